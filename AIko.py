@@ -6,11 +6,14 @@ Objects for interaction with custom-made AI characters.
 Requirements:
 - AIkoVoice.py (100 or greater) and its requirements
 - AIkoINIhandler.py (29 or greater)
-- AikoSentiment.py
+- AikoSentiment.py (003 or greater)
+- AIkoTracing.py (001 or greater)
+- AIkoMatcher.py (001 or greater)
 
 pip install:
 - openai
-- func_timeout
+- aiohttp
+- tiktoken (optional, token counts are roughly estimated without it)
 
 txt files:
 - 0.txt
@@ -49,34 +52,114 @@ Changelog:
 - Added fom property to FOM class, for a quick way of checking the current mood.
 168beta:
 - AIko now knows the date and time.
+169beta:
+- Added generate_gpt_completion_stream function, which uses the streamed chat API and yields the completion one
+sentence at a time.
+- Added interact_stream method to AIko class, a streaming variant of interact.
+170beta:
+- MessageList is now backed by a deque, so adding items no longer shifts the whole list.
+- Added clear method and len() support to MessageList.
+171beta:
+- Added count_tokens and count_message_tokens functions, which estimate token counts with a local tokenizer.
+- Context's build_context now trims the oldest memories, then the oldest side prompts, to keep the prompt under a
+configurable token budget.
+- Estimated prompt size is now available through AIko's prompt_tokens property and written to the log.
+172beta:
+- Added CompletionClient class, an asyncio based OpenAI client which reuses one pooled HTTP session, applies
+per-attempt timeouts, backs off exponentially (with jitter) on rate limits and can hedge slow requests.
+- generate_gpt_completion_timeout and generate_gpt_completion_stream now request completions through the shared
+CompletionClient. func_timeout is no longer required.
+173beta:
+- FrameOfMind's update_score now submits messages to the shared SentimentService and applies their scores once the
+results arrive, returning a Future. AIko no longer starts a thread per message for it.
+174beta:
+- Added MoodUpdater class, a bounded executor for FrameOfMind updates with a configurable queue size and overflow
+policy (drop oldest, drop newest or coalesce).
+- AIko now routes mood updates through its MoodUpdater, and flushes it before updating her mood, so the personality
+is picked with the current message's sentiment accounted for.
+- FrameOfMind's update_score Future is now only done once the score has been updated.
+175beta:
+- Added LogWriter class, which buffers log entries in memory and writes them from a background thread, either
+periodically or once enough text is buffered. Logging no longer does disk I/O on the thread that called it.
+- Log can also write each interaction as a JSON line to a .jsonl file next to the text log (configurable).
+- Added flush_log method to AIko, so buffered entries can be written before the app is closed.
+176beta:
+- Prompt building and completion latencies (and the time to the first streamed sentence) are now recorded by the
+tracer, and marked on the current message's span.
+177beta:
+- Added PromptRepository class, which loads prompt files once, keeps their parsed text in memory and re-reads the ones
+which changed (checked by modification time on a background thread). Edited personalities and keywords now apply
+without restarting.
+- Context and AIko's keywords now read from the shared PromptRepository instead of reading files at construction.
+- Context now keeps the current personality's key, so check_personality no longer looks it up by content.
+- Fixed gather_txts building keys out of the DirEntry's representation. Keys are now the file's name without extension
+or spaces, in uppercase, and only .txt files are gathered.
+178beta:
+- BlackBox and has_keyword now use compiled keyword matchers (AIkoMatcher.py), so matching a message takes a single
+pass over it regardless of how many keywords there are. has_keyword now matches the longest keyword the message starts
+with.
+179beta:
+- Added optional prompts parameter to AIko, so characters streaming from the same process can each read their prompts
+from their own folder.
+- Log files created within the same second no longer overwrite each other, as each gets a numbered suffix.
+180beta:
+- Background threads are now named after what they do, so they can be told apart when profiling.
+181beta:
+- Importing AIko.py no longer has side effects: the config (and the INI file's missing values), the OpenAI key and the
+openai package are only loaded when first needed. Settings are read through AIkoINIhandler's load_config.
+- generate_gpt_completion_timeout and generate_gpt_completion_stream default to the completion client's timeout.
+- Closing the CompletionClient cancels the requests still in flight, so threads reading their streams are no longer
+left waiting forever.
+182beta:
+- Fixed completions raising UnboundLocalError instead of failing when no attempt was made. completion_attempts is now
+at least 1.
 ===================================================================
 """
 # ----------------- Imports -----------------
-import openai  # gpt3
-from threading import Thread, Lock  # thread safe Score class
+import asyncio  # completion client
+import json  # parsing streamed completions
+import random  # backoff jitter
+import time  # measuring completion latency
+from queue import Queue  # bridging streamed completions to threads
+from threading import Thread, Lock, Condition  # thread safe Score class
+from concurrent.futures import Future, wait  # mood updates
+from collections import deque  # MessageList
 from datetime import datetime  # for logging
-from configparser import ConfigParser  # ini file config
-from AikoSentiment import sentiment_analysis  # for the mood system
-from func_timeout import func_timeout, FunctionTimedOut  # for handling openAI ratelimit errors
+from AikoSentiment import get_sentiment_service  # for the mood system
+from AIkoTracing import get_tracer  # latency tracing
+from AIkoMatcher import Matcher  # keyword matching
 import os  # gathering files from folder
-from AIkoINIhandler import handle_ini
+import atexit  # flushing logs on exit
+import re  # splitting streamed completions into sentences
+from functools import lru_cache  # caching token counts
+from AIkoINIhandler import load_config
 from datetime import datetime
 
 # -------------------------------------------
 # PLEASE set it if making a new build. for logging purposes
-build_version = 'Aiko167beta'.upper()
+build_version = 'Aiko182beta'.upper()
 
 # ------------- Set variables ---------------
-# reads config file
-handle_ini()
+# settings are read from the shared config (see AIkoINIhandler's load_config) when first needed, so importing this
+# script doesn't touch the INI file or the keys
 
-config = ConfigParser()
-config.read('AIkoPrefs.ini')
-# Sets variable according to config
-completion_timeout = config.getint('GENERAL', 'completion_timeout')
-model = config.get('GENERAL', 'model')
+# tokenizer used for counting tokens, loaded on first use
+tokenizer = None
 
-openai.api_key = open('keys/key_openai.txt', 'r').read().strip()
+# client shared by every completion request, created on first use
+completion_client = None
+completion_client_lock = Lock()
+
+# writer shared by every log, created on first use
+log_writer = None
+log_writer_lock = Lock()
+
+# repository shared by everything reading prompt files, created on first use
+prompt_repository = None
+prompt_repository_lock = Lock()
+
+# matches the end of a sentence (terminal punctuation, optional closing quotes/brackets and the following whitespace)
+sentence_end = re.compile(r'[.!?…]+["\')\]]*\s+')
 
 
 # -------------------------------------------
@@ -118,6 +201,14 @@ def txt_to_string(filename: str):
     return string
 
 
+def read_openai_key():
+    """
+    Returns the OpenAI API key in keys/key_openai.txt.
+    """
+    with open('keys/key_openai.txt', 'r') as key_file:
+        return key_file.read().strip()
+
+
 def generate_gpt_completion(messages: list):
     """
     Generates a GPT completion by providing a list of messages.
@@ -136,10 +227,12 @@ def generate_gpt_completion(messages: list):
                 - completion_tokens (int): The number of tokens used in the completion.
                 - total_tokens (int): The total number of tokens used.
     """
+    import openai
 
+    openai.api_key = read_openai_key()
     try:
         request = openai.ChatCompletion.create(
-            model=model,
+            model=load_config().get('GENERAL', 'model'),
             messages=messages
         )
 
@@ -156,24 +249,186 @@ def generate_gpt_completion(messages: list):
         return '', (0, 0, 0)
 
 
-def generate_gpt_completion_timeout(messages: list, timeout: int = completion_timeout):
+def get_completion_client():
+    """
+    Returns the CompletionClient shared by every completion request, creating it on first use.
+    """
+    global completion_client
+
+    with completion_client_lock:
+        if completion_client is None:
+            config = load_config()
+            completion_client = CompletionClient(
+                api_key=read_openai_key(),
+                api_base=config.get('GENERAL', 'api_base'),
+                model=config.get('GENERAL', 'model'),
+                attempt_timeout=config.getint('GENERAL', 'completion_timeout'),
+                max_attempts=max(1, config.getint('GENERAL', 'completion_attempts')),
+                hedge_percentile=config.getfloat('GENERAL', 'hedge_percentile')
+            )
+
+        return completion_client
+
+
+def get_log_writer():
+    """
+    Returns the LogWriter shared by every log, creating it on first use.
+    """
+    global log_writer
+
+    with log_writer_lock:
+        if log_writer is None:
+            config = load_config()
+            log_writer = LogWriter(config.getfloat('GENERAL', 'log_flush_interval'),
+                                   config.getint('GENERAL', 'log_flush_size'))
+            # buffered entries are written on a normal exit. os._exit skips this, so call flush before using it
+            atexit.register(log_writer.flush)
+
+        return log_writer
+
+
+def get_prompt_repository():
     """
-    Requests a completion under a set timeout in seconds.
-    If the first request fails to return a value under the set time out value, a second request is made.
-    Useful for circumventing RateLimit errors when the OpenAI API is overloaded.
+    Returns the PromptRepository shared by everything reading prompt files, creating it on first use.
+    """
+    global prompt_repository
+
+    with prompt_repository_lock:
+        if prompt_repository is None:
+            prompt_repository = PromptRepository('prompts', load_config().getfloat('GENERAL', 'prompt_reload_interval'))
+
+        return prompt_repository
+
+
+def generate_gpt_completion_timeout(messages: list, timeout: int = None):
+    """
+    Requests a completion through the shared CompletionClient. Each attempt is given a set timeout in seconds, and
+    failed attempts (timeouts, rate limits and server errors) are retried with exponential backoff.
 
     Returns a tuple containing:
     - Str, Completion text
     - Tuple, usage data in tokens.
 
     """
+    return get_completion_client().complete(messages, timeout)
 
-    try:
-        completion_request = func_timeout(timeout, generate_gpt_completion, kwargs={'messages': messages})
-    except FunctionTimedOut:
-        completion_request = generate_gpt_completion(messages)
 
-    return completion_request
+def get_tokenizer():
+    """
+    Returns the local tokenizer for the model in use, loading it on first use. Returns None if tiktoken isn't
+    installed.
+    """
+    global tokenizer
+
+    if tokenizer is None:
+        try:
+            import tiktoken
+        except ImportError:
+            return None
+
+        try:
+            tokenizer = tiktoken.encoding_for_model(load_config().get('GENERAL', 'model'))
+        except KeyError:
+            tokenizer = tiktoken.get_encoding('cl100k_base')
+
+    return tokenizer
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str):
+    """
+    Counts the tokens in a text using the model's tokenizer. Results are cached, as the same memories and side prompts
+    are counted again for every request.
+
+    Falls back to a rough estimate (4 characters per token) if tiktoken isn't installed.
+    """
+    encoding = get_tokenizer()
+
+    if encoding is None:
+        return (len(text) + 3) // 4
+
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages: list, reply_priming: bool = True):
+    """
+    Estimates how many prompt tokens a list of messages will take up.
+
+    Args:
+        messages (list): A list of {"role": <role>, "content": <content>} dictionaries.
+        reply_priming (bool): Whether to include the tokens every reply is primed with. Should be False when counting
+            only part of a prompt.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    # every message takes up 3 tokens for its framing, plus 1 for its role
+    tokens = sum(4 + count_tokens(message['content']) for message in messages)
+
+    return tokens + 3 if reply_priming else tokens
+
+
+def split_sentences(text: str):
+    """
+    Splits the complete sentences off the start of a text.
+
+    Args:
+        text (str): The text to be split.
+
+    Returns:
+        tuple: A tuple containing:
+            - sentences (list): The complete sentences found in the text, stripped of surrounding whitespace.
+            - remainder (str): The rest of the text, which does not end a sentence yet.
+    """
+    sentences = []
+    start = 0
+
+    for match in sentence_end.finditer(text):
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+
+    return sentences, text[start:]
+
+
+def generate_gpt_completion_stream(messages: list, timeout: int = None):
+    """
+    Generates a GPT completion using the streamed chat API (through the shared CompletionClient), yielding it one
+    sentence at a time as soon as each sentence is complete.
+
+    Args:
+        messages (list): A list of dictionaries representing the messages in the conversation. Follows the same
+            format as generate_gpt_completion.
+        timeout (int): How many seconds to wait for the API before giving up on the request.
+
+    Yields:
+        str: The next sentence of the completion.
+
+    Returns:
+        tuple: Once exhausted, the generator returns the same (completion, token_usage) tuple as
+            generate_gpt_completion. The streamed API does not report usage, so completion tokens are counted from the
+            received chunks and prompt tokens are reported as 0.
+    """
+    completion = ''
+    buffer = ''
+    completion_tokens = 0
+
+    for content in get_completion_client().stream(messages, timeout):
+        completion_tokens += 1
+        completion += content
+        buffer += content
+
+        # yields sentences as soon as they are complete
+        sentences, buffer = split_sentences(buffer)
+        for sentence in sentences:
+            yield sentence
+
+    # yields whatever is left of the completion
+    if buffer.strip():
+        yield buffer.strip()
+
+    return completion.strip(), (0, completion_tokens, completion_tokens)
 
 
 def txt_to_list(txt_filename: str):
@@ -220,28 +475,290 @@ def gather_txts(directory: str):
     """
     txts = {}
 
-    # adds each txt file in folder to dictionary
-    for filename in os.scandir(directory):
-        # formats the filename to be added as the dictionary's key
-        txt_name = str(filename)
-        txt_name = txt_name[1:-1]
-        txt_name = txt_name.replace('DirEntry', '')
-        txt_name = txt_name.replace('.txt', '')
-        txt_name = txt_name.replace("'", '')
-        txt_name = txt_name.replace(' ', '')
-        txt_name = txt_name.upper()
-
-        # adds the contents of the txt to the dictionary using the filename as key
-        contents = txt_to_string(filename)
-        txts[txt_name] = contents
+    # adds each txt file in folder to dictionary, using the formatted filename as key
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith('.txt'):
+            txts[txt_key(entry.name)] = txt_to_string(entry.path)
 
     return txts
 
 
+def txt_key(filename: str):
+    """
+    Formats a text file's name into the key used for it by gather_txts and PromptRepository (uppercase, without
+    file extension or spaces). EG: 'prompts/keywords/my keyword.txt' -> 'MYKEYWORD'.
+    """
+    return os.path.splitext(os.path.basename(filename))[0].replace(' ', '').upper()
+
+
 # -------------------------------------------
 
 
 # ----------------- Classes -------------------
+class CompletionError(Exception):
+    """
+    Raised when a completion attempt fails in a way that may succeed if retried.
+    """
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CompletionClient:
+    """
+    An asyncio based client for OpenAI's chat completion API. Runs its own event loop on a separate thread and reuses a
+    single pooled HTTP session for every request, so connections are kept alive between completions.
+
+    Each attempt has its own timeout. Timeouts, rate limits and server errors are retried with exponential backoff and
+    full jitter (honoring the Retry-After header when present). Requests can also be hedged: once an attempt takes
+    longer than a given percentile of recent latencies, a duplicate request is sent and whichever answers first is used.
+
+    Parameters:
+        api_key (str): OpenAI API key.
+        api_base (str): Base URL of the API. Can point to a local stub server.
+        model (str): The GPT model to be used.
+        attempt_timeout (float): Seconds before an attempt is given up on.
+        max_attempts (int): Maximum number of attempts per completion.
+        backoff_base (float): Backoff ceiling for the first retry, in seconds. Doubles every retry.
+        backoff_max (float): Maximum backoff ceiling, in seconds.
+        hedge_percentile (float): Latency percentile (0-100) after which a hedged request is sent. 0 disables hedging.
+        hedge_min_samples (int): How many latencies need to be recorded before requests start being hedged.
+
+    Methods:
+        complete(messages : list, timeout : float) -> tuple:
+            Requests a completion, blocking until it is done. Returns the same tuple as generate_gpt_completion.
+        stream(messages : list, timeout : float):
+            Requests a streamed completion, returning a generator of content deltas.
+        close():
+            Closes the HTTP session and stops the event loop.
+    """
+
+    def __init__(self, api_key: str, api_base: str = 'https://api.openai.com/v1', model: str = 'gpt-3.5-turbo',
+                 attempt_timeout: float = 10, max_attempts: int = 3, backoff_base: float = 0.5,
+                 backoff_max: float = 8.0, hedge_percentile: float = 95, hedge_min_samples: int = 20):
+        import aiohttp
+
+        self.__aiohttp = aiohttp
+        self.__url = f'{api_base.rstrip("/")}/chat/completions'
+        self.__headers = {'Authorization': f'Bearer {api_key}'}
+        self.__model = model
+
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+        # latencies of recent successful attempts, for hedging
+        self.__latencies = deque(maxlen=200)
+
+        self.__session = None
+        self.__loop = asyncio.new_event_loop()
+        Thread(target=self.__loop.run_forever, name='completion-client', daemon=True).start()
+
+    # ------------------------------ HELPERS
+
+    def __get_session(self):
+        # created lazily, as the session must be created inside the running event loop
+        if self.__session is None or self.__session.closed:
+            self.__session = self.__aiohttp.ClientSession(
+                headers=self.__headers,
+                connector=self.__aiohttp.TCPConnector(limit=20, keepalive_timeout=60)
+            )
+        return self.__session
+
+    def __backoff(self, attempt: int, retry_after: float = None):
+        # exponential backoff with full jitter
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def __hedge_delay(self):
+        # returns how long to wait for an attempt before hedging it, or None if hedging is disabled
+        if self.hedge_percentile <= 0 or len(self.__latencies) < self.hedge_min_samples:
+            return None
+
+        latencies = sorted(self.__latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))
+        return latencies[index]
+
+    async def __check_response(self, response):
+        if response.status == 429:
+            retry_after = response.headers.get('Retry-After')
+            raise CompletionError('Rate limited.', float(retry_after) if retry_after else None)
+        if response.status >= 500:
+            raise CompletionError(f'Server error {response.status}.')
+        if response.status >= 400:
+            raise ValueError(f'Request failed with status {response.status}: {await response.text()}')
+
+    # ------------------------------ REQUESTS
+
+    async def __attempt(self, payload: dict, timeout: float):
+        start = time.monotonic()
+
+        try:
+            async with self.__get_session().post(
+                    self.__url, json=payload, timeout=self.__aiohttp.ClientTimeout(total=timeout)) as response:
+                await self.__check_response(response)
+                data = await response.json()
+        except (asyncio.TimeoutError, self.__aiohttp.ClientError) as e:
+            raise CompletionError(f'{type(e).__name__}: {e}')
+
+        self.__latencies.append(time.monotonic() - start)
+
+        usage = data.get('usage', {})
+        completion = data['choices'][0]['message']['content']
+        token_usage = (usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0), usage.get('total_tokens', 0))
+
+        return completion, token_usage
+
+    async def __hedged_attempt(self, payload: dict, timeout: float):
+        first = asyncio.ensure_future(self.__attempt(payload, timeout))
+
+        hedge_delay = self.__hedge_delay()
+        if hedge_delay is None:
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+        if done:
+            return first.result()
+
+        # the first attempt is slower than usual, so a duplicate is sent and the fastest one is used
+        pending = {first, asyncio.ensure_future(self.__attempt(payload, timeout))}
+        error = None
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for task_left in pending:
+                        task_left.cancel()
+                    return task.result()
+                error = task.exception()
+
+        raise error
+
+    async def complete_async(self, messages: list, timeout: float = None):
+        """
+        Coroutine version of complete. Must run on the client's event loop.
+        """
+        timeout = self.attempt_timeout if timeout is None else timeout
+        payload = {'model': self.__model, 'messages': messages}
+
+        error = None
+        for attempt in range(self.max_attempts):
+            try:
+                return await self.__hedged_attempt(payload, timeout)
+            except CompletionError as e:
+                error = e
+            except ValueError as e:
+                # the request itself is invalid, so retrying won't help
+                error = e
+                break
+
+            if attempt < self.max_attempts - 1:
+                await asyncio.sleep(self.__backoff(attempt, error.retry_after))
+
+        print('Aiko.py:')
+        print(f'Completion failed: {error}')
+        print()
+
+        return '', (0, 0, 0)
+
+    async def __stream_async(self, payload: dict, timeout: float, output: Queue):
+        # puts content deltas in the output queue, followed by None once the stream is over
+        received = False
+        error = None
+
+        try:
+            for attempt in range(self.max_attempts):
+                try:
+                    async with self.__get_session().post(
+                            self.__url, json=payload,
+                            timeout=self.__aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)) as response:
+                        await self.__check_response(response)
+
+                        async for line in response.content:
+                            line = line.decode('utf-8').strip()
+                            if not line.startswith('data:'):
+                                continue
+
+                            data = line[len('data:'):].strip()
+                            if data == '[DONE]':
+                                return
+
+                            content = json.loads(data)['choices'][0]['delta'].get('content')
+                            if content:
+                                received = True
+                                output.put(content)
+                        return
+
+                except (CompletionError, ValueError, asyncio.TimeoutError, self.__aiohttp.ClientError) as e:
+                    error = e
+
+                # content can't be taken back, so the stream is only retried if nothing has been received yet
+                if received or isinstance(error, ValueError):
+                    break
+
+                if attempt < self.max_attempts - 1:
+                    await asyncio.sleep(self.__backoff(attempt, getattr(error, 'retry_after', None)))
+
+            print('Aiko.py:')
+            print(f'Streamed completion failed: {error}')
+            print()
+        finally:
+            output.put(None)
+
+    # ------------------------------ PUBLIC
+
+    def complete(self, messages: list, timeout: float = None):
+        """
+        Requests a completion, blocking until it is done. Thread safe.
+
+        Args:
+            messages (list): Messages in the same format as generate_gpt_completion's.
+            timeout (float, optional): Per attempt timeout. Uses the client's attempt_timeout if not given.
+
+        Returns:
+            tuple: The completion text and a (prompt_tokens, completion_tokens, total_tokens) tuple. An empty
+            completion and zeroed usage are returned if every attempt fails.
+        """
+        return asyncio.run_coroutine_threadsafe(self.complete_async(messages, timeout), self.__loop).result()
+
+    def stream(self, messages: list, timeout: float = None):
+        """
+        Requests a streamed completion. Returns a generator which yields the completion's content deltas as soon as
+        they arrive. Attempts are retried only if they fail before any content has been received.
+        """
+        timeout = self.attempt_timeout if timeout is None else timeout
+        payload = {'model': self.__model, 'messages': messages, 'stream': True}
+
+        output = Queue()
+        asyncio.run_coroutine_threadsafe(self.__stream_async(payload, timeout, output), self.__loop)
+
+        while True:
+            content = output.get()
+            if content is None:
+                return
+            yield content
+
+    def close(self):
+        async def close_session():
+            # requests still in flight are cancelled, so streams waiting on them end instead of hanging
+            pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+            if self.__session is not None:
+                await self.__session.close()
+
+        asyncio.run_coroutine_threadsafe(close_session(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+
+
 class MessageList:
     """
     A class that holds a limited list of messages meant for prompting GPT.
@@ -251,15 +768,21 @@ class MessageList:
 
     Methods:
         add_item(item : str, role : str):
-            Removes the oldest item in the list and appends a new one.
+            Removes the oldest item in the list (if full) and appends a new one.
+        delete_item(index : int):
+            Removes the item at the given index.
+        clear():
+            Removes all items.
         get_items() -> list:
             Returns the populated items of the list.
         is_empty() -> bool:
             Whether items have been added to the list or not.
     """
+    __slots__ = ('__message_list__',)
 
     def __init__(self, slots: int):
-        self.__message_list__ = create_limited_list(slots)
+        # the oldest item is discarded automatically once the deque is full
+        self.__message_list__ = deque(maxlen=slots)
 
     def __str__(self):
         items = self.get_items()
@@ -270,47 +793,48 @@ class MessageList:
 
         return '\n'.join(items_as_strings)
 
+    def __len__(self):
+        return len(self.__message_list__)
+
     def add_item(self, item: str, role: str):
         """
-          Removes the oldest item in the list and appends a new one.
+          Removes the oldest item in the list (if full) and appends a new one.
 
           Attributes:
               item (str): The message to be added.
               role (str): The role the message will be under when requesting a completion. Can be either "system",
               "user" or "assistant".
         """
-        self.__message_list__.pop(0)
         self.__message_list__.append({"role": role, "content": item})
 
     def delete_item(self, index: int):
-        self.__message_list__[index] = ''
+        """
+          Removes the item at the given index. Items after it are shifted back by one.
+        """
+        del self.__message_list__[index]
+
+    def clear(self):
+        self.__message_list__.clear()
 
     def get_items(self) -> list:
         """
           Returns the populated items of the list.
         """
-        populated_items = []
-
-        for item in self.__message_list__:
-            if item != '':
-                populated_items.append(item)
-        return populated_items
+        return list(self.__message_list__)
 
     def append_items(self, existing_list: list):
         """
           Appends the populated items of the lists to an existing list.
           USE WITH CAUTION: This method will MODIFY the list you give it as a parameter. It has no return value
         """
-        for item in self.__message_list__:
-            if item != '':
-                existing_list.append(item)
+        existing_list.extend(self.__message_list__)
 
     def is_empty(self) -> bool:
-        return self.__message_list__[-1] == ''
+        return len(self.__message_list__) == 0
 
     def get_reference(self):
         """
-        Returns a reference to this class' private list object. Useful for display/consulting needs - if you want to
+        Returns a reference to this class' private deque object. Useful for display/consulting needs - if you want to
         modify the list, use the class' built in methods.
         """
         return self.__message_list__
@@ -322,63 +846,216 @@ class BlackBox:
         self.personal_key_word = ['you']
         self.preference_key_word = ['favorite', 'like', 'where', 'old']
 
+        # finds words of both lists in a single pass, the payload being the list each word belongs to
+        self.__matcher = Matcher({
+            **{word: 'preference' for word in self.preference_key_word},
+            **{word: 'personal' for word in self.personal_key_word},
+        }, ignore_case=True)
+
     def message_meets_criteria(self, message: str):
-        l_msg = message.lower()
         # if 'what is' in message.lower():
-        if any(x in l_msg for x in self.personal_key_word) and any(y in l_msg for y in self.preference_key_word):
-            return True
+        found = set()
+        for match in self.__matcher.find_all(message):
+            found.add(match.payload)
+            # needs a word from each list
+            if len(found) == 2:
+                return True
 
         return False
 
 
+class PromptRepository:
+    """
+    Loads prompt files once and keeps their parsed (comment stripped, see txt_to_string) text in memory. Every
+    reload_interval seconds, a background thread checks the loaded files' modification times and re-reads only the ones
+    which changed, so edits apply without restarting and reading a prompt never touches the disk.
+
+    Parameters:
+        root (str): Folder containing the prompt files. Paths given to the methods are relative to it.
+        reload_interval (float): Seconds between checks for changed files. 0 disables reloading.
+
+    Public Methods:
+    - get(path : str) -> str: Returns a file's parsed text.
+    - directory(path : str) -> dict: Returns the parsed text of every .txt file in a folder, keyed like gather_txts.
+    The returned dictionary is replaced (not modified) when a file changes, so it should not be kept around.
+    - reload(): Re-reads loaded files which changed, and picks up files added to (or removed from) loaded folders.
+    """
+    def __init__(self, root: str = 'prompts', reload_interval: float = 2.0):
+        self.root = root
+
+        # path: (modification time, text)
+        self.__files = {}
+        # path: (list of file paths, {key: text})
+        self.__directories = {}
+        self.__lock = Lock()
+
+        if reload_interval > 0:
+            Thread(target=self.__watch, args=(reload_interval,), name='prompt-watcher', daemon=True).start()
+
+    def __watch(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.reload()
+
+    def __load_file(self, path: str):
+        # (re)reads the file if its modification time changed, returns whether it did
+        full_path = os.path.join(self.root, path)
+        try:
+            mtime = os.stat(full_path).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        cached = self.__files.get(path)
+        if cached is not None and cached[0] == mtime:
+            return False
+
+        self.__files[path] = (mtime, txt_to_string(full_path))
+
+        if cached is not None:
+            print('Aiko.py:')
+            print(f'Reloaded prompt file {path}')
+            print()
+        return True
+
+    def __load_directory(self, path: str):
+        try:
+            names = sorted(entry.name for entry in os.scandir(os.path.join(self.root, path))
+                           if entry.is_file() and entry.name.endswith('.txt'))
+        except OSError as e:
+            print('Aiko.py:')
+            print(f'Could not read prompt folder {path}: {e}')
+            print()
+            names = []
+
+        files = [os.path.join(path, name) for name in names]
+        changed = [self.__load_file(file) for file in files]
+
+        cached = self.__directories.get(path)
+        if cached is not None and cached[0] == files and not any(changed):
+            return
+
+        if cached is not None:
+            # forgets removed files
+            for file in set(cached[0]) - set(files):
+                del self.__files[file]
+
+        self.__directories[path] = (files, {txt_key(file): self.__files[file][1] for file in files})
+
+    def get(self, path: str):
+        cached = self.__files.get(path)
+        if cached is None:
+            with self.__lock:
+                self.__load_file(path)
+                cached = self.__files[path]
+
+        return cached[1]
+
+    def directory(self, path: str):
+        cached = self.__directories.get(path)
+        if cached is None:
+            with self.__lock:
+                self.__load_directory(path)
+                cached = self.__directories[path]
+
+        return cached[1]
+
+    def reload(self):
+        with self.__lock:
+            in_directories = set()
+            for path in list(self.__directories):
+                self.__load_directory(path)
+                in_directories.update(self.__directories[path][0])
+
+            for path in list(self.__files):
+                if path not in in_directories:
+                    self.__load_file(path)
+
+
 class Context:
+    """
+    Holds and builds the character's context.
+
+    Parameters:
+        scenario (str): The starting scenario.
+        sp_slots (int): The max number of side prompt slots.
+        mem_slots (int): The max number of context slots.
+        token_budget (int, optional): Max number of prompt tokens. 0 for no limit. Read from the config if not given.
+        prompts (PromptRepository, optional): Where personalities and the profile are read from. Uses the shared
+        repository if not given.
+    """
 
-    def __init__(self, scenario: str, sp_slots: int = 5, mem_slots: int = 10):
-        self.__personalities = gather_txts('prompts/personalities')
-        self.__personality = self.__personalities['0']
+    def __init__(self, scenario: str, sp_slots: int = 5, mem_slots: int = 10, token_budget: int = None,
+                 prompts: PromptRepository = None):
+        self.__prompts = get_prompt_repository() if prompts is None else prompts
+        self.__personality = '0'
 
         self.context = MessageList(mem_slots)
         self.side_prompts = MessageList(sp_slots)
         self.scenario = MessageList(1)
 
         self.scenario.add_item(scenario, "system")
-        self.__profile = txt_to_string('prompts/profile.txt')
 
-    def __append_message_lists(self, list_to_append: list):
-        self.scenario.append_items(list_to_append)
-        self.side_prompts.append_items(list_to_append)
-        self.context.append_items(list_to_append)
+        if token_budget is None:
+            token_budget = load_config().getint('GENERAL', 'context_token_budget')
+        self.token_budget = token_budget
+        self.last_prompt_tokens = 0
 
     @property
     def personality_count(self):
-        return len(self.__personalities)
+        return len(self.__prompts.directory('personalities'))
 
-    def build_context(self, use_profile: bool = False):
+    def build_context(self, use_profile: bool = False, reserved_tokens: int = 0):
         """
           Builds context dictionary list with the currently relevant information.
+
+          If a token budget is set, the oldest memories and then the oldest side prompts are left out until the
+          context fits in it.
+
+          Args:
+              use_profile (bool): Whether to include the character's profile.
+              reserved_tokens (int): Tokens to keep free in the budget for messages which will be appended later.
         """
-        messages = [{"role": "system", "content": self.__personality}]
-        self.__append_message_lists(messages)
+        personalities = self.__prompts.directory('personalities')
+        # falls back to the default personality if the current one's file has been removed
+        personality = personalities.get(self.__personality, personalities.get('0', ''))
+
+        head = [{"role": "system", "content": personality}]
+        self.scenario.append_items(head)
 
+        side_prompts = self.side_prompts.get_items()
+        memory = self.context.get_items()
+
+        tail = []
         if use_profile:
-            messages.append({"role": "system", "content": self.__profile})
+            tail.append({"role": "system", "content": self.__prompts.get('profile.txt')})
 
         # adds date and time to context
-        current_time = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
-        messages.append({"role": "system", "content": f'Current time (d-m-y): {datetime.now()}'})
+        tail.append({"role": "system", "content": f'Current time (d-m-y): {datetime.now()}'})
+
+        tokens = count_message_tokens(head + side_prompts + memory + tail) + reserved_tokens
 
-        return messages
+        if self.token_budget > 0:
+            # trims the oldest memories first, then the oldest side prompts
+            for trimmable in (memory, side_prompts):
+                trimmed = 0
+                while tokens > self.token_budget and trimmed < len(trimmable):
+                    tokens -= count_message_tokens([trimmable[trimmed]], reply_priming=False)
+                    trimmed += 1
+                del trimmable[:trimmed]
+
+        self.last_prompt_tokens = tokens
+
+        return head + side_prompts + memory + tail
 
     def switch_personality(self, personality: str):
         personality = personality.upper()
-        if personality not in self.__personalities:
+        if personality not in self.__prompts.directory('personalities'):
             raise ValueError('Invalid personality.')
 
-        self.__personality = self.__personalities[personality]
+        self.__personality = personality
 
     def check_personality(self):
-        # looks for personality key value matching current personality in the personalities dictionary and returns it
-        return list(self.__personalities.keys())[list(self.__personalities.values()).index(self.__personality)]
+        return self.__personality
 
 
 class Score:
@@ -396,9 +1073,69 @@ class Score:
         return self.__score
 
 
+class LogWriter:
+    """
+    Buffers text in memory and appends it to files from a background thread, so writing to a log doesn't block the
+    thread that called it.
+
+    Parameters:
+        flush_interval (float): Maximum seconds text stays buffered before being written.
+        flush_size (int): Buffered characters which trigger a write before flush_interval is reached.
+
+    Methods:
+        write(path : str, text : str):
+            Buffers text to be appended to the file at path. Text for the same file is written in order.
+        flush():
+            Writes all buffered text, blocking until it is done.
+    """
+    def __init__(self, flush_interval: float = 1.0, flush_size: int = 8192):
+        self.__flush_interval = flush_interval
+        self.__flush_size = flush_size
+
+        self.__buffers = {}
+        self.__buffered = 0
+        self.__condition = Condition()
+        # keeps the worker and flush calls from writing at the same time, which could reorder entries
+        self.__write_lock = Lock()
+
+        Thread(target=self.__loop, name='log-writer', daemon=True).start()
+
+    def __loop(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__buffered >= self.__flush_size, self.__flush_interval)
+            self.flush()
+
+    def write(self, path: str, text: str):
+        with self.__condition:
+            self.__buffers.setdefault(path, []).append(text)
+            self.__buffered += len(text)
+            if self.__buffered >= self.__flush_size:
+                self.__condition.notify()
+
+    def flush(self):
+        with self.__write_lock:
+            with self.__condition:
+                buffers, self.__buffers = self.__buffers, {}
+                self.__buffered = 0
+
+            for path, texts in buffers.items():
+                # writes in utf-8 encoding to avoid special characters such as emojis causing exceptions
+                try:
+                    with open(path, 'a', encoding='utf-8') as file:
+                        file.write(''.join(texts))
+                except OSError as e:
+                    print('Aiko.py:')
+                    print(f'Could not write to {path}: {e}')
+                    print()
+
+
 class Log:
-    def __init__(self, personality_file: str):
+    def __init__(self, personality_file: str, jsonl: bool = False):
+        self.__writer = get_log_writer()
         self.__log = self.__create_log(personality_file)
+        # structured log, with one JSON object per interaction
+        self.__jsonl = os.path.splitext(self.__log)[0] + '.jsonl' if jsonl else None
 
     def __create_log(self, personality_file: str):
         """
@@ -417,12 +1154,17 @@ class Log:
         time = time.replace(' ', '_').replace('/', '-').replace(':', '-')
 
         log_filename = r'log/{}.txt'.format(time)
+        # several characters (or a quick restart) can create logs within the same second
+        suffix = 1
+        while os.path.exists(log_filename):
+            suffix += 1
+            log_filename = r'log/{}_{}.txt'.format(time, suffix)
 
-        with open(r'log/{}.txt'.format(time), 'w') as log:
+        with open(log_filename, 'w') as log:
             log.write(f'{hour}\n')
             log.write('\n')
             log.write(f'AIKO.PY BUILD VERSION: {build_version} \n\n')
-            log.write(f'GPT MODEL IN USE: {model} \n\n')
+            log.write(f'GPT MODEL IN USE: {load_config().get("GENERAL", "model")} \n\n')
             log.write(f'{personality_file}: \n\n')
             with open(personality_file, 'r') as aiko_txt:
                 for line in aiko_txt:
@@ -434,29 +1176,54 @@ class Log:
 
         return log_filename
 
-    def update_log(self, user_string: str, completion_data: tuple):
+    def update_log(self, user_string: str, completion_data: tuple, estimated_prompt_tokens: int = None):
         """
           Updates the log file with the user's input and the generated output.
 
           Args:
               user_string (str): The user's input message.
               completion_data (tuple): A tuple containing the generated output and token usage information.
+              estimated_prompt_tokens (int, optional): The prompt size estimated before the request was sent.
         """
         time = datetime.now()
         hour = f'[{time.hour}:{time.minute}:{time.second}]'
 
         self.__session_token_usage__ += completion_data[1][2]
 
-        # writes to log in utf-8 encoding to avoid special characters such as emojis causing exceptions
-        with open(self.__log, 'a', encoding="utf-8") as log:
-            log.write(f'{hour}\n')
-            log.write('\n')
-            log.write(f'Prompt: {user_string} --TOKENS USED: {completion_data[1][0]}\n')
-            log.write(f'Output: {completion_data[0]} --TOKENS USED: {completion_data[1][1]}\n')
-            log.write(f'Total tokens used: {completion_data[1][2]}\n')
-            log.write('\n')
-            log.write(f'Tokens used this session: {self.__session_token_usage__}\n')
-            log.write('\n')
+        # the entry is buffered and written by the log writer in the background
+        entry = [
+            f'{hour}\n',
+            '\n',
+            f'Prompt: {user_string} --TOKENS USED: {completion_data[1][0]}\n',
+        ]
+        if estimated_prompt_tokens is not None:
+            entry.append(f'Estimated prompt tokens: {estimated_prompt_tokens}\n')
+        entry += [
+            f'Output: {completion_data[0]} --TOKENS USED: {completion_data[1][1]}\n',
+            f'Total tokens used: {completion_data[1][2]}\n',
+            '\n',
+            f'Tokens used this session: {self.__session_token_usage__}\n',
+            '\n',
+        ]
+        self.__writer.write(self.__log, ''.join(entry))
+
+        if self.__jsonl is not None:
+            self.__writer.write(self.__jsonl, json.dumps({
+                'time': time.isoformat(timespec='seconds'),
+                'prompt': user_string,
+                'output': completion_data[0],
+                'prompt_tokens': completion_data[1][0],
+                'estimated_prompt_tokens': estimated_prompt_tokens,
+                'completion_tokens': completion_data[1][1],
+                'total_tokens': completion_data[1][2],
+                'session_tokens': self.__session_token_usage__,
+            }, ensure_ascii=False) + '\n')
+
+    def flush(self):
+        """
+          Writes every buffered log entry, blocking until it is done.
+        """
+        self.__writer.flush()
 
 
 class FrameOfMind:
@@ -475,7 +1242,8 @@ class FrameOfMind:
         - irritability_threshold (int, optional): If the mood score surpasses this threshold, either in the positive or
          the negative range, neutral comments will start to affect the mood score.
     Methods:
-        - update_score(self, message: str): Update the mood score based on the sentiment of a given message.
+        - update_score(self, message: str): Update the mood score based on the sentiment of a given message. Returns a
+        Future which is done once the score has been updated.
         - check_mood(self): Check and print the current mood state and mood score.
     """
     def __init__(self, mood_range: int, threshold: int = None, irritability_threshold: int = None):
@@ -486,13 +1254,13 @@ class FrameOfMind:
 
         # sets default threshold value if no value is given
         if threshold is None:
-            threshold = config.getint('FRAME_OF_MIND', 'mood_change_threshold')
+            threshold = load_config().getint('FRAME_OF_MIND', 'mood_change_threshold')
 
         self.__thresholds = self.__build_threshold_dict(mood_range, threshold)
 
         # sets default irritability if no value is given
         if irritability_threshold is None:
-            irritability_threshold = config.getint('FRAME_OF_MIND', 'irritability_threshold')
+            irritability_threshold = load_config().getint('FRAME_OF_MIND', 'irritability_threshold')
 
         # non-irritable zone (neutral comments' scores will affect her mood if past this zone)
         self.__non_irritable_zone = range(irritability_threshold * -1, irritability_threshold)
@@ -533,8 +1301,24 @@ class FrameOfMind:
         return thresholds
 
     def update_score(self, message: str):
-        # calculate score of given message
-        sentiment, points = sentiment_analysis(message)
+        # calculate score of given message. the score is updated once the result arrives
+        updated = Future()
+        get_sentiment_service().submit(message).add_done_callback(lambda result: self.__apply_sentiment(result, updated))
+        return updated
+
+    def __apply_sentiment(self, result: Future, updated: Future):
+        try:
+            if result.exception() is not None:
+                print('Aiko.py:')
+                print(f'Sentiment analysis failed: {result.exception()}')
+                print()
+                return
+
+            self.__update_score(*result.result())
+        finally:
+            updated.set_result(None)
+
+    def __update_score(self, sentiment: str, points: int):
         # update score value
         if sentiment == 'positive':
             self.__mood_score.update_score(points)
@@ -563,6 +1347,97 @@ class FrameOfMind:
                 return str(state)
 
 
+class MoodUpdater:
+    """
+    A bounded executor for FrameOfMind updates. Messages are queued and sent for sentiment analysis in order, by a
+    single worker thread, and their scores are applied in the same order.
+
+    Parameters:
+        fom (FrameOfMind): The FrameOfMind object to be updated.
+        max_pending (int): Maximum number of messages waiting to be analyzed.
+        policy (str): What to do with new messages once max_pending is reached:
+            - 'drop_oldest': drops the oldest waiting message to make room.
+            - 'drop_newest': drops the new message.
+            - 'coalesce': merges the new message into the newest waiting one, so the burst is analyzed as one text.
+
+    Attributes:
+        dropped (int): How many messages have been dropped.
+
+    Methods:
+        submit(message : str) -> bool:
+            Queues a message. Returns False if it was dropped.
+        flush(timeout : float) -> bool:
+            Blocks until every queued message has been analyzed and applied. Returns False if the timeout ran out.
+    """
+    policies = ('drop_oldest', 'drop_newest', 'coalesce')
+
+    # the sentiment APIs don't accept very long documents, so coalesced messages are capped
+    max_coalesced_length = 5000
+
+    def __init__(self, fom: FrameOfMind, max_pending: int = 20, policy: str = 'coalesce'):
+        if policy not in self.policies:
+            raise ValueError(f'{policy} is not a valid policy. Valid policies: {", ".join(self.policies)}')
+
+        self.__fom = fom
+        self.__max_pending = max_pending
+        self.__policy = policy
+
+        self.__pending = deque()
+        self.__in_flight = 0
+        self.__condition = Condition()
+
+        self.dropped = 0
+
+        Thread(target=self.__loop, name='mood-updater', daemon=True).start()
+
+    def __loop(self):
+        while True:
+            with self.__condition:
+                while not self.__pending:
+                    self.__condition.wait()
+
+                messages = list(self.__pending)
+                self.__pending.clear()
+                self.__in_flight = len(messages)
+
+            # submitted all at once, so the sentiment service can batch them
+            wait([self.__fom.update_score(message) for message in messages])
+
+            with self.__condition:
+                self.__in_flight = 0
+                self.__condition.notify_all()
+
+    def submit(self, message: str) -> bool:
+        with self.__condition:
+            if len(self.__pending) >= self.__max_pending:
+                if self.__policy == 'drop_newest':
+                    self.dropped += 1
+                    return False
+
+                if self.__policy == 'coalesce':
+                    coalesced = f'{self.__pending[-1]} {message}'
+                    if len(coalesced) <= self.max_coalesced_length:
+                        self.__pending[-1] = coalesced
+                        return True
+
+                # drop_oldest, or coalescing would make the message too long
+                self.__pending.popleft()
+                self.dropped += 1
+
+            self.__pending.append(message)
+            self.__condition.notify_all()
+
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        with self.__condition:
+            return self.__condition.wait_for(lambda: not self.__pending and self.__in_flight == 0, timeout)
+
+    @property
+    def pending(self):
+        return len(self.__pending) + self.__in_flight
+
+
 class AIko:
     """
       A class that can be used for interacting with custom-made AI characters.
@@ -575,10 +1450,14 @@ class AIko:
           personality_filename (str): The filename of the personality file.
           sp_slots (int): The max number of side prompt slots.
           mem_slots (int): The max number of context slots.
+          prompts (PromptRepository, optional): Where the character's prompts are read from. Defaults to the shared
+          repository of the prompts folder.
 
       Methods:
           interact(username: str, message: str):
               Interacts with the AI character by providing a username and a message.
+          interact_stream(message: str, use_system_role: bool):
+              Same as interact, but yields the answer one sentence at a time while it is being generated.
           add_side_prompt(side_prompt : str):
               Injects a side prompt into the character's memory.
           change_scenario(scenario : str):
@@ -586,59 +1465,112 @@ class AIko:
     """
 
     def __init__(self, character_name: str, scenario: str = '', sp_slots: int = 5,
-                 mem_slots: int = 10):
+                 mem_slots: int = 10, prompts: PromptRepository = None):
         self.character_name = character_name
+        self.__prompts = get_prompt_repository() if prompts is None else prompts
         self.__black_box = BlackBox()
-        self.context = Context(scenario, sp_slots, mem_slots)
+        self.context = Context(scenario, sp_slots, mem_slots, prompts=self.__prompts)
 
         self.fom = FrameOfMind(
             self.context.personality_count if self.context.personality_count % 2 != 0 else self.context.personality_count + 1)
-        self.__log = Log('prompts/personalities/0.txt')
-        self.__keywords = gather_txts('prompts/keywords')
+        config = load_config()
+        self.__mood_updater = MoodUpdater(
+            self.fom, config.getint('FRAME_OF_MIND', 'mood_queue_size'), config.get('FRAME_OF_MIND', 'mood_overflow_policy'))
+        self.__mood_flush_timeout = config.getfloat('FRAME_OF_MIND', 'mood_flush_timeout')
+        self.__tracer = get_tracer()
+        self.__log = Log(os.path.join(self.__prompts.root, 'personalities', '0.txt'),
+                         config.getboolean('GENERAL', 'jsonl_log'))
+        # rebuilt whenever the keywords folder changes
+        self.__keyword_matcher = None
+        self.__matched_keywords = None
 
     @property
     def keywords(self):
-        return sorted(list(self.__keywords.keys()))
+        return sorted(self.__prompts.directory('keywords').keys())
+
+    @property
+    def prompt_tokens(self):
+        """
+        Estimated size in tokens of the last prompt sent (or about to be sent) for completion.
+        """
+        return self.context.last_prompt_tokens
 
     def change_scenario(self, scenario: str):
         self.context.scenario.add_item(scenario, 'system')
 
+    def flush_log(self):
+        """
+        Writes every buffered log entry. Call it before exiting with os._exit, which skips the exit handlers.
+        """
+        self.__log.flush()
+
     def add_side_prompt(self, side_prompt: str):
         self.context.side_prompts.add_item(side_prompt, 'system')
 
     def has_keyword(self, message: str):
-        for keyword in self.__keywords:
-            if message.startswith(keyword):
-                return (True, {"role": "system", "content": self.__keywords[keyword]}, keyword)
+        keywords = self.__prompts.directory('keywords')
+        # the repository replaces the dictionary when a keyword file changes
+        if keywords is not self.__matched_keywords:
+            self.__keyword_matcher = Matcher(keywords)
+            self.__matched_keywords = keywords
+
+        match = self.__keyword_matcher.match_prefix(message)
+        if match is not None:
+            return (True, {"role": "system", "content": match.payload}, match.keyword)
 
         return (False, None, None)
 
-    def interact(self, message: str, use_system_role: bool = False):
+    def __prepare_interaction(self, message: str, use_system_role: bool, span=None):
         """
-          Interacts with the AI character by providing a message.
-        """
-        # performs sentiment analysis on message to update her mood, done on a separate thread to avoid extra latency
-        Thread(target=self.fom.update_score, kwargs={'message': message}).start()
+          Starts the sentiment analysis of the message and builds the messages list to be sent for completion.
 
-        use_profile = self.__black_box.message_meets_criteria(message)
-        messages = self.context.build_context(use_profile)
+          Returns:
+              tuple: The messages list and the keyword found in the message (None if no keyword was found).
+        """
+        # performs sentiment analysis on message to update her mood, done in the background to avoid extra latency
+        self.__mood_updater.submit(message)
 
-        has_keyword = False
+        keyword = None
+        new_messages = []
         # appends the message under the chosen role (user/system)
         if use_system_role:
             # checks for keyword
             has_keyword, keyword_instructions, keyword = self.has_keyword(message)
             if has_keyword:
-                messages.append(keyword_instructions)
+                new_messages.append(keyword_instructions)
 
             # appends as system
-            messages.append({"role": "system", "content": message})
+            new_messages.append({"role": "system", "content": message})
         else:
             # appends as user
-            messages.append({"role": "user", "content": message})
+            new_messages.append({"role": "user", "content": message})
 
-        # requests completion
-        completion = generate_gpt_completion_timeout(messages)
+        # builds the context, leaving room in the token budget for the new messages
+        with self.__tracer.measure('prompt_build'):
+            use_profile = self.__black_box.message_meets_criteria(message)
+            messages = self.context.build_context(use_profile, count_message_tokens(new_messages, reply_priming=False))
+        if span is not None:
+            span.mark('prompt_built')
+
+        return messages + new_messages, keyword
+
+    def __parse_output(self, output: str, keyword: str = None):
+        """
+          Parses the keyword and the character's name (EG "Aiko: bla bla") out of the start of an output.
+        """
+        # parses keyword out of output, if using keywords
+        if keyword is not None and f'{keyword.lower()}:' in output.lower()[:len(keyword) + 2]:
+            output = output[len(keyword) + 1:]
+        # parses character name (EG "Aiko: bla bla") out of output
+        if f'{self.character_name}:' in output[:len(self.character_name) + 2]:
+            output = output[len(self.character_name) + 1:]
+
+        return output
+
+    def __finish_interaction(self, message: str, completion: tuple, use_system_role: bool):
+        """
+          Saves the interaction to context, logs it and updates the character's personality according to her mood.
+        """
         output = completion[0]
 
         # saves interaction to context
@@ -648,20 +1580,73 @@ class AIko:
             self.context.context.add_item(message, "user")
             self.context.context.add_item(output, "assistant")
 
-        self.__log.update_log(message, completion)
+        self.__log.update_log(message, completion, self.prompt_tokens)
 
-        # parses keyword out of output, if using keywords
-        if has_keyword and f'{keyword.lower()}:' in output.lower()[:len(keyword) + 2]:
-            output = output[len(keyword) + 1:]
-        # parses character name (EG "Aiko: bla bla") out of output
-        if f'{self.character_name}:' in output[:len(self.character_name) + 2]:
-            output = output[len(self.character_name) + 1:]
+        # waits for pending mood updates (including this message's) before checking current mood
+        self.__mood_updater.flush(self.__mood_flush_timeout)
 
         # updates personality after checking current mood
         personality = self.fom.update_fom()
         self.context.switch_personality(personality)
 
-        return output
+    def interact(self, message: str, use_system_role: bool = False):
+        """
+          Interacts with the AI character by providing a message.
+        """
+        span = self.__tracer.current()
+        messages, keyword = self.__prepare_interaction(message, use_system_role, span)
+
+        # requests completion
+        with self.__tracer.measure('completion'):
+            completion = generate_gpt_completion_timeout(messages)
+        if span is not None:
+            span.mark('completed')
+
+        self.__finish_interaction(message, completion, use_system_role)
+
+        return self.__parse_output(completion[0], keyword)
+
+    def interact_stream(self, message: str, use_system_role: bool = False):
+        """
+          Interacts with the AI character by providing a message, yielding her answer one sentence at a time as soon as
+          each sentence is generated. The complete answer is saved to context and logged once the generator is
+          exhausted.
+        """
+        # the generator runs on whichever thread consumes it, so the current span is captured here
+        return self.__interact_stream(message, use_system_role, self.__tracer.current())
+
+    def __interact_stream(self, message: str, use_system_role: bool, span):
+        messages, keyword = self.__prepare_interaction(message, use_system_role, span)
+
+        # requests streamed completion
+        start = time.monotonic()
+        stream = generate_gpt_completion_stream(messages)
+        first_sentence = True
+
+        while True:
+            try:
+                sentence = next(stream)
+            except StopIteration as stop:
+                # the streamed API doesn't report prompt tokens, so the estimate is used instead
+                output, (_, completion_tokens, _) = stop.value
+                completion = (output, (self.prompt_tokens, completion_tokens, self.prompt_tokens + completion_tokens))
+                self.__tracer.record('completion', time.monotonic() - start)
+                if span is not None:
+                    span.mark('completed')
+                break
+
+            # the keyword and the character's name can only be at the start of the answer
+            if first_sentence:
+                sentence = self.__parse_output(sentence, keyword).strip()
+                first_sentence = False
+                self.__tracer.record('first_sentence', time.monotonic() - start)
+                if span is not None:
+                    span.mark('first_sentence')
+
+            if sentence:
+                yield sentence
+
+        self.__finish_interaction(message, completion, use_system_role)
 # -------------------------------------------
 
 
@@ -0,0 +1,638 @@
+"""
+AIkoBenchmark.py
+
+Benchmarks for Aiko's scripts. Run with the name of the benchmark to be executed, EG:
+
+python AIkoBenchmark.py containers
+
+The imports and phrases benchmarks exit with an error if importing a script loads a heavy SDK, or if repeated chat
+messages aren't served from the phrase cache, so they can be used as regression checks.
+
+Requirements:
+- AIko.py (181beta or greater) and its requirements.
+- AIkoStreamingTools.py (042 or greater) and its requirements.
+- AIkoSession.py (002 or greater) and its requirements.
+- AIkoStubs.py (003 or greater).
+- AIkoFrontend.py (001 or greater).
+- AIkoINIhandler.py (46 or greater).
+- AIkoVoice.py (121 or greater).
+
+Changelog:
+
+001:
+- Initial release. Added containers benchmark, which compares the deque backed MessageList and MessageQueue classes
+with the previous list backed implementations.
+002:
+- Added ingestion benchmark, which replays synthetic chat (copypastas, emote walls, spammers, questions) through a
+ChatIngestor at a fixed rate.
+003:
+- Added pipeline benchmark, which replays a chat log (or synthetic chat) through a stub Twitch chat server into a
+StreamSession, with OpenAI and Azure replaced by local stubs. Reports message counts, latency percentiles per stage and
+CPU time per thread.
+004:
+- BenchmarkFrontend is now a Frontend.
+005:
+- Added imports benchmark, which measures how long each script takes to import (python -X importtime) and fails if
+importing it loads a heavy SDK (openai, azure, pytchat, keyboard, tkinter, aiohttp).
+006:
+- Added --phrase-cache option to the pipeline benchmark. Phrase caching is otherwise disabled, so runs stay comparable.
+007:
+- Added phrases benchmark, which reads chat messages aloud twice (the way AnswerLoops does) and checks that the second
+time, and a fresh cache reading the first one's files, are served from the phrase cache.
+"""
+import tempfile
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+from threading import Lock
+from time import perf_counter, sleep
+
+import AIko as aiko_script
+import AikoSentiment
+from AIko import MessageList, CompletionClient, create_limited_list
+from AIkoStreamingTools import MessageQueue, ChatIngestor, Scheduler, parse_irc_line
+from AIkoTracing import get_tracer
+from AIkoFrontend import Frontend
+from AIkoINIhandler import load_config
+from AIkoStubs import StubOpenAIServer, StubTwitchIRCServer, StubSentimentBackend, StubSynthesisBackend, \
+    lognormal_latency
+
+
+# ------------------------------------------ BASELINES ----------------------------------------------------------------
+# previous implementations, kept for comparison
+
+
+class ListMessageList:
+    """
+    MessageList as it was before being backed by a deque: a list padded with empty strings.
+    """
+    def __init__(self, slots: int):
+        self.__message_list__ = create_limited_list(slots)
+
+    def add_item(self, item: str, role: str):
+        self.__message_list__.pop(0)
+        self.__message_list__.append({"role": role, "content": item})
+
+    def append_items(self, existing_list: list):
+        for item in self.__message_list__:
+            if item != '':
+                existing_list.append(item)
+
+
+class ListMessageQueue:
+    """
+    MessageQueue as it was before being backed by a deque.
+    """
+    def __init__(self):
+        self.__queue = []
+        self.__lock = Lock()
+
+    def is_empty(self):
+        return len(self.__queue) == 0
+
+    def add_message(self, message: str):
+        with self.__lock:
+            self.__queue.append(message)
+
+    def get_next(self):
+        with self.__lock:
+            if not self.is_empty():
+                return self.__queue.pop(0)
+            return ''
+
+
+# ------------------------------------------ HELPERS ------------------------------------------------------------------
+
+
+def time_it(func: callable, repeat: int = 3):
+    """
+    Runs the function a few times and returns the fastest run's duration in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def print_row(*columns):
+    print(''.join(f'{column:>16}' for column in columns))
+
+
+def percentile(samples: list, p: float):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+
+class CollectingQueue:
+    """
+    Stands in for MasterQueue, keeping every message added to it.
+    """
+    def __init__(self):
+        self.messages = []
+
+    def add_message(self, message: str, message_type: str):
+        self.messages.append(message)
+
+
+def synthetic_chat(seed: int = 0):
+    """
+    Generates an endless stream of (author, message) tuples resembling a busy chat: mostly chatter, some questions,
+    copypastas repeated by many people, emote walls and a few spammers.
+    """
+    rng = random.Random(seed)
+    words = ['the', 'stream', 'is', 'so', 'good', 'today', 'aiko', 'lol', 'what', 'game', 'play', 'next', 'love',
+             'this', 'song', 'chat', 'hello', 'from', 'brazil', 'music', 'cute', 'cat', 'dog', 'pizza', 'best']
+    emotes = ['LUL', 'Kappa', 'PogChamp', 'KEKW', 'monkaS', '<3']
+    copypastas = ['Aiko please say hi to my mom she watches every stream',
+                  'THIS IS THE BEST STREAM ON TWITCH RIGHT NOW',
+                  'raid from the cozy corner! welcome everyone!']
+    spammers = [f'spammer{i}' for i in range(3)]
+
+    i = 0
+    while True:
+        i += 1
+        dice = rng.random()
+        if dice < 0.25:
+            yield f'raider{rng.randint(0, 5000)}', rng.choice(copypastas) + rng.choice(['', '!', '!!', ' <3'])
+        elif dice < 0.35:
+            yield f'viewer{rng.randint(0, 2000)}', ' '.join([rng.choice(emotes)] * rng.randint(3, 15))
+        elif dice < 0.40:
+            yield rng.choice(spammers), 'follow me at spam dot com ' * rng.randint(1, 3)
+        elif dice < 0.55:
+            yield f'viewer{rng.randint(0, 2000)}', f'{" ".join(rng.choices(words, k=rng.randint(3, 10)))}?'
+        else:
+            yield f'viewer{rng.randint(0, 2000)}', f'{" ".join(rng.choices(words, k=rng.randint(1, 12)))} {i}'
+
+
+def load_replay(path: str):
+    """
+    Reads a recorded chat log into a list of (author, message, tags) tuples. Each line is either a JSON object (with
+    author/user/request_id and message/text/title keys) or a raw IRC line captured from Twitch's chat server, of which
+    only PRIVMSGs are kept.
+    """
+    messages = []
+    with open(path, 'r', encoding='utf-8') as replay:
+        for line in replay:
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith('{'):
+                entry = json.loads(line)
+                author = entry.get('author') or entry.get('user') or entry.get('request_id') or 'viewer'
+                message = entry.get('message') or entry.get('text') or entry.get('title') or ''
+                messages.append((str(author).replace(' ', '_'), message, {}))
+                continue
+
+            irc_message = parse_irc_line(line)
+            if irc_message.command == 'PRIVMSG' and irc_message.prefix:
+                messages.append((irc_message.prefix.split('!', 1)[0], irc_message.params[-1], irc_message.tags))
+
+    return messages
+
+
+def thread_cpu_times():
+    """
+    Returns the CPU seconds used by each live thread, summed by thread name. Empty where per-thread CPU clocks aren't
+    available (EG, on Windows).
+    """
+    cpu_times = {}
+    if not hasattr(time, 'pthread_getcpuclockid'):
+        return cpu_times
+
+    for thread in threading.enumerate():
+        try:
+            seconds = time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+        except (OSError, TypeError):
+            # the thread exited in the meantime
+            continue
+        cpu_times[thread.name] = cpu_times.get(thread.name, 0.0) + seconds
+
+    return cpu_times
+
+
+class BenchmarkFrontend(Frontend):
+    """
+    Frontend which doesn't display anything. Times each answered chat message from when its author's oldest unanswered message was sent
+    until the answer has been said.
+    """
+    def __init__(self):
+        self.latencies = []
+        self.__sent = {}
+        self.__answering = None
+        self.__lock = Lock()
+
+    def message_sent(self, author: str):
+        with self.__lock:
+            self.__sent.setdefault(author.lower(), perf_counter())
+
+    def print(self, text: str):
+        # AnswerLoops prints the chat message it's answering, then the answer once it has been said
+        if text.startswith('(CHAT) '):
+            self.__answering = text[7:].split(':', 1)[0].lower()
+        elif text.startswith('Aiko: ') and self.__answering is not None:
+            with self.__lock:
+                sent = self.__sent.pop(self.__answering, None)
+            if sent is not None:
+                self.latencies.append(perf_counter() - sent)
+            self.__answering = None
+
+    def print_to_cmdl(self, text: str = ''):
+        pass
+
+
+# ------------------------------------------ BENCHMARKS ---------------------------------------------------------------
+
+
+def bench_message_list(cls, slots: int, messages: int, builds: int):
+    message_list = cls(slots)
+    # fills the list so every addition discards the oldest item
+    for i in range(slots):
+        message_list.add_item(f'message {i}', 'user')
+
+    def add():
+        for i in range(messages):
+            message_list.add_item(f'message {i}', 'user')
+
+    def build():
+        for _ in range(builds):
+            message_list.append_items([])
+
+    return time_it(add) / messages, time_it(build) / builds
+
+
+def bench_message_queue(cls, length: int):
+    def fill_and_drain():
+        queue = cls()
+        for i in range(length):
+            queue.add_message(f'message {i}')
+        while queue.get_next() != '':
+            pass
+
+    return time_it(fill_and_drain) / length
+
+
+def containers(args):
+    """
+    Compares deque backed message containers with the previous list backed ones, at increasing slot counts.
+    """
+    print('MessageList (microseconds per add_item / per append_items)')
+    print_row('slots', 'list add', 'deque add', 'list build', 'deque build')
+    for slots in args.slots:
+        list_add, list_build = bench_message_list(ListMessageList, slots, args.messages, args.builds)
+        deque_add, deque_build = bench_message_list(MessageList, slots, args.messages, args.builds)
+        print_row(slots, f'{list_add * 1e6:.3f}', f'{deque_add * 1e6:.3f}',
+                  f'{list_build * 1e6:.3f}', f'{deque_build * 1e6:.3f}')
+
+    print()
+    print('MessageQueue (microseconds per message, add_message + get_next)')
+    print_row('length', 'list', 'deque')
+    for length in args.slots:
+        print_row(length, f'{bench_message_queue(ListMessageQueue, length) * 1e6:.3f}',
+                  f'{bench_message_queue(MessageQueue, length) * 1e6:.3f}')
+
+
+def ingestion(args):
+    """
+    Replays synthetic chat through a ChatIngestor at a fixed rate, then as fast as possible.
+    """
+    chat = synthetic_chat(args.seed)
+
+    # paced replay
+    queue = CollectingQueue()
+    scheduler = Scheduler()
+    ingestor = ChatIngestor(queue, capacity=args.capacity, forward_interval=args.forward_interval,
+                            forward_count=args.forward_count, scheduler=scheduler)
+    ingestor.start()
+
+    total = int(args.rate * args.seconds)
+    latencies = []
+    start = perf_counter()
+    for i in range(total):
+        # sleeps until the message is due
+        delay = start + i / args.rate - perf_counter()
+        if delay > 0:
+            sleep(delay)
+
+        author, message = next(chat)
+        submitted = perf_counter()
+        ingestor.submit(author, message)
+        latencies.append(perf_counter() - submitted)
+    elapsed = perf_counter() - start
+
+    ingestor.stop()
+    scheduler.stop()
+
+    print(f'Paced replay: {total} messages in {elapsed:.2f}s ({total / elapsed:.0f} msg/s, target {args.rate:.0f})')
+    print(f'submit latency (microseconds): p50 {percentile(latencies, 50) * 1e6:.1f}, '
+          f'p99 {percentile(latencies, 99) * 1e6:.1f}, max {max(latencies) * 1e6:.1f}')
+    for key, value in ingestor.stats().items():
+        print(f'    {key}: {value:.1f}' if isinstance(value, float) else f'    {key}: {value}')
+    print('first forwarded messages:')
+    for message in queue.messages[:5]:
+        print(f'    {message}')
+    print('(before ingestion, chat was read with a 0.1s delay per message, capping it at 10 msg/s)')
+
+    # unpaced, to find the ingestion ceiling
+    print()
+    ingestor = ChatIngestor(CollectingQueue(), capacity=args.capacity, scheduler=Scheduler())
+    messages = [next(chat) for _ in range(total)]
+    elapsed = time_it(lambda: [ingestor.submit(author, message) for author, message in messages], repeat=1)
+    print(f'Unpaced: {total} messages in {elapsed:.3f}s ({total / elapsed:.0f} msg/s)')
+
+
+def pipeline(args):
+    """
+    Replays chat through the whole live pipeline (chat loop, ingestor, MasterQueue, AIko and AnswerLoops), with OpenAI
+    and Azure replaced by local stubs.
+    """
+    from AIkoSession import Orchestrator
+    from AIkoVoice import Synthesizer, NullPlayer, PhraseCache
+
+    if args.replay:
+        messages = load_replay(args.replay)
+    else:
+        chat = synthetic_chat(args.seed)
+        messages = [(*next(chat), {}) for _ in range(int(args.rate * args.seconds))]
+
+    # stubs. the shared completion client and sentiment service are replaced before anything uses them
+    openai_server = StubOpenAIServer(
+        reply='Aiko: That is a really good question! I have thought about it a lot. Thanks for asking, chat.',
+        latency=lognormal_latency(args.completion_latency), token_interval=args.token_interval
+    )
+    aiko_script.completion_client = CompletionClient('stub', openai_server.start(),
+                                                   load_config().get('GENERAL', 'model'))
+    AikoSentiment.sentiment_service = AikoSentiment.SentimentService(
+        StubSentimentBackend(lognormal_latency(args.sentiment_latency))
+    )
+    twitch_server = StubTwitchIRCServer()
+    twitch_address = twitch_server.start()
+
+    phrase_cache = PhraseCache(folder=None) if args.phrase_cache else None
+
+    # a single session, reading from the stub chat server
+    orchestrator = Orchestrator(scheduler=Scheduler())
+    session = orchestrator.add_session(
+        'Aiko', 'You are doing a "JUST CHATTING STREAM" on Twitch.', channel='benchmark',
+        twitch_address=twitch_address, twitch_token='oauth:benchmark',
+        synthesizer=Synthesizer(backend=StubSynthesisBackend(lognormal_latency(args.synthesis_latency),
+                                                             args.words_per_minute), player=NullPlayer(),
+                                cache=phrase_cache or False)
+    )
+    frontend = BenchmarkFrontend()
+    session.attach(frontend)
+    session.start()
+    if not twitch_server.wait_for_joins(1, timeout=10):
+        print("The chat loop didn't join the stub chat server.")
+        orchestrator.stop()
+        return
+
+    cpu_start = thread_cpu_times()
+    process_start = time.process_time()
+
+    # paced replay
+    start = perf_counter()
+    for i, (author, message, tags) in enumerate(messages):
+        delay = start + i / args.rate - perf_counter()
+        if delay > 0:
+            sleep(delay)
+
+        frontend.message_sent(author)
+        twitch_server.send_message(author, message, tags)
+    replay_time = perf_counter() - start
+
+    # gives the pipeline time to answer what's left
+    sleep(args.drain)
+    elapsed = perf_counter() - start
+
+    cpu_end = thread_cpu_times()
+    process_cpu = time.process_time() - process_start
+    ingestion = session.ingestor.stats()
+    stages = get_tracer().stats()
+
+    orchestrator.stop()
+    aiko_script.completion_client.close()
+    twitch_server.stop()
+    openai_server.stop()
+
+    answered = len(frontend.latencies)
+    print(f'Replayed {len(messages)} messages in {replay_time:.1f}s ({len(messages) / replay_time:.1f} msg/s), '
+          f'then drained for {args.drain:.0f}s')
+    print(f'    ingested: {ingestion["received"]}')
+    print(f'    dropped by the ingestor: {ingestion["dropped"] + ingestion["collapsed"] + ingestion["expired"]} '
+          f'(dropped {ingestion["dropped"]}, collapsed {ingestion["collapsed"]}, expired {ingestion["expired"]}, '
+          f'merged {ingestion["merged"]})')
+    print(f'    forwarded to the queue: {ingestion["forwarded"]}')
+    print(f'    answered: {answered} ({answered / elapsed * 60:.1f} per minute)')
+    print(f'    forwarded but not answered: {max(0, ingestion["forwarded"] - answered)}')
+    if phrase_cache is not None:
+        cache_stats = phrase_cache.stats()
+        print(f'    phrase cache: {cache_stats["hits"]} hits, {cache_stats["misses"]} misses')
+
+    print()
+    print('Latencies (milliseconds)')
+    print_row('stage', 'count', 'p50', 'p95', 'p99', 'max')
+    for stage, summary in stages.items():
+        print_row(stage, summary['count'], *(f'{summary[key] * 1000:.0f}' if summary[key] is not None else '-'
+                                             for key in ('p50', 'p95', 'p99', 'max')))
+    if frontend.latencies:
+        latencies = frontend.latencies
+        print_row('end_to_end', answered, *(f'{value * 1000:.0f}' for value in
+                                            (percentile(latencies, 50), percentile(latencies, 95),
+                                             percentile(latencies, 99), max(latencies))))
+    print('(end_to_end goes from a message being sent to chat until its answer has been said. total goes from a '
+          'message reaching the queue until then)')
+
+    print()
+    print(f'CPU time (milliseconds, {process_cpu * 1000:.0f} for the whole process, stubs included)')
+    if not cpu_end:
+        print('    per thread CPU time is not available on this platform.')
+    else:
+        print_row('thread', 'cpu', 'per answer')
+        attributed = 0.0
+        for name, seconds in sorted(cpu_end.items(), key=lambda item: -(item[1] - cpu_start.get(item[0], 0.0))):
+            used = seconds - cpu_start.get(name, 0.0)
+            attributed += used
+            if used >= 0.0005:
+                print_row(name, f'{used * 1000:.0f}', f'{used * 1000 / answered:.1f}' if answered else '-')
+        print_row('exited threads', f'{max(0.0, process_cpu - attributed) * 1000:.0f}', '')
+        print('(exited threads includes prefetch threads, which consume streamed completions)')
+
+
+class InstantPlayer:
+    """
+    Player which returns as soon as it's given a clip, so only synthesis time is measured.
+    """
+    def play(self, clip):
+        pass
+
+
+def read_aloud(synthesizer, texts: list):
+    """
+    Reads every text aloud the way AnswerLoops reads chat messages, and returns how long it took in seconds.
+    """
+    from AIkoSession import reading_rate
+
+    start = perf_counter()
+    utterances = [synthesizer.say_async(text, reading_rate(text), 'neutral') for text in texts]
+    for utterance in utterances:
+        utterance.wait()
+    return perf_counter() - start
+
+
+def phrases(args):
+    """
+    Reads chat messages aloud twice through a stub voice, and checks the second time is served from the phrase cache.
+    """
+    from AIkoVoice import Synthesizer, PhraseCache
+
+    chat = synthetic_chat(args.seed)
+    texts = list(dict.fromkeys(message for _, message in (next(chat) for _ in range(args.messages))))
+
+    failed = False
+    with tempfile.TemporaryDirectory() as folder:
+        backend = StubSynthesisBackend(lognormal_latency(args.synthesis_latency))
+        cache = PhraseCache(folder=folder)
+        synthesizer = Synthesizer(backend=backend, player=InstantPlayer(), cache=cache)
+
+        print_row('pass', 'seconds', 'hits', 'misses')
+        for label in ('first', 'repeated'):
+            before = cache.stats()
+            elapsed = read_aloud(synthesizer, texts)
+            after = cache.stats()
+            hits, misses = after['hits'] - before['hits'], after['misses'] - before['misses']
+            print_row(label, f'{elapsed:.3f}', hits, misses)
+        failed = failed or misses > 0
+        synthesizer.close()
+
+        # a new cache, as after a restart, only has the files to go by
+        cache.flush()
+        disk_cache = PhraseCache(max_memory=0, folder=folder)
+        synthesizer = Synthesizer(backend=backend, player=InstantPlayer(), cache=disk_cache)
+        elapsed = read_aloud(synthesizer, texts)
+        stats = disk_cache.stats()
+        print_row('from disk', f'{elapsed:.3f}', stats['hits'], stats['misses'])
+        failed = failed or stats['misses'] > 0
+        synthesizer.close()
+
+    if failed:
+        print('Repeated messages were synthesized again instead of being served from the phrase cache.')
+        sys.exit(1)
+
+
+# scripts which should be cheap to import, and the packages they should only load when used
+import_checked_scripts = ('AIko', 'AIkoINIhandler', 'AikoSentiment', 'AIkoVoice', 'AIkoStreamingTools', 'AIkoSession',
+                          'AIkoFrontend', 'AIkoTracing', 'AIkoMatcher', 'AIkoDevices', 'Livestream')
+heavy_packages = ('openai', 'azure', 'pytchat', 'keyboard', 'tkinter', 'aiohttp')
+
+
+def measure_import(module: str):
+    """
+    Imports the module in a fresh interpreter with python -X importtime. Returns its cumulative import time in
+    microseconds and the names of every package imported along with it.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # lines look like "import time:       123 |        456 |     package.module", nested imports indented
+    total = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        packages.add(name.split('.')[0])
+        if name == module:
+            total = int(cumulative)
+
+    return total, packages
+
+
+def imports(args):
+    """
+    Measures how long each script takes to import, and checks that importing it doesn't load heavy SDKs.
+    """
+    ini_mtime = os.path.getmtime('AIkoPrefs.ini') if os.path.exists('AIkoPrefs.ini') else None
+
+    failed = False
+    print_row('script', 'best ms', 'heavy packages')
+    for module in args.modules:
+        try:
+            measurements = [measure_import(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print_row(module, '-', f'import failed: {e}')
+            failed = True
+            continue
+
+        heavy = sorted(set().union(*(packages for _, packages in measurements)) & set(heavy_packages))
+        failed = failed or bool(heavy)
+        print_row(module, f'{min(total for total, _ in measurements) / 1000:.1f}', ', '.join(heavy) or '-')
+
+    if ini_mtime is not None and os.path.getmtime('AIkoPrefs.ini') != ini_mtime:
+        print('AIkoPrefs.ini was written to while importing.')
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for Aiko's scripts.")
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+
+    containers_parser = benchmarks.add_parser('containers', help=containers.__doc__.strip())
+    containers_parser.add_argument('--slots', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    containers_parser.add_argument('--messages', type=int, default=20000)
+    containers_parser.add_argument('--builds', type=int, default=200)
+    containers_parser.set_defaults(func=containers)
+
+    ingestion_parser = benchmarks.add_parser('ingestion', help=ingestion.__doc__.strip())
+    ingestion_parser.add_argument('--rate', type=float, default=1000.0, help='Messages per second.')
+    ingestion_parser.add_argument('--seconds', type=float, default=10.0)
+    ingestion_parser.add_argument('--capacity', type=int, default=200)
+    ingestion_parser.add_argument('--forward-interval', type=float, default=1.0)
+    ingestion_parser.add_argument('--forward-count', type=int, default=2)
+    ingestion_parser.add_argument('--seed', type=int, default=0)
+    ingestion_parser.set_defaults(func=ingestion)
+
+    pipeline_parser = benchmarks.add_parser('pipeline', help=pipeline.__doc__.strip())
+    pipeline_parser.add_argument('--replay', help='Chat log to replay (JSON lines or a Twitch IRC capture). Synthetic '
+                                                  'chat is generated if not given.')
+    pipeline_parser.add_argument('--rate', type=float, default=5.0, help='Messages per second.')
+    pipeline_parser.add_argument('--seconds', type=float, default=30.0, help='Length of the synthetic chat.')
+    pipeline_parser.add_argument('--drain', type=float, default=10.0,
+                                 help='Seconds to keep answering after the replay ends.')
+    pipeline_parser.add_argument('--completion-latency', type=float, default=0.8, help='Median, in seconds.')
+    pipeline_parser.add_argument('--token-interval', type=float, default=0.02)
+    pipeline_parser.add_argument('--sentiment-latency', type=float, default=0.15, help='Median, in seconds.')
+    pipeline_parser.add_argument('--synthesis-latency', type=float, default=0.3, help='Median, in seconds.')
+    pipeline_parser.add_argument('--words-per-minute', type=float, default=600.0,
+                                 help='Speaking speed of the stub voice. Higher values shorten playback.')
+    pipeline_parser.add_argument('--phrase-cache', action='store_true',
+                                 help='Caches rendered phrases in memory, as the live pipeline does.')
+    pipeline_parser.add_argument('--seed', type=int, default=0)
+    pipeline_parser.set_defaults(func=pipeline)
+
+    phrases_parser = benchmarks.add_parser('phrases', help=phrases.__doc__.strip())
+    phrases_parser.add_argument('--messages', type=int, default=50, help='Synthetic chat messages to read.')
+    phrases_parser.add_argument('--synthesis-latency', type=float, default=0.05, help='Median, in seconds.')
+    phrases_parser.add_argument('--seed', type=int, default=0)
+    phrases_parser.set_defaults(func=phrases)
+
+    imports_parser = benchmarks.add_parser('imports', help=imports.__doc__.strip())
+    imports_parser.add_argument('--modules', nargs='+', default=list(import_checked_scripts))
+    imports_parser.add_argument('--repeat', type=int, default=3, help='Best of this many imports is reported.')
+    imports_parser.set_defaults(func=imports)
+
+    arguments = parser.parse_args()
+    arguments.func(arguments)
@@ -0,0 +1,210 @@
+"""
+AIkoDevices.py
+
+Audio device lookup for Aiko's scripts. Audio endpoints are enumerated through a platform backend (pactl on Linux,
+with PulseAudio or PipeWire, and pnputil on Windows) and kept in a DeviceRegistry, which only enumerates them again once
+its cached list is older than a set time to live. Devices can be looked up by name (or part of it) or by ID.
+
+Requirements:
+- AIkoINIhandler.py (47 or greater).
+
+Changelog:
+
+001:
+- Initial release. Added AudioDevice tuple, PactlBackend, PnputilBackend and DeviceRegistry classes, and
+get_device_registry function.
+"""
+import os
+import sys
+import time
+import shutil
+import subprocess
+from threading import Lock
+from collections import namedtuple
+from AIkoINIhandler import load_config
+
+# an audio endpoint. kind is either 'input' (microphones) or 'output' (speakers)
+AudioDevice = namedtuple('AudioDevice', ['id', 'name', 'kind'])
+
+# registry shared by every script, created on first use
+device_registry = None
+device_registry_lock = Lock()
+
+
+# ------------------------------------------ BACKENDS -----------------------------------------------------------------
+
+
+def parse_blocks(text: str):
+    """
+    Splits "key: value" listings (as printed by pactl and pnputil) into a list of dictionaries, one per block of lines.
+    Blocks are separated by empty lines. Nested lines are skipped.
+    """
+    blocks = []
+    block = None
+    for line in text.splitlines():
+        if not line.strip():
+            block = None
+            continue
+
+        # pactl indents its fields with one tab, and nests properties and ports under them with more
+        if line.startswith('\t\t'):
+            continue
+
+        if block is None:
+            block = {'header': line.strip()}
+            blocks.append(block)
+
+        key, separator, value = line.strip().partition(':')
+        if separator and key not in block:
+            block[key.strip()] = value.strip()
+
+    return blocks
+
+
+class PactlBackend:
+    """
+    Enumerates the sinks (outputs) and sources (inputs) of PulseAudio, or PipeWire's PulseAudio server, through pactl.
+    Devices are identified by their PulseAudio name, and named by their description.
+    """
+    def enumerate(self) -> list:
+        devices = []
+        for kind, listing in (('output', 'sinks'), ('input', 'sources')):
+            # field names are translated in other locales
+            result = subprocess.run(['pactl', 'list', listing], capture_output=True, text=True,
+                                    env={**os.environ, 'LC_ALL': 'C'})
+            if result.returncode != 0:
+                raise RuntimeError(f'pactl list {listing} failed: {result.stderr.strip()}')
+
+            for block in parse_blocks(result.stdout):
+                if 'Name' in block:
+                    devices.append(AudioDevice(block['Name'], block.get('Description', block['Name']), kind))
+
+        return devices
+
+
+class PnputilBackend:
+    """
+    Enumerates the connected audio endpoints through pnputil. Devices are identified by their endpoint ID (the part of
+    their instance ID from the first curly bracket onwards), which is what Azure's speech SDK expects.
+    """
+    def enumerate(self) -> list:
+        result = subprocess.run(['pnputil', '/enum-devices', '/connected', '/class', 'AudioEndpoint'],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f'pnputil failed: {result.stdout.strip()}')
+
+        devices = []
+        for block in parse_blocks(result.stdout):
+            instance_id = block.get('Instance ID', '')
+            if '{' not in instance_id or 'Device Description' not in block:
+                continue
+
+            endpoint_id = instance_id[instance_id.index('{'):]
+            # endpoint IDs start with {0.0.0 for render (output) devices and {0.0.1 for capture (input) devices
+            kind = 'input' if endpoint_id.startswith('{0.0.1.') else 'output'
+            devices.append(AudioDevice(endpoint_id, block['Device Description'], kind))
+
+        return devices
+
+
+def create_backend():
+    """
+    Returns the device backend for the current platform, or None if there isn't one.
+    """
+    if sys.platform == 'win32':
+        return PnputilBackend()
+    if shutil.which('pactl') is not None:
+        return PactlBackend()
+    return None
+
+
+# ------------------------------------------ REGISTRY -----------------------------------------------------------------
+
+
+class DeviceRegistry:
+    """
+    Keeps the list of audio devices enumerated by a backend, enumerating them again only once the list is older than
+    its time to live. Thread safe.
+
+    Parameters:
+        backend (optional): Object with an enumerate() method returning a list of AudioDevices. Chosen according to the
+        platform if not given.
+        ttl (float): Seconds an enumeration is kept for. 0 or less keeps it until refresh is called.
+
+    Public Methods:
+    - devices(kind : str) -> list: Every device, or only the ones of the given kind ('input' or 'output').
+    - find(query : str, kind : str) -> AudioDevice: Looks a device up by ID or name. Returns None if not found.
+    - endpoint_id(query : str, kind : str) -> str: The found device's ID, or an empty string if not found.
+    - refresh(): Enumerates the devices again.
+    """
+    def __init__(self, backend=None, ttl: float = 300.0):
+        self.__backend = backend if backend is not None else create_backend()
+        self.__ttl = ttl
+
+        self.__devices = None
+        self.__enumerated_at = 0.0
+        self.__lock = Lock()
+
+    def __enumerate(self):
+        devices = []
+        if self.__backend is not None:
+            try:
+                devices = self.__backend.enumerate()
+            except (OSError, RuntimeError) as e:
+                # failures are cached too, so they aren't retried by every lookup until the ttl runs out
+                print('AIkoDevices.py:')
+                print(f"Couldn't enumerate audio devices: {e}")
+                print()
+
+        self.__devices = devices
+        self.__enumerated_at = time.monotonic()
+
+    def refresh(self):
+        with self.__lock:
+            self.__enumerate()
+
+    def devices(self, kind: str = None) -> list:
+        with self.__lock:
+            if self.__devices is None or (0 < self.__ttl <= time.monotonic() - self.__enumerated_at):
+                self.__enumerate()
+            devices = self.__devices
+
+        return [device for device in devices if kind is None or device.kind == kind]
+
+    def find(self, query: str, kind: str = None):
+        """
+        Looks a device up by its exact ID, then by its exact name, then by part of its name. Names are matched
+        regardless of letter case.
+        """
+        devices = self.devices(kind)
+        lowered = query.lower()
+
+        for matches in (lambda device: device.id == query,
+                        lambda device: device.name.lower() == lowered,
+                        lambda device: lowered in device.name.lower()):
+            for device in devices:
+                if matches(device):
+                    return device
+
+        return None
+
+    def endpoint_id(self, query: str, kind: str = None) -> str:
+        device = self.find(query, kind)
+        return '' if device is None else device.id
+
+
+def get_device_registry():
+    """
+    Returns the DeviceRegistry shared by every script, creating it on first use.
+    """
+    global device_registry
+
+    with device_registry_lock:
+        if device_registry is None:
+            device_registry = DeviceRegistry(ttl=load_config().getfloat('VOICE', 'device_cache_ttl'))
+        return device_registry
+
+
+if __name__ == '__main__':
+    for audio_device in get_device_registry().devices():
+        print(f'{audio_device.kind:<8}{audio_device.name}\n        {audio_device.id}')
@@ -0,0 +1,333 @@
+"""
+AIkoFrontend.py
+
+User interfaces for Livestream.py. Aiko's loops only talk to a Frontend, so the Tk GUI (LiveGUI, in AIkoGUITools.py)
+can be swapped for the HeadlessFrontend, which needs no display, when running on a server or in benchmarks.
+
+Requirements:
+- AIko.py (170beta or greater)
+- AIkoStreamingTools.py (027 or greater)
+
+Changelog:
+
+001:
+- Initial release. Added Frontend and HeadlessFrontend classes. Moved CommandLine and UIUpdateQueue classes from
+AIkoGUITools.py (20).
+"""
+import sys
+from datetime import datetime
+from collections import deque
+from threading import Thread, Lock, Event
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+
+
+class CommandLine:
+    """
+    A simple command line interface class that associates commands with functions and allows
+    you to execute functions based on user input.
+
+    Args:
+        commands (dict): A dictionary containing command-function mappings.
+
+    Attributes:
+        __commands (dict): A private dictionary to store the command-function mappings.
+
+    Methods:
+        add_command(command, function):
+            Add a new command and its associated function to the internal command dictionary.
+
+        input(command):
+            Parse the user input, execute the associated function, and handle arguments when provided.
+
+    Example usage:
+        cmd = CommandLine({"print_hello": print_hello})
+        cmd.input("print_hello")
+        Hello, world!
+    """
+    def __init__(self, commands: dict):
+        # command dictionary {"command": function, [...]}
+        self.__commands = commands
+
+    def add_command(self, command: str, function: callable, description: str = ''):
+        """
+        Add a new command and its associated function to the internal command dictionary.
+
+        Args:
+            command (str): The name of the command.
+            function (callable): The function to be executed when the command is called.
+            description (str), optional: A short description which will be included when the help command is called.
+        """
+        self.__commands[command] = (function, description)
+
+    def input(self, command: str):
+        """
+        Parse the user input, execute the associated function, and handle arguments when provided.
+
+        Args:
+            command (str): The user input, which may include a command and an optional argument.
+
+        Returns:
+            bool: True if the command was recognized and executed, False otherwise.
+        """
+        # splits command and argument (when included)
+        command = command.split(maxsplit=1)
+
+        # if command includes an argument
+        if len(command) > 1:
+            if command[0] in self.__commands:
+                try:
+                    # calls recognized function from command dictionary
+                    self.__commands[command[0]][0](command[1])
+                    return True
+                except TypeError as e:
+                    print(e)
+        # if command doesn't include an argument
+        elif command[0] in self.__commands:
+            # calls recognized function from command dictionary
+            self.__commands[command[0]][0]()
+            return True
+
+        return False
+
+    def help(self):
+        help_string = ''
+        for key, value in sorted(self.__commands.items()):
+            if value[1] == '':
+                help_string += f'{key}: No description provided.\n\n'
+            else:
+                help_string += f'{key}: {value[1]}\n\n'
+        return help_string[:-1]
+
+
+class UIUpdateQueue:
+    """
+    Collects UI updates from any thread until the UI's thread takes them. Lines are kept in order per widget, and
+    widget refreshes are collapsed, so a widget refreshed many times between two drains is only redrawn once.
+
+    Parameters:
+        max_lines (int): How many lines are kept per widget between drains. Older lines are discarded.
+
+    Public Methods:
+    - add_line(widget : str, text : str): Queues a line to be appended to a widget.
+    - refresh(widget : str): Queues a widget to be redrawn.
+    - drain() -> tuple: Returns and forgets the queued ({widget: [lines]}, {widgets to redraw}).
+    """
+    def __init__(self, max_lines: int = 2000):
+        self.__max_lines = max_lines
+        self.__lines = {}
+        self.__refreshes = set()
+        self.__lock = Lock()
+
+    def add_line(self, widget: str, text: str):
+        with self.__lock:
+            lines = self.__lines.get(widget)
+            if lines is None:
+                lines = self.__lines[widget] = deque(maxlen=self.__max_lines)
+            lines.append(text)
+
+    def refresh(self, widget: str):
+        with self.__lock:
+            self.__refreshes.add(widget)
+
+    def drain(self):
+        with self.__lock:
+            lines = {widget: list(widget_lines) for widget, widget_lines in self.__lines.items() if widget_lines}
+            refreshes = self.__refreshes
+
+            self.__lines.clear()
+            self.__refreshes = set()
+
+        return lines, refreshes
+
+
+class Frontend:
+    """
+    Base class for user interfaces. Everything below can be called from any thread.
+
+    Public Methods:
+    - print(text : str): Prints to the conversation log.
+    - print_to_cmdl(text : str): Prints to the command line.
+    - update_chat_widget(): Called whenever the chat messages in queue change.
+    - update_side_prompts_widget(): Called whenever the side prompts change.
+    - add_command(command : str, func : callable, desc : str): Adds a command to the command line.
+    - bind_mute_button(func : callable): Sets the function called when the microphone is muted or un-muted.
+    - toggle_mute(): Mutes or un-mutes the microphone.
+    - toggle_chat_pause(): Pauses or un-pauses the chat queue.
+    - set_close_protocol(protocol : callable): Sets the function called when the user closes the frontend.
+    - run(): Runs the frontend, blocking until it's closed.
+    - close_app(): Closes the frontend.
+    """
+    def print(self, text: str):
+        raise NotImplementedError
+
+    def print_to_cmdl(self, text: str):
+        raise NotImplementedError
+
+    def update_chat_widget(self):
+        pass
+
+    def update_side_prompts_widget(self):
+        pass
+
+    def add_command(self, command: str, func: callable, desc: str = ''):
+        raise NotImplementedError
+
+    def bind_mute_button(self, func: callable):
+        raise NotImplementedError
+
+    def toggle_mute(self):
+        raise NotImplementedError
+
+    def toggle_chat_pause(self):
+        raise NotImplementedError
+
+    def set_close_protocol(self, protocol: callable):
+        raise NotImplementedError
+
+    def run(self):
+        raise NotImplementedError
+
+    def close_app(self):
+        raise NotImplementedError
+
+
+class HeadlessFrontend(Frontend):
+    """
+    Frontend without a GUI. Prints to the console, and takes commands from the console and, optionally, from control
+    connections: plain TCP connections sending one command per line, which are sent everything printed to the command
+    line.
+
+    Parameters:
+        queue (MasterQueue): Queue whose chat can be paused.
+        commands (dict, optional): Commands for the command line.
+        control_host (str): Address control connections are accepted on.
+        control_port (int): Port control connections are accepted on. 0 disables them.
+        console (bool): Whether commands are read from the console.
+    """
+    def __init__(self, queue, commands: dict = None, control_host: str = '127.0.0.1', control_port: int = 0,
+                 console: bool = True):
+        self.__interpreter = CommandLine(commands if commands is not None else {})
+        self.__interpreter.add_command('help', self.help, 'Prints all commands.')
+
+        self.__pool = queue.get_chat_messages()
+        self.__mute = None
+        self.__close_protocol = self.close_app
+        self.__closed = Event()
+        self.__console = console
+
+        self.__output_lock = Lock()
+        self.__clients = []
+
+        self.__server = None
+        self.__serving = False
+        if control_port:
+            self.__server = ThreadingTCPServer((control_host, control_port), self.__build_handler())
+            self.__server.daemon_threads = True
+
+    def __build_handler(self):
+        frontend = self
+
+        class Handler(StreamRequestHandler):
+            def handle(self):
+                frontend.add_client(self.wfile)
+                try:
+                    for line in self.rfile:
+                        frontend.execute(line.decode('utf-8', errors='replace'))
+                except OSError:
+                    pass
+                finally:
+                    frontend.remove_client(self.wfile)
+
+        return Handler
+
+    def add_client(self, client):
+        with self.__output_lock:
+            self.__clients.append(client)
+
+    def remove_client(self, client):
+        with self.__output_lock:
+            if client in self.__clients:
+                self.__clients.remove(client)
+
+    def __write(self, line: str, to_clients: bool):
+        with self.__output_lock:
+            print(line, flush=True)
+
+            if to_clients:
+                for client in list(self.__clients):
+                    try:
+                        client.write(f'{line}\n'.encode('utf-8'))
+                        client.flush()
+                    except OSError:
+                        self.__clients.remove(client)
+
+    @staticmethod
+    def __timestamp():
+        time = datetime.now()
+        return f'[{time.hour:02d}:{time.minute:02d}:{time.second:02d}]'
+
+    def print(self, text: str):
+        self.__write(f'{self.__timestamp()} {text}', False)
+
+    def print_to_cmdl(self, text: str = ''):
+        self.__write(f'{self.__timestamp()} > {text}', True)
+
+    def add_command(self, command: str, func: callable, desc: str = ''):
+        self.__interpreter.add_command(command, func, desc)
+
+    def execute(self, command: str):
+        """
+        Runs a command line command, as if it had been typed in the console.
+        """
+        command = command.strip()
+        if not command:
+            return
+
+        if not self.__interpreter.input(command):
+            self.print_to_cmdl('Invalid command.')
+
+    def bind_mute_button(self, func: callable):
+        self.__mute = func
+
+    def toggle_mute(self):
+        if self.__mute is not None:
+            self.__mute()
+
+    def toggle_chat_pause(self):
+        self.__pool.pause()
+
+    def set_close_protocol(self, protocol: callable):
+        self.__close_protocol = protocol
+
+    def __read_console(self):
+        for line in sys.stdin:
+            self.execute(line)
+
+    def run(self):
+        if self.__server is not None:
+            Thread(target=self.__server.serve_forever, name='control-server', daemon=True).start()
+            self.__serving = True
+            host, port = self.__server.server_address[:2]
+            self.print_to_cmdl(f'Accepting control connections on {host}:{port}.')
+
+        # the console is read on a separate thread, so the main thread can still be interrupted with ctrl+c. once the
+        # console is closed (EG, when running in the background), commands can still come from control connections
+        if self.__console:
+            Thread(target=self.__read_console, name='console', daemon=True).start()
+
+        try:
+            while not self.__closed.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            self.__close_protocol()
+
+    def close_app(self):
+        self.__closed.set()
+        if self.__server is not None:
+            # shutdown waits for serve_forever to return, so it would block if the server was never started
+            if self.__serving:
+                self.__server.shutdown()
+            self.__server.server_close()
+
+    def help(self):
+        self.print_to_cmdl(f'\n\n{self.__interpreter.help()}')
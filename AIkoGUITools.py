@@ -2,8 +2,9 @@
 AIkoGUITools.py
 
 Requirements:
-- AIko.py (159beta or greater)
+- AIko.py (170beta or greater)
 - AIkoStreamingTools.py (027 or greater)
+- AIkoFrontend.py (001 or greater)
 - uiassets folder
 
 Changelog:
@@ -31,11 +32,25 @@ Changelog:
 - Added press method to ImageButton class, which invokes the buttons command while also updating its state.
 18:
 - Updated to work with Aiko.py 159beta.
+19:
+- Selected side prompts are now deleted from last to first, as MessageList shifts items back after a deletion.
+20:
+- Added UIUpdateQueue class. LiveGUI's print, print_to_cmdl, update_chat_widget and update_side_prompts_widget can now be
+called from any thread: they queue the update, and the Tk mainloop applies every queued update at a fixed refresh
+rate. Repeated chat and side prompt refreshes are done once per frame.
+- Log and command line text widgets now keep at most a set number of lines (configurable).
+21:
+- Moved CommandLine and UIUpdateQueue classes to AIkoFrontend.py. LiveGUI is now a Frontend, and gained toggle_mute
+and toggle_chat_pause methods.
+22:
+- Side prompts are displayed from a copy of their MessageList, so the GUI no longer iterates the deque while other
+threads add to it.
 """
 from tkinter import *
 from tkinter import ttk
 from AIkoStreamingTools import MasterQueue
 from AIko import AIko, MessageList
+from AIkoFrontend import Frontend, CommandLine, UIUpdateQueue
 from datetime import datetime
 
 
@@ -46,7 +61,8 @@ def return_message_content(item):
 
 
 def parse_message_list(message_list: MessageList):
-    return list(map(return_message_content, message_list.get_reference()))
+    # get_items copies the deque in one step, so other threads adding items can't break the iteration
+    return list(map(return_message_content, message_list.get_items()))
 
 
 class ImageButton(ttk.Button):
@@ -71,89 +87,29 @@ class ImageButton(ttk.Button):
         self.click_function()
 
 
-class CommandLine:
+class LiveGUI(Frontend):
     """
-    A simple command line interface class that associates commands with functions and allows
-    you to execute functions based on user input.
-
-    Args:
-        commands (dict): A dictionary containing command-function mappings.
-
-    Attributes:
-        __commands (dict): A private dictionary to store the command-function mappings.
-
-    Methods:
-        add_command(command, function):
-            Add a new command and its associated function to the internal command dictionary.
-
-        input(command):
-            Parse the user input, execute the associated function, and handle arguments when provided.
-
-    Example usage:
-        cmd = CommandLine({"print_hello": print_hello})
-        cmd.input("print_hello")
-        Hello, world!
+    Tk frontend for livestreaming. Printing and widget updates are thread safe: they are queued and applied by the Tk
+    mainloop every frame.
+
+    Parameters:
+        queue (MasterQueue): Queue whose chat messages are displayed.
+        char (AIko): Character whose side prompts are displayed.
+        commands (dict, optional): Commands for the command line.
+        refresh_rate (float): How many times per second queued updates are applied.
+        max_lines (int): How many lines the log and command line widgets keep.
     """
-    def __init__(self, commands: dict):
-        # command dictionary {"command": function, [...]}
-        self.__commands = commands
-
-    def add_command(self, command: str, function: callable, description: str = ''):
-        """
-        Add a new command and its associated function to the internal command dictionary.
-
-        Args:
-            command (str): The name of the command.
-            function (callable): The function to be executed when the command is called.
-            description (str), optional: A short description which will be included when the help command is called.
-        """
-        self.__commands[command] = (function, description)
-
-    def input(self, command: str):
-        """
-        Parse the user input, execute the associated function, and handle arguments when provided.
-
-        Args:
-            command (str): The user input, which may include a command and an optional argument.
-
-        Returns:
-            bool: True if the command was recognized and executed, False otherwise.
-        """
-        # splits command and argument (when included)
-        command = command.split(maxsplit=1)
-
-        # if command includes an argument
-        if len(command) > 1:
-            if command[0] in self.__commands:
-                try:
-                    # calls recognized function from command dictionary
-                    self.__commands[command[0]][0](command[1])
-                    return True
-                except TypeError as e:
-                    print(e)
-        # if command doesn't include an argument
-        elif command[0] in self.__commands:
-            # calls recognized function from command dictionary
-            self.__commands[command[0]][0]()
-            return True
-
-        return False
-
-    def help(self):
-        help_string = ''
-        for key, value in sorted(self.__commands.items()):
-            if value[1] == '':
-                help_string += f'{key}: No description provided.\n\n'
-            else:
-                help_string += f'{key}: {value[1]}\n\n'
-        return help_string[:-1]
-
-
-class LiveGUI:
-    def __init__(self, queue: MasterQueue, char: AIko, commands: dict = None):
+    def __init__(self, queue: MasterQueue, char: AIko, commands: dict = None, refresh_rate: float = 20.0,
+                 max_lines: int = 2000):
         if commands is None:
             commands = {}
 
+        # updates from other threads, applied every frame
+        self.__updates = UIUpdateQueue(max_lines)
+        self.__frame_interval = max(1, int(1000 / refresh_rate))
+        self.__max_lines = max_lines
+        self.__closed = False
+
         # CommandLine object for reading terminal commands
         self.__interpreter = CommandLine(commands)
 
@@ -189,6 +145,8 @@ class LiveGUI:
         # adds help command to interpreter
         self.__interpreter.add_command('help', self.help, 'Prints all commands.')
 
+        self.__root.after(self.__frame_interval, self.__apply_updates)
+
     def __set_frame_weights(self):
         self.__root.columnconfigure(0, weight=1)
         self.__root.rowconfigure(0, weight=1)
@@ -269,12 +227,7 @@ class LiveGUI:
         time = datetime.now()
         hour = f'[{time.hour:02d}:{time.minute:02d}:{time.second:02d}]'
 
-        self.__cmd_terminal['state'] = 'normal'
-        self.__cmd_terminal.insert(END, f'{hour} {text}\n')
-        self.__cmd_terminal['state'] = 'disabled'
-
-        if not self.__scrolling_cmd:
-            self.__cmd_terminal.see(END)
+        self.__updates.add_line('cmd', f'{hour} {text}\n')
 
     def __execute_command(self, anything=None):
         command = self.__cmd_entry.get()
@@ -420,20 +373,21 @@ class LiveGUI:
     def update_chat_widget(self):
         """
         Must be called each time the MessagePool parameter is modified, so the widget can display the messages
-        properly.
+        properly. The widget is redrawn on the next frame.
         """
-        self.__chat_var.set(self.__pool.get_pool_reference())
+        self.__updates.refresh('chat')
 
     def update_side_prompts_widget(self):
         """
-        Must be called each time the MessagePool parameter is modified, so the widget can display the messages
-        properly.
+        Must be called each time the side prompts are modified, so the widget can display them properly. The widget is
+        redrawn on the next frame.
         """
-        self.__sp_var.set(value=parse_message_list(self.__side_prompts))
+        self.__updates.refresh('side_prompts')
 
     def __delete_side_prompt(self, anything=None):
         selection = self.__sp_listbox.curselection()
-        for i in selection:
+        # deletes from last to first so the remaining indexes stay valid
+        for i in reversed(selection):
             self.__side_prompts.delete_item(i)
         # clears selection
         self.__sp_listbox.selection_clear(selection[0], selection[-1])
@@ -444,22 +398,58 @@ class LiveGUI:
         time = datetime.now()
         hour = f'[{time.hour:02d}:{time.minute:02d}:{time.second:02d}]'
 
-        self.__log_terminal['state'] = 'normal'
-        self.__log_terminal.insert(END, f'{hour} {text}\n')
-        self.__log_terminal['state'] = 'disabled'
+        self.__updates.add_line('log', f'{hour} {text}\n')
+
+    def __append_lines(self, terminal: Text, lines: list, scrolling: bool):
+        terminal['state'] = 'normal'
+        terminal.insert(END, ''.join(lines))
+
+        # keeps the last max_lines lines. the text always ends with an empty line after the last newline
+        excess = int(terminal.index('end-1c').split('.')[0]) - 1 - self.__max_lines
+        if excess > 0:
+            terminal.delete('1.0', f'{excess + 1}.0')
+        terminal['state'] = 'disabled'
 
-        if not self.__scrolling_log:
-            self.__log_terminal.see(END)
+        if not scrolling:
+            terminal.see(END)
+
+    def __apply_updates(self):
+        """
+        Applies every queued update, then schedules itself for the next frame. Runs on the Tk mainloop.
+        """
+        if self.__closed:
+            return
+
+        lines, refreshes = self.__updates.drain()
+
+        if 'log' in lines:
+            self.__append_lines(self.__log_terminal, lines['log'], self.__scrolling_log)
+        if 'cmd' in lines:
+            self.__append_lines(self.__cmd_terminal, lines['cmd'], self.__scrolling_cmd)
+
+        if 'chat' in refreshes:
+            self.__chat_var.set(self.__pool.get_pool_reference())
+        if 'side_prompts' in refreshes:
+            self.__sp_var.set(value=parse_message_list(self.__side_prompts))
+
+        self.__root.after(self.__frame_interval, self.__apply_updates)
 
     def run(self):
         self.__root.mainloop()
 
     def close_app(self):
+        self.__closed = True
         self.__root.destroy()
 
     def bind_mute_button(self, func: callable):
         self.bp_button_mute.configure(command=func)
 
+    def toggle_mute(self):
+        self.bp_button_mute.press()
+
+    def toggle_chat_pause(self):
+        self.chat_button_pause.press()
+
     def set_close_protocol(self, protocol: callable):
         self.__root.protocol("WM_DELETE_WINDOW", protocol)
 
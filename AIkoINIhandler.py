@@ -25,11 +25,61 @@ Changelog:
 - Added FRAME_OF_MIND section with irritability_threshold option.
 29:
 - Added mood_change_threshold option to FRAME_OF_MIND section.
+30:
+- Added stream_completions option to GENERAL.
+31:
+- Added synthesis_backend and ready_clips options to VOICE section.
+32:
+- Added mem_slots option to GENERAL.
+33:
+- Added context_token_budget option to GENERAL.
+34:
+- Added completion_attempts, hedge_percentile and api_base options to GENERAL.
+35:
+- Added sentiment_backend option to FRAME_OF_MIND section.
+36:
+- Added mood_queue_size, mood_overflow_policy and mood_flush_timeout options to FRAME_OF_MIND section.
+37:
+- Added log_flush_interval, log_flush_size and jsonl_log options to GENERAL section.
+38:
+- Added stats_dump_interval option to LIVESTREAM section.
+39:
+- Added prompt_reload_interval option to GENERAL section.
+40:
+- Added chat_buffer_size, chat_forward_interval, chat_forward_count, chat_duplicate_window and chat_max_age options
+to LIVESTREAM section.
+41:
+- Added chat_pool_size, pool_recency_weight, pool_subscriber_weight, pool_length_weight, pool_question_weight and
+pool_unanswered_weight options to LIVESTREAM section.
+42:
+- Added channel option to LIVESTREAM section.
+43:
+- Added listen_ip option to REMOTE_SIDE_PROMPTING section. Livestream.py now listens for remote side prompts, and
+server_ip is the address RemoteSP.py connects to.
+44:
+- Added ui_refresh_rate and ui_max_lines options to LIVESTREAM section.
+45:
+- Added frontend and control_port options to LIVESTREAM section.
+46:
+- Added load_config function, which returns the settings shared by every script. The INI file is only parsed (and
+completed) the first time it's called, instead of whenever AIko.py is imported.
+47:
+- Added device_cache_ttl option to VOICE section.
+48:
+- Added phrase_cache_memory, phrase_cache_disk (both in megabytes) and phrase_cache_folder options to VOICE section.
+49:
+- listen_ip now defaults to 127.0.0.1, so only local operators can send side prompts unless it's changed. Added secret
+option to REMOTE_SIDE_PROMPTING section, which remote operators must send before their prompts are accepted.
 '''
 
 from configparser import ConfigParser
+from threading import Lock
 import os
 
+# settings shared by every script, loaded on first use
+config = None
+config_lock = Lock()
+
 def handle_ini(ini : str = 'AIkoPrefs.ini'):
 
     print(f'AIkoINIhandler.py: Parsing {ini}...')
@@ -51,8 +101,18 @@ def handle_ini(ini : str = 'AIkoPrefs.ini'):
         ('breaker_phrase', 'code red'),
         ('dynamic_scenarios', 'True'),
         ('completion_timeout', '10'),
+        ('completion_attempts', '3'),
+        ('hedge_percentile', '95'),
+        ('api_base', 'https://api.openai.com/v1'),
         ('max_side_prompts', '5'),
+        ('mem_slots', '10'),
+        ('context_token_budget', '3000'),
         ('model', 'gpt-3.5-turbo'),
+        ('stream_completions', 'True'),
+        ('log_flush_interval', '1.0'),
+        ('log_flush_size', '8192'),
+        ('jsonl_log', 'False'),
+        ('prompt_reload_interval', '2.0'),
     ]
 
     VOICE = [
@@ -63,11 +123,21 @@ def handle_ini(ini : str = 'AIkoPrefs.ini'):
         ('default_style', 'neutral'),
         ('default_rate', '1.0'),
         ('default_pitch', '0.0'),
+        ('synthesis_backend', 'azure'),
+        ('ready_clips', '2'),
+        ('device_cache_ttl', '300'),
+        ('phrase_cache_memory', '32'),
+        ('phrase_cache_disk', '256'),
+        ('phrase_cache_folder', 'cache/phrases'),
     ]
 
     FRAME_OF_MIND = [
         ('irritability_threshold', '300'),
         ('mood_change_threshold', '600'),
+        ('sentiment_backend', 'azure'),
+        ('mood_queue_size', '20'),
+        ('mood_overflow_policy', 'coalesce'),
+        ('mood_flush_timeout', '2.0'),
     ]
 
     SPONTANEOUS_TALKING = [
@@ -77,17 +147,36 @@ def handle_ini(ini : str = 'AIkoPrefs.ini'):
 
     LIVESTREAM = [
         ('platform', 'Twitch'),
+        ('channel', 'aikochannel'),
         ('liveid', ''),
         ('toggle_listening', 'Page Down'),
         ('side_prompt', 'Page Up'),
         ('voice_message_expiration_time', '10.0'),
         ('chat_min_cooldown', '2'),
         ('chat_max_cooldown', '6'),
+        ('stats_dump_interval', '60'),
+        ('chat_buffer_size', '200'),
+        ('chat_forward_interval', '1.0'),
+        ('chat_forward_count', '2'),
+        ('chat_duplicate_window', '30'),
+        ('chat_max_age', '60'),
+        ('chat_pool_size', '10'),
+        ('pool_recency_weight', '2.0'),
+        ('pool_subscriber_weight', '2.0'),
+        ('pool_length_weight', '0.5'),
+        ('pool_question_weight', '1.5'),
+        ('pool_unanswered_weight', '2.0'),
+        ('ui_refresh_rate', '20'),
+        ('ui_max_lines', '2000'),
+        ('frontend', 'gui'),
+        ('control_port', '0'),
     ]
 
     REMOTE_SIDE_PROMPTING = [
         ('port', '5004'),
         ('server_ip', ''),
+        ('listen_ip', '127.0.0.1'),
+        ('secret', ''),
     ]
 
     # saves the lists containing the values in a dictionary, with their respective sections as the key
@@ -128,3 +217,19 @@ def handle_ini(ini : str = 'AIkoPrefs.ini'):
 
     with open(ini, 'w') as configfile:
         config.write(configfile)
+
+
+def load_config():
+    """
+    Returns the settings in AIkoPrefs.ini, shared by every script. The first call adds any missing values to the file.
+    """
+    global config
+
+    with config_lock:
+        if config is None:
+            handle_ini()
+
+            config = ConfigParser()
+            config.read('AIkoPrefs.ini')
+
+        return config
@@ -0,0 +1,129 @@
+"""
+AIkoMatcher.py
+
+Keyword matching for Aiko's scripts. A Matcher is compiled once from a set of keywords, and can then either match the
+longest keyword at the start of a text (prefix trie) or find every keyword occurring anywhere in it (Aho-Corasick),
+in a single pass over the text. Matching time doesn't grow with the number of keywords.
+
+Changelog:
+
+001:
+- Initial release. Added Matcher class and Match tuple.
+"""
+from collections import deque, namedtuple
+
+# a keyword found in a text. start and end are the keyword's span in the text (text[start:end])
+Match = namedtuple('Match', ['keyword', 'start', 'end', 'payload'])
+
+
+class Matcher:
+    """
+    A compiled set of keywords, each with a payload returned along with its matches.
+
+    Parameters:
+        keywords (dict): Keywords as keys, payloads as values. Empty keywords are ignored.
+        ignore_case (bool): Whether matching ignores letter case. Matches still report the keywords as given.
+
+    Public Methods:
+    - match_prefix(text : str) -> Match: Returns the longest keyword the text starts with, or None.
+    - find_all(text : str): Yields every keyword occurrence in the text (overlapping ones included), by end position.
+    - search(text : str) -> Match: Returns the first keyword occurrence to end in the text, or None.
+    """
+    __slots__ = ('__keywords', '__payloads', '__ignore_case', '__goto', '__fail', '__terminal', '__outputs')
+
+    def __init__(self, keywords: dict, ignore_case: bool = False):
+        self.__ignore_case = ignore_case
+        self.__keywords = []
+        self.__payloads = []
+
+        # trie: each node is a {character: node} dictionary. node 0 is the root
+        self.__goto = [{}]
+        # index of the keyword ending exactly at each node, if any
+        self.__terminal = [None]
+
+        for keyword, payload in keywords.items():
+            if not keyword:
+                continue
+
+            node = 0
+            for character in keyword.lower() if ignore_case else keyword:
+                next_node = self.__goto[node].get(character)
+                if next_node is None:
+                    next_node = len(self.__goto)
+                    self.__goto[node][character] = next_node
+                    self.__goto.append({})
+                    self.__terminal.append(None)
+                node = next_node
+
+            if self.__terminal[node] is None:
+                self.__terminal[node] = len(self.__keywords)
+                self.__keywords.append(keyword)
+                self.__payloads.append(payload)
+
+        self.__build_failure_links()
+
+    def __build_failure_links(self):
+        # aho-corasick failure links, built breadth first. each node falls back to the node of its longest proper
+        # suffix present in the trie, and outputs every keyword ending at it or at any of its fallbacks
+        self.__fail = [0] * len(self.__goto)
+        self.__outputs = [() if terminal is None else (terminal,) for terminal in self.__terminal]
+
+        queue = deque(self.__goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for character, child in self.__goto[node].items():
+                queue.append(child)
+
+                fallback = self.__fail[node]
+                while fallback and character not in self.__goto[fallback]:
+                    fallback = self.__fail[fallback]
+                self.__fail[child] = self.__goto[fallback].get(character, 0)
+
+                self.__outputs[child] += self.__outputs[self.__fail[child]]
+
+    def __len__(self):
+        return len(self.__keywords)
+
+    def __match(self, index: int, start: int, end: int):
+        return Match(self.__keywords[index], start, end, self.__payloads[index])
+
+    def match_prefix(self, text: str):
+        goto = self.__goto
+        terminal = self.__terminal
+
+        node = 0
+        best = None
+        for i, character in enumerate(text):
+            if self.__ignore_case:
+                character = character.lower()
+
+            node = goto[node].get(character)
+            if node is None:
+                break
+            if terminal[node] is not None:
+                best = (terminal[node], i + 1)
+
+        if best is None:
+            return None
+        return self.__match(best[0], 0, best[1])
+
+    def find_all(self, text: str):
+        goto = self.__goto
+        fail = self.__fail
+        outputs = self.__outputs
+
+        node = 0
+        for i, character in enumerate(text):
+            # lowered one character at a time, so the spans match the original text
+            if self.__ignore_case:
+                character = character.lower()
+
+            while node and character not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(character, 0)
+
+            for index in outputs[node]:
+                yield self.__match(index, i + 1 - len(self.__keywords[index]), i + 1)
+
+    def search(self, text: str):
+        return next(self.find_all(text), None)
@@ -0,0 +1,633 @@
+"""
+AIkoSession.py
+
+Everything needed to run one character on one channel (a StreamSession), and an Orchestrator which runs several of
+them in one process, sharing the scheduler, completion client, sentiment service and log writer between them.
+
+Requirements:
+- AIko.py (181beta or greater) and its requirements.
+- AIkoStreamingTools.py (047 or greater).
+- AIkoINIhandler.py (46 or greater).
+- AIkoVoice.py (117 or greater) and its requirements.
+- AIkoTracing.py (001 or greater).
+- AIkoMatcher.py (001 or greater).
+- AIkoFrontend.py (001 or greater).
+
+packages:
+- pip install pytchat (for YouTube chat)
+
+Changelog:
+
+001:
+- Initial release. Moved ChatLoop, AnswerLoops, parse_msg and prefetch from Livestream.py (030), and made them
+independent of Livestream's globals: each loop can be stopped on its own, and ChatLoop reads the channel it was given.
+- Added StreamSession and Orchestrator classes.
+002:
+- ChatLoop and StreamSession can be given the Twitch chat server's address and token, EG to read from a local stub
+server.
+- Loop threads are now named, so they can be told apart when profiling.
+003:
+- ChatLoop, AnswerLoops and StreamSession now report to a Frontend (AIkoFrontend.py), so they can run without a GUI.
+004:
+- Settings are read through AIkoINIhandler's load_config, so the INI file is only parsed once per process.
+005:
+- Fixed AnswerLoops reading spontaneous and generic messages from the shared prompts folder instead of its session's.
+006:
+- Messages read aloud get their rate from reading_rate, which always picks the same rate for the same text, so their
+audio can be reused by the synthesizer's phrase cache.
+007:
+- prefetch's generator raises the exceptions of the iterable it consumes, so a failed streamed completion is no longer
+said as if it had finished.
+008:
+- A StreamSession's config is also used by its AnswerLoops and MasterQueue, instead of only by its ingestor and
+character.
+"""
+import os
+import zlib
+from time import sleep, time
+from queue import Queue, Empty
+from threading import Thread, Event, Lock
+from configparser import ConfigParser
+from random import Random, choice, uniform, randint
+
+from AIko import AIko, PromptRepository, txt_to_list, get_log_writer
+from AIkoINIhandler import load_config
+from AIkoVoice import Synthesizer
+from AIkoStreamingTools import MasterQueue, ChatIngestor, Pytwitch, Scheduler, default_scheduler
+from AIkoTracing import get_tracer
+from AIkoMatcher import Matcher
+from AIkoFrontend import Frontend
+
+# ------------------------------------------------ FUNCTIONS -----------------------------------------------------------
+
+
+def reading_rate(text: str):
+    """
+    Returns the rate a message is read aloud at, between 1.2 and 1.4. The rate is picked from the text itself, so the
+    same message is always read the same way and its audio can be cached.
+    """
+    return round(Random(zlib.crc32(text.encode('utf-8'))).uniform(1.2, 1.4), 2)
+
+
+def parse_msg(msg: str, character: str = ':', after=False):
+    if after:
+        return msg[msg.index(character) + 2:]
+
+    return msg[: msg.index(character)]
+
+
+def prefetch(iterable):
+    """
+    Consumes the given iterable on a separate thread and returns a generator over its items. Useful for keeping slow
+    producers (such as streamed completions) running while the consumer is busy doing something else. Exceptions
+    raised by the iterable are raised again by the generator, once it reaches them.
+    """
+    buffer = Queue()
+    done = object()
+
+    class Failure:
+        def __init__(self, exception: BaseException):
+            self.exception = exception
+
+    def producer():
+        try:
+            for item in iterable:
+                buffer.put(item)
+        except BaseException as e:
+            buffer.put(Failure(e))
+        finally:
+            buffer.put(done)
+
+    def consumer():
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Failure):
+                raise item.exception
+            yield item
+
+    Thread(target=producer, name='prefetch', daemon=True).start()
+    return consumer()
+
+# ------------------------------------------------- CLASSES ------------------------------------------------------------
+
+
+class ChatLoop:
+    def __init__(self, queue: MasterQueue, ingestor: ChatIngestor, ui_app: Frontend, youtube: bool = False,
+                 yt_id: str = None, channel: str = 'aikochannel', twitch_address: tuple = None,
+                 twitch_token: str = None):
+        self.__queue = queue
+        self.__ingestor = ingestor
+        self.__app = ui_app
+        self.__channel = channel
+        # (host, port) of twitch's chat server, and the token used to log into it
+        self.__twitch_address = twitch_address if twitch_address is not None else ('irc.chat.twitch.tv', 6667)
+        self.__twitch_token = twitch_token
+
+        if youtube:
+            import pytchat
+            self.__chat = pytchat.create(video_id=yt_id)
+            self.__loop = self.__loop_youtube
+        else:
+            self.__loop = self.__loop_twitch
+
+        self.__running = False
+
+    def start(self):
+        self.__running = True
+        self.__ingestor.start()
+        Thread(target=self.__loop, name='chat-loop').start()
+
+    def stop(self):
+        self.__running = False
+        self.__ingestor.stop()
+
+    def __skip_message(self, message, author):
+        # skips chat commands
+        if message[0] == '!':
+            return True
+
+        if '@' in message:
+            if self.__channel in message:
+                pass
+            else:
+                return True
+
+        # parses follow alerts and sends them as system messages
+        if author.lower() == 'streamelements' and 'just followed!' in message.lower():
+            follower = message.split(" ", 1)[0][1:]
+            self.__queue.add_message(
+                f'EVENT: {follower} just followed you on Twitch. Thank them! Read their name!', "system")
+            self.__app.print_to_cmdl(f'{follower} just followed. Letting the character know...')
+            return True
+
+        # skips bot replies
+        if author.lower() == 'streamelements':
+            return True
+
+        return False
+
+    def __loop_twitch(self):
+        # starts pytwitch object
+        token = self.__twitch_token
+        if token is None:
+            token = open('keys/key_twitch.txt').read().strip()
+        chat = Pytwitch(token, self.__channel, *self.__twitch_address)
+
+        while self.__running:
+            # blocks until a message is received, timing out every now and then to check whether the loop should stop
+            try:
+                author, message, tags = chat.get_tagged_message(timeout=1.0)
+            except Empty:
+                continue
+            # checks whether message should be skipped (bot commands, etc)
+            if self.__skip_message(message, author):
+                continue
+
+            # the ingestor merges follow-ups from the same author and forwards the best messages to the queue
+            self.__ingestor.submit(author, message, tags)
+
+        chat.close_socket()
+
+    def __loop_youtube(self):
+        while self.__chat.is_alive():
+            if not self.__running:
+                break
+            for c in self.__chat.get().sync_items():
+                if not self.__running:
+                    break
+                self.__ingestor.submit(c.author.name, c.message, {'subscriber': '1' if c.author.isChatSponsor else '0'})
+
+            # pytchat fetches messages in the background, this only sets how often they are collected
+            sleep(0.1)
+
+
+class AnswerLoops:
+    def __init__(self, char: AIko, ui_app: Frontend, queue: MasterQueue, synthesizer: Synthesizer = None,
+                 scheduler: Scheduler = None, prompts_folder: str = 'prompts', config: ConfigParser = None):
+        self.__last_time_spoken = time()
+        self.__running = False
+
+        # aiko object, app object, message queue object
+        self.__char = char
+        self.__app = ui_app
+        self.__queue = queue
+
+        self.__speaking = Event()
+        self.__allow_sb = Event()
+
+        self.__debug_fom = False
+
+        self.__config = load_config() if config is None else config
+
+        self.__stream_completions = self.__config.getboolean('GENERAL', 'stream_completions')
+
+        # silence breaker
+        self.__scheduler = scheduler if scheduler is not None else default_scheduler()
+        self.__sb_lock = Lock()
+        self.__sb_call = None
+        self.__sb_min_time = self.__config.getint('SPONTANEOUS_TALKING', 'min_time')
+        self.__sb_max_time = self.__config.getint('SPONTANEOUS_TALKING', 'max_time')
+        self.__max_silence_time = randint(self.__sb_min_time, self.__sb_max_time)
+        self.__sb_not_before = 0.0
+        self.__system_prompts = txt_to_list(os.path.join(prompts_folder, 'spontaneous_messages.txt'))
+        self.__generic_messages = txt_to_list(os.path.join(prompts_folder, 'generic_messages.txt'))
+
+        # voices aiko
+        self.__synthesizer = synthesizer if synthesizer is not None else Synthesizer()
+        self.__last_utterance = None
+
+        # keyword system
+        self.__keywords = {
+            'DEFAULT_SYS': self.__kw_default,
+            # read only
+            'READ_ONLY': self.__kw_read_only,
+            'READ_ONLY_PARSE': self.__kw_read_only_parse,
+            # read and answer
+            'READ': self.__kw_read,
+            'READ_PARSE': self.__kw_read_parse,
+        }
+        # matches 'KEYWORD:' at the start of system messages
+        self.__keyword_matcher = Matcher({f'{keyword}:': function for keyword, function in self.__keywords.items()})
+
+    # ----------------------------- KEYWORD CALLED FUNCTIONS
+    def __kw_default(self, message: str):
+        answer = self.__get_answer(message, True)
+        self.__app.print(f'(SYS) {message}')
+
+        output = self.__say_answer(answer)
+        self.__app.print(f'Aiko: {output}\n')
+
+        # FOM debug printouts
+        if self.__debug_fom:
+            self.__app.print(f'CURRENT SCORE: {self.__char.fom.check_score()}')
+            self.__app.print(f'NEXT MOOD: {self.__char.context.check_personality()}\n')
+
+    def __kw_read_only(self, message: str, parse=False):
+        self.__app.print(f'(READ){message}\n')
+
+        self.__say(parse_msg(message, after=True) if parse else message, reading=True)
+
+        # adds read message to side prompts so the character can "remember" reading it
+        self.__add_sp(message)
+
+    def __kw_read(self, message: str, parse=False):
+        answer = self.__get_answer(message, True)
+
+        self.__app.print(f'(READ){message}')
+
+        # the answer is synthesized while the message is being read
+        self.__say(parse_msg(message, after=True) if parse else message, reading=True, pause=uniform(0.10, 0.15),
+                   wait=False)
+        output = self.__say_answer(answer)
+
+        self.__app.print(f'Aiko: {output}\n')
+
+        # adds read message to side prompts so the character can "remember" reading it
+        self.__add_sp(message)
+
+        # FOM debug printouts
+        if self.__debug_fom:
+            self.__app.print(f'CURRENT SCORE: {self.__char.fom.check_score()}')
+            self.__app.print(f'NEXT MOOD: {self.__char.context.check_personality()}\n')
+
+    def __kw_read_only_parse(self, message: str):
+        self.__kw_read_only(message, parse=True)
+
+    def __kw_read_parse(self, message: str):
+        self.__kw_read(message, parse=True)
+
+    # ----------------------------------------
+    @property
+    def keywords(self):
+        return sorted(list(self.__keywords.keys()) + self.__char.keywords)
+
+    def __check_for_kw(self, message: str):
+        """
+        Checks if message starts with a keyword, and executes the corresponding keyword function with the rest of the
+        message.
+        """
+        match = self.__keyword_matcher.match_prefix(message)
+        if match is not None:
+            match.payload(message[match.end:])
+            return
+
+        self.__keywords['DEFAULT_SYS'](message)
+
+    def __say(self, message: str, rate: float = None, style: str = None, pitch: float = None, reading: bool = False,
+              pause: float = 0.0, wait: bool = True):
+        """
+        Sets self.__speaking event in order to declare silence has been broken and voices the given message.
+        If wait is False, the message is only queued in the synthesizer, so whatever is said next gets synthesized
+        while it plays.
+        """
+        if reading:
+            rate = reading_rate(message)
+            style = "neutral"
+
+        self.__speaking.set()
+        self.__last_utterance = self.__synthesizer.say_async(message, rate, style, pitch, pause)
+
+        if wait:
+            self.__last_utterance.wait()
+            self.__speaking.clear()
+
+            # resets timer
+            self.__last_time_spoken = time()
+            self.__sb_schedule()
+
+    def __say_stream(self, sentences) -> str:
+        """
+        Queues each sentence to be voiced as soon as it is available. Returns the voiced sentences joined together.
+        """
+        said = []
+
+        self.__speaking.set()
+        try:
+            for sentence in sentences:
+                self.__last_utterance = self.__synthesizer.say_async(sentence)
+                said.append(sentence)
+        finally:
+            # waits for everything queued to be played, even if the stream failed halfway
+            if self.__last_utterance is not None:
+                self.__last_utterance.wait()
+            self.__speaking.clear()
+
+        # resets timer
+        self.__last_time_spoken = time()
+        self.__sb_schedule()
+
+        return ' '.join(said)
+
+    def __get_answer(self, message: str, use_system_role: bool = False):
+        """
+        Requests the character's answer to a message. If streaming completions, returns a generator of sentences which
+        keeps being filled on a separate thread, otherwise, returns the complete answer.
+        """
+        if self.__stream_completions:
+            return prefetch(self.__char.interact_stream(message, use_system_role))
+
+        return self.__char.interact(message, use_system_role)
+
+    def __say_answer(self, answer) -> str:
+        """
+        Voices an answer returned by __get_answer. Returns the answer's text.
+        """
+        if isinstance(answer, str):
+            self.__say(answer)
+            return answer
+
+        return self.__say_stream(answer)
+
+    def __add_sp(self, side_prompt: str):
+        self.__char.add_side_prompt(side_prompt)
+        self.__app.update_side_prompts_widget()
+
+    # --------------------------------- LOOPS
+    # interacts with the character AI
+    def __talk_loop(self):
+        """
+        Character's answer loop.
+        """
+
+        while self.__running:
+            # blocks until a message is ready, timing out every now and then to check whether the loop should stop
+            msg_type, message = self.__queue.get_next(timeout=1.0)
+            if msg_type == 'system':
+                self.__check_for_kw(message)
+                get_tracer().finish_current()
+                continue
+            elif msg_type == 'chat':
+                self.__app.update_chat_widget()
+
+            # no messages in queue
+            if message == '':
+                continue
+
+            # --------------------------- regular message route ---------------------------------------
+            answer = self.__get_answer(message)
+
+            # reads message before answering, if message is a chat message. the answer is synthesized while it's read
+            if msg_type == 'chat':
+                self.__say(parse_msg(message, after=True), reading=True, wait=False)
+
+            self.__app.print(f'({msg_type.upper()}) {message}')
+
+            output = self.__say_answer(answer)
+            self.__app.print(f'Aiko: {output}\n')
+            get_tracer().finish_current()
+
+            # FOM debug printouts
+            if self.__debug_fom:
+                self.__app.print(f'CURRENT SCORE: {self.__char.fom.check_score()}')
+                self.__app.print(f'NEXT MOOD: {self.__char.context.check_personality()}\n')
+
+            sleep(0.1)
+
+    # silence breaker
+    def __sb_schedule(self):
+        """
+        (Re)schedules the silence breaker for when the current silence reaches the max silence time.
+        """
+        with self.__sb_lock:
+            if self.__sb_call is not None:
+                self.__sb_call.cancel()
+                self.__sb_call = None
+
+            # executes if spontaneous messages arent paused (paused by default)
+            if not self.__allow_sb.is_set():
+                return
+
+            deadline = max(self.__last_time_spoken + self.__max_silence_time, self.__sb_not_before)
+            self.__sb_call = self.__scheduler.schedule(max(0.0, deadline - time()), self.__sb_fire)
+
+    def __sb_fire(self):
+        """
+        Silence breaker. Called by the scheduler once the max silence time has been reached.
+        """
+        if not self.__running or not self.__allow_sb.is_set():
+            return
+        # gets rescheduled once the character stops speaking
+        if self.__speaking.is_set():
+            return
+
+        # re-rolls max silence time
+        self.__max_silence_time = randint(self.__sb_min_time, self.__sb_max_time)
+        self.__sb_not_before = time() + self.__max_silence_time
+
+        # decides between spontaneous or generic message
+        dice = randint(0, 1)
+        if dice == 0 and self.__system_prompts:
+            message = self.__system_prompts.pop(randint(0, len(self.__system_prompts) - 1))
+            # gives the spontaneous message some extra time before breaking the silence again
+            self.__sb_not_before += randint(self.__sb_min_time, self.__sb_max_time)
+        else:
+            message = choice(self.__generic_messages)
+
+        self.__queue.add_message(message, "system")
+        self.__sb_schedule()
+
+    # -------------------------------- PUBLIC
+
+    def sb_allow(self):
+        """
+        Resumes/Initiates silence breaker.
+        """
+        self.__last_time_spoken = time()
+        self.__allow_sb.set()
+        self.__sb_schedule()
+
+    def sb_stop(self):
+        """
+        Pauses the silence breaker.
+        """
+        self.__allow_sb.clear()
+        self.__sb_schedule()
+
+    def set_debug_fom(self, debug: str):
+        self.__debug_fom = bool(debug.capitalize())
+
+    def start(self):
+        """
+        Starts the talk loop in a separate thread. The silence breaker runs on the scheduler once allowed.
+        """
+        self.__running = True
+        Thread(target=self.__talk_loop, name='talk-loop').start()
+
+    def stop(self):
+        """
+        Stops the talk loop (after the current answer) and the silence breaker.
+        """
+        self.__running = False
+        self.sb_stop()
+
+
+# ------------------------------------------------- SESSIONS -----------------------------------------------------------
+
+
+class StreamSession:
+    """
+    One character streaming on one channel: its AIko, MasterQueue, ChatIngestor, ChatLoop and AnswerLoops.
+
+    Args:
+        character (str): The character's name.
+        scenario (str): The starting scenario.
+        platform (str): 'twitch' or 'youtube'.
+        channel (str): Twitch channel's name.
+        liveid (str): YouTube live's id.
+        twitch_address (tuple, optional): (host, port) of Twitch's chat server. Defaults to Twitch's.
+        twitch_token (str, optional): Token for Twitch's chat server. Read from keys/key_twitch.txt if not given.
+        prompts_folder (str, optional): Folder with the character's prompts (personalities, keywords, profile,
+        spontaneous and generic messages). Uses the shared prompts folder if not given.
+        synthesizer (Synthesizer, optional): Voices the character. Created from the config when attached if not given.
+        scheduler (Scheduler, optional): Runs chat cooldowns, forwards and the silence breaker. Uses the default
+        scheduler if not given.
+        config (ConfigParser, optional): Settings. Read from AIkoPrefs.ini if not given.
+
+    Public Methods:
+    - attach(frontend : Frontend): Creates the loops, which report to the given frontend. Must be called before
+    start.
+    - start(): Starts reading chat and answering.
+    - stop(): Stops reading chat and answering, after the current answer.
+    """
+    def __init__(self, character: str, scenario: str, platform: str = 'twitch', channel: str = 'aikochannel',
+                 liveid: str = '', twitch_address: tuple = None, twitch_token: str = None,
+                 prompts_folder: str = None, synthesizer: Synthesizer = None, scheduler: Scheduler = None,
+                 config: ConfigParser = None):
+        if config is None:
+            config = load_config()
+
+        self.platform = platform.lower()
+        self.channel = channel
+        self.liveid = liveid
+        self.twitch_address = twitch_address
+        self.twitch_token = twitch_token
+
+        self.__config = config
+        self.__scheduler = scheduler if scheduler is not None else default_scheduler()
+        self.__synthesizer = synthesizer
+        self.__prompts_folder = 'prompts' if prompts_folder is None else prompts_folder
+
+        prompts = None
+        if prompts_folder is not None:
+            prompts = PromptRepository(prompts_folder, config.getfloat('GENERAL', 'prompt_reload_interval'))
+        self.aiko = AIko(character, scenario, sp_slots=config.getint('GENERAL', 'max_side_prompts'),
+                         mem_slots=config.getint('GENERAL', 'mem_slots'), prompts=prompts)
+        self.queue = MasterQueue(self.__scheduler, config)
+
+        self.ingestor = None
+        self.chat_loop = None
+        self.answer_loops = None
+
+    def attach(self, frontend: Frontend):
+        config = self.__config
+
+        self.ingestor = ChatIngestor(
+            self.queue,
+            capacity=config.getint('LIVESTREAM', 'chat_buffer_size'),
+            forward_interval=config.getfloat('LIVESTREAM', 'chat_forward_interval'),
+            forward_count=config.getint('LIVESTREAM', 'chat_forward_count'),
+            duplicate_window=config.getfloat('LIVESTREAM', 'chat_duplicate_window'),
+            max_age=config.getfloat('LIVESTREAM', 'chat_max_age'),
+            on_forward=frontend.update_chat_widget,
+            scheduler=self.__scheduler
+        )
+        self.chat_loop = ChatLoop(self.queue, self.ingestor, frontend, self.platform == 'youtube', self.liveid,
+                                  self.channel, self.twitch_address, self.twitch_token)
+        self.answer_loops = AnswerLoops(self.aiko, frontend, self.queue, self.__synthesizer, self.__scheduler,
+                                        self.__prompts_folder, config)
+
+    def start(self):
+        if self.answer_loops is None:
+            raise RuntimeError('StreamSession must be attached to a frontend before starting.')
+
+        self.chat_loop.start()
+        self.answer_loops.start()
+
+    def stop(self):
+        if self.answer_loops is not None:
+            self.chat_loop.stop()
+            self.answer_loops.stop()
+
+
+class Orchestrator:
+    """
+    Runs several StreamSessions in one process.
+
+    Sessions share a single scheduler and, through AIko.py and AikoSentiment.py, a single completion client (one
+    connection pool and event loop), sentiment service and log writer. Each extra session only adds its own chat
+    reader, talk loop, mood updater and synthesis pipeline threads.
+
+    Args:
+        scheduler (Scheduler, optional): Scheduler shared by every session. Uses the default scheduler if not given.
+        config (ConfigParser, optional): Settings shared by every session. Read from AIkoPrefs.ini if not given.
+
+    Public Methods:
+    - add_session(character : str, scenario : str, **kwargs) -> StreamSession: Creates a session (see StreamSession
+    for the arguments).
+    - start(): Starts every session.
+    - stop(): Stops every session and writes buffered logs.
+    """
+    def __init__(self, scheduler: Scheduler = None, config: ConfigParser = None):
+        if config is None:
+            config = load_config()
+
+        self.scheduler = scheduler if scheduler is not None else default_scheduler()
+        self.config = config
+        self.sessions = []
+
+    def add_session(self, character: str, scenario: str, **kwargs):
+        session = StreamSession(character, scenario, scheduler=self.scheduler, config=self.config, **kwargs)
+        self.sessions.append(session)
+        return session
+
+    def start(self):
+        for session in self.sessions:
+            session.start()
+
+    def stop(self):
+        for session in self.sessions:
+            session.stop()
+
+        get_log_writer().flush()
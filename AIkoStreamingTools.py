@@ -5,21 +5,86 @@ Requirements:
 - AIko.py (140beta or greater) and its requirements.
 - AIkoVoice.py (100 or greater) and its requirements.
 - AIkoINIhandler.py (23 or greater) and its requirements.
+- AIkoTracing.py (001 or greater).
 
 Changelog:
 
 031:
 - Removed redundant double underlines from MasterQueue attribute names.
+032:
+- MasterQueue's get_next now blocks until a message is ready (or the given timeout runs out) instead of returning
+empty strings right away.
+- MessagePool's pick_message can now be called without blocking while the pool is paused.
+033:
+- Added Scheduler class, which runs scheduled callbacks on a single thread.
+- MasterQueue's chat cooldowns and MessageContainer's message expiration are now scheduled callbacks, instead of a new
+thread per cooldown and a thread polling for expiration.
+034:
+- MessageQueue is now backed by a deque, so getting the next message no longer shifts the whole queue.
+035:
+- MasterQueue now records how long each message waited in queue, and starts a tracing span for each message it
+returns, on the calling thread.
+036:
+- Added TwitchChat, an asyncio Twitch chat client which splits received data into lines, parses IRCv3 tags, answers
+PINGs as they arrive and reconnects with backoff. Several messages received at once are no longer glued together.
+- Added parse_irc_line function.
+- Pytwitch now reads messages through TwitchChat on a separate thread. Its get_message no longer recurses on socket
+errors and can be given a timeout.
+037:
+- Added ChatIngestor class, which buffers incoming chat messages (up to a limit), collapses duplicates, copypastas and
+emote walls, merges follow-up messages from the same author and forwards the best scored ones to the MasterQueue at a
+steady pace.
+- Added RateMeter class, normalize_chat_message and score_chat_message functions.
+038:
+- MessagePool now keeps occupied slots in a set and their weights in a WeightedSampler (a Fenwick tree), so empty
+checks are O(1) and picks are O(log n), instead of retrying random slots until an occupied one is found.
+- MessagePool picks are now weighted by recency, subscriber status, length, question marks and whether the author has
+been answered yet. Weights and pool size are configurable.
+- Messages added to MasterQueue can carry metadata (author, subscriber status), used by the MessagePool.
+- Pausing the MessagePool no longer holds its lock, so adding messages while paused doesn't block the caller.
+- Added clear_chat_messages method to MasterQueue.
+- Added get_tagged_message method to Pytwitch, which also returns the message's tags.
+- ChatIngestor forwards the author and subscriber status of messages along with them.
+039:
+- MasterQueue and MessageContainer are no longer singletons, so each streaming session can have its own queue.
+040:
+- Scheduler and Pytwitch threads are now named, so they can be told apart when profiling.
+041:
+- Added SidePromptServer class, which receives side prompts from remote operators over persistent connections, using
+newline delimited JSON, and acknowledges each one.
+042:
+- No longer imports AIko.py, which it didn't use. Settings are read through AIkoINIhandler's load_config.
+043:
+- Fixed ChatIngestor discarding follow-up messages which didn't fit in the author's merged message, while counting
+them as merged. They are now buffered as new messages.
+044:
+- Fixed MessagePool's arrival order growing for as long as the pool never filled up, as picked messages were only
+forgotten when evicting.
+045:
+- SidePromptServer listens on 127.0.0.1 by default, and can require operators to send a shared secret in their hello.
+046:
+- Fixed ChatIngestor evicting by the outdated score of a removed message when a message with the same text was
+buffered again.
+047:
+- MasterQueue and MessageContainer can be given their own config, instead of always reading the shared one.
 """
 
 # ----------------------------- Imports -------------------------------------
 import time
-import AIko
+import json
+import hmac
+import heapq
+import re
+import math
 import random
+import asyncio
+import itertools
+from queue import Queue
+from collections import deque, namedtuple
 from configparser import ConfigParser
-from threading import Thread, Lock, Event
-import socket
-import re
+from threading import Thread, Lock, Condition
+from AIkoTracing import get_tracer
+from AIkoINIhandler import load_config
 # ----------------------------------------------------------------------------
 
 
@@ -29,6 +94,131 @@ def is_empty_string(string: str):
 # ----------------------------------------------------------------------------
 
 
+class ScheduledCall:
+    """
+    A callback scheduled to run at a given time by a Scheduler.
+
+    Public Methods:
+    - cancel(): Prevents the callback from running, if it hasn't run yet.
+    """
+    def __init__(self, deadline: float, callback: callable, args: tuple):
+        self.deadline = deadline
+        self.__callback = callback
+        self.__args = args
+        self.__cancelled = False
+
+    def cancel(self):
+        self.__cancelled = True
+
+    @property
+    def cancelled(self):
+        return self.__cancelled
+
+    def run(self):
+        if not self.__cancelled:
+            self.__callback(*self.__args)
+
+
+class Scheduler:
+    """
+    A heap based timer which runs scheduled callbacks on a single thread, sleeping until the next deadline.
+    Callbacks should be short, as they delay every callback scheduled after them.
+
+    Public Methods:
+    - schedule(delay : float, callback : callable, *args): Runs the callback after delay seconds.
+    - stop(): Stops the scheduler's thread. Callbacks which haven't run yet are dropped.
+    """
+    def __init__(self):
+        self.__heap = []
+        self.__counter = itertools.count()  # breaks ties between calls with the same deadline
+        self.__wakeup = Condition()
+        self.__running = True
+
+        Thread(target=self.__loop, name='scheduler', daemon=True).start()
+
+    def __next_due(self):
+        # blocks until the earliest call is due and pops it. returns None once the scheduler is stopped
+        with self.__wakeup:
+            while self.__running:
+                if not self.__heap:
+                    self.__wakeup.wait()
+                    continue
+
+                deadline, _, call = self.__heap[0]
+
+                if call.cancelled:
+                    heapq.heappop(self.__heap)
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    heapq.heappop(self.__heap)
+                    return call
+
+                self.__wakeup.wait(remaining)
+
+        return None
+
+    def __loop(self):
+        while True:
+            call = self.__next_due()
+            if call is None:
+                return
+
+            try:
+                call.run()
+            except Exception as e:
+                print('AIkoStreamingTools.py:')
+                print(e)
+                print()
+
+    def schedule(self, delay: float, callback: callable, *args) -> ScheduledCall:
+        """
+        Schedules a callback to run after a given amount of seconds.
+
+        Args:
+        - delay: Seconds to wait before running the callback.
+        - callback: The function to be called.
+        - args: Arguments to call the function with.
+
+        Returns:
+        - The ScheduledCall object, which can be used to cancel the call.
+        """
+        call = ScheduledCall(time.monotonic() + delay, callback, args)
+
+        with self.__wakeup:
+            heapq.heappush(self.__heap, (call.deadline, next(self.__counter), call))
+
+            # the thread only needs waking up if the new call is due before the one it is waiting for
+            if self.__heap[0][2] is call:
+                self.__wakeup.notify()
+
+        return call
+
+    def stop(self):
+        with self.__wakeup:
+            self.__running = False
+            self.__wakeup.notify()
+
+
+_default_scheduler = None
+_default_scheduler_lock = Lock()
+
+
+def default_scheduler():
+    """
+    Returns the scheduler shared by the module's classes, creating it on first use.
+    """
+    global _default_scheduler
+
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = Scheduler()
+        return _default_scheduler
+
+# ----------------------------------------------------------------------------
+
+
 class MessageQueue: 
     """
     A class representing a thread-safe message queue.
@@ -38,8 +228,10 @@ class MessageQueue:
     - add_message(message: str): Adds a message to the queue.
     - get_next(): Retrieves and removes the next message from the queue.
     """
+    __slots__ = ('__queue', '__lock')
+
     def __init__(self):
-        self.__queue = []
+        self.__queue = deque()
         self.__lock = Lock()
 
     def is_empty(self):
@@ -71,67 +263,40 @@ class MessageQueue:
         """
         with self.__lock:
             if not self.is_empty():
-                return self.__queue.pop(0)
+                return self.__queue.popleft()
             return ''
 
 
 class MessageContainer:
     """
-    A singleton class that provides thread-safe storage for a temporary message. 
-    Only one instance of the class can exist.
+    Provides thread-safe storage for a temporary message.
 
     Public Methods:
     - switch_message(message: str): Sets the message to the given value.
     - get_message(): Retrieves and clears the stored message.
     - has_message(): Checks if there is a stored message.
 
+    Args:
+        scheduler (Scheduler, optional): Handles expiration. Uses the default scheduler if not given.
+        config (ConfigParser, optional): Settings. Uses the shared config if not given.
     """
-    __instance__ = None
-    __lock__ = Lock()
-
-    def __new__(cls):
-        """
-        Ensures that only one instance of the class can be created.
-        """
-        if cls.__instance__ is None: 
-            with cls.__lock__:
-                if not cls.__instance__:
-                    cls.__instance__ = super().__new__(cls)
-                    cls.__instance__.__initialized__ = False
-        return cls.__instance__
-
-    def __init__(self):
-        if self.__initialized__:
-            return
-        self.__initialized__ = True
-
+    def __init__(self, scheduler: Scheduler = None, config: ConfigParser = None):
         self.__msg__ = ''
         self.__lock__ = Lock()
-        self.__switch_evt__ = Event()
 
-        # gets message expiration time from config
-        config = ConfigParser()
-        config.read('AIkoPrefs.ini')
+        # scheduler which handles expiration
+        self.__scheduler__ = scheduler if scheduler is not None else default_scheduler()
+        self.__expiration__ = None
 
+        # gets message expiration time from config
+        config = load_config() if config is None else config
         self.__expiration_time__ = config.getfloat('LIVESTREAM', 'voice_message_expiration_time')
 
-        # starts separate thread to manage expiration
-        Thread(target = self.__expiration_countdown__).start()
-
-    def __expiration_countdown__(self):
-        timer_start = time.time()
-        while True:
-            timer_now = time.time()
-
-            if self.__switch_evt__.is_set():
-                timer_start = time.time()
-                self.__switch_evt__.clear()
-
-            if (timer_now - timer_start) >= self.__expiration_time__:
-                with self.__lock__:
-                    self.__msg__ = ''
-                
-            time.sleep(0.1)
+    def __expire__(self, message: str):
+        with self.__lock__:
+            # only expires the message if it hasn't been switched in the meantime
+            if self.__msg__ is message:
+                self.__msg__ = ''
 
     def switch_message(self, message: str):
         """
@@ -142,7 +307,10 @@ class MessageContainer:
         """
         with self.__lock__:
             self.__msg__ = message
-            self.__switch_evt__.set()
+
+            if self.__expiration__ is not None:
+                self.__expiration__.cancel()
+            self.__expiration__ = self.__scheduler__.schedule(self.__expiration_time__, self.__expire__, message)
 
     def has_message(self):
         """
@@ -166,78 +334,319 @@ class MessageContainer:
             return helper
 
 
+class WeightedSampler:
+    """
+    Fenwick (binary indexed) tree over a fixed number of slot weights. Setting a weight and picking a slot at random,
+    proportionally to the weights, both take O(log n). Not thread safe.
+    """
+    __slots__ = ('__weights', '__tree')
+
+    def __init__(self, size: int):
+        self.__weights = [0.0] * size
+        self.__tree = [0.0] * (size + 1)
+
+    def __len__(self):
+        return len(self.__weights)
+
+    def set(self, index: int, weight: float):
+        delta = weight - self.__weights[index]
+        self.__weights[index] = weight
+
+        i = index + 1
+        while i < len(self.__tree):
+            self.__tree[i] += delta
+            i += i & -i
+
+    def get(self, index: int):
+        return self.__weights[index]
+
+    def total(self):
+        i = len(self.__weights)
+        total = 0.0
+        while i > 0:
+            total += self.__tree[i]
+            i -= i & -i
+        return total
+
+    def rebuild(self, weights: list = None):
+        """
+        Rebuilds the tree from the weights (or from new ones, if given), clearing accumulated floating point errors.
+        """
+        if weights is not None:
+            self.__weights = list(weights)
+
+        self.__tree = [0.0] + self.__weights
+        for i in range(1, len(self.__tree)):
+            parent = i + (i & -i)
+            if parent < len(self.__tree):
+                self.__tree[parent] += self.__tree[i]
+
+    def sample(self, rng=random):
+        """
+        Returns a random slot's index, picked proportionally to the weights. Returns None if every weight is 0.
+        """
+        total = self.total()
+        if total <= 0:
+            return None
+
+        remaining = rng.random() * total
+        position = 0
+        step = 1 << (len(self.__weights).bit_length() - 1)
+        while step:
+            if position + step <= len(self.__weights) and self.__tree[position + step] <= remaining:
+                position += step
+                remaining -= self.__tree[position]
+            step >>= 1
+
+        return min(position, len(self.__weights) - 1)
+
+
+class PooledMessage:
+    """
+    A chat message held by the MessagePool.
+    """
+    __slots__ = ('text', 'author', 'subscriber', 'arrival', 'sequence')
+
+    def __init__(self, text: str, author: str, subscriber: bool, arrival: float, sequence: int):
+        self.text = text
+        self.author = author
+        self.subscriber = subscriber
+        self.arrival = arrival
+        self.sequence = sequence
+
+
+class PoolWeights:
+    """
+    How much each of a chat message's traits multiplies its chance of being picked by the MessagePool.
+
+    Args:
+        recency (float): Multiplier for each minute a message is newer than another.
+        subscriber (float): Multiplier for messages from subscribers (or members).
+        length (float): Added to 1 for every 10 words (up to 30 words), before multiplying.
+        question (float): Multiplier for messages containing a question mark.
+        unanswered (float): Multiplier for messages from authors who haven't been answered yet.
+    """
+    __slots__ = ('recency', 'subscriber', 'length', 'question', 'unanswered')
+
+    def __init__(self, recency: float = 2.0, subscriber: float = 2.0, length: float = 0.5, question: float = 1.5,
+                 unanswered: float = 2.0):
+        self.recency = recency
+        self.subscriber = subscriber
+        self.length = length
+        self.question = question
+        self.unanswered = unanswered
+
+    @classmethod
+    def from_config(cls, config: ConfigParser):
+        return cls(*(config.getfloat('LIVESTREAM', f'pool_{name}_weight') for name in cls.__slots__))
+
+
 class MessagePool:
     """
-    A thread-safe class representing a message pool with limited capacity.
+    A thread-safe class representing a message pool with limited capacity, from which messages are picked at random,
+    weighted by their traits (see PoolWeights).
+
+    Occupied slots are kept in a set and their weights in a WeightedSampler, so checking whether the pool is empty is
+    O(1) and picking a message is O(log n).
 
     Public Methods:
-        add_message(item: str) -> None:
+        add_message(item: str, metadata: dict) -> None:
             Adds a message to the message pool. If the pool is already at maximum capacity,
             the oldest message is removed to make room for the new message.
 
-        pick_message() -> str:
+        pick_message(blocking : bool) -> str:
             Picks a random message from the message pool and returns it. The picked message
             is removed from the pool. If the pool is empty, an empty string is returned.
-    """ 
-    def __init__(self):
-        self.__pool = AIko.create_limited_list(10)
+
+    Args:
+        on_resume (callable, optional): Called whenever the pool is un-paused.
+        size (int): Number of message slots.
+        weights (PoolWeights, optional): How messages are weighted. Uses the defaults if not given.
+    """
+    # max number of answered authors remembered
+    max_answered_authors = 1000
+
+    # recency exponents are rebased once they get this large, to keep weights from overflowing
+    max_recency_exponent = 50.0
+
+    def __init__(self, on_resume: callable = None, size: int = 10, weights: PoolWeights = None):
+        self.__size = size
+        self.__weights = weights if weights is not None else PoolWeights()
+
+        self.__slots = [None] * size
+        self.__live = set()
+        self.__free = list(range(size - 1, -1, -1))
+        self.__sampler = WeightedSampler(size)
+        # slot index of each message's text, for edits
+        self.__by_text = {}
+        # (sequence, slot index) in arrival order, for evicting the oldest message. entries of removed messages are
+        # skipped when they reach the front, and compacted away if they pile up
+        self.__arrivals = deque()
+        self.__sequence = itertools.count()
+        self.__answered = {}
+        self.__origin = time.monotonic()
+
         self.__lock = Lock()
         self.__paused = False
+        # messages added while paused. only the newest ones would fit in the pool anyway
+        self.__held = deque(maxlen=size)
+        self.__resumed = Condition(self.__lock)
+        self.__on_resume = on_resume
+
+    def __weigh(self, message: PooledMessage):
+        weights = self.__weights
+
+        weight = 1 + weights.length * min(len(message.text.split()), 30) / 10
+        if message.subscriber:
+            weight *= weights.subscriber
+        if '?' in message.text:
+            weight *= weights.question
+        if message.author not in self.__answered:
+            weight *= weights.unanswered
+
+        # newer messages weigh more. only relative weights matter, so this is measured from an arbitrary origin
+        return weight * weights.recency ** ((message.arrival - self.__origin) / 60)
+
+    def __rebase(self, now: float):
+        # moves the recency origin to now, so new exponents start from 0 again
+        self.__origin = now
+        self.__sampler.rebuild([0.0 if slot is None else self.__weigh(slot) for slot in self.__slots])
 
     def is_empty(self):
-        for item in self.__pool:
-            if item != '':
-                return False
-        return True
-
-    def add_message(self, message: str):
+        return not self.__live
+
+    def __len__(self):
+        return len(self.__live)
+
+    def __remove(self, index: int):
+        message = self.__slots[index]
+        self.__slots[index] = None
+        self.__live.discard(index)
+        self.__free.append(index)
+        self.__sampler.set(index, 0.0)
+        if self.__by_text.get(message.text) == index:
+            del self.__by_text[message.text]
+
+        # picked messages leave their entries behind, which would never be popped if the pool doesn't fill up
+        if len(self.__arrivals) > 2 * self.__size:
+            self.__arrivals = deque((sequence, index) for sequence, index in self.__arrivals
+                                    if self.__slots[index] is not None and self.__slots[index].sequence == sequence)
+        return message
+
+    def __insert(self, message: str, metadata: dict):
+        now = time.monotonic()
+        if (now - self.__origin) / 60 > self.max_recency_exponent:
+            self.__rebase(now)
+
+        if len(self.__live) == self.__size:
+            # removes the oldest message
+            while True:
+                sequence, index = self.__arrivals.popleft()
+                if self.__slots[index] is not None and self.__slots[index].sequence == sequence:
+                    self.__remove(index)
+                    break
+
+        index = self.__free.pop()
+        metadata = metadata or {}
+        pooled = PooledMessage(message, metadata.get('author', message.partition(':')[0]),
+                               bool(metadata.get('subscriber', False)), now, next(self.__sequence))
+
+        self.__slots[index] = pooled
+        self.__live.add(index)
+        self.__by_text[message] = index
+        self.__arrivals.append((pooled.sequence, index))
+        self.__sampler.set(index, self.__weigh(pooled))
+
+    def add_message(self, message: str, metadata: dict = None):
         """
         Adds a message to the message pool. If the pool is already at maximum capacity,
         the oldest message is removed to make room for the new message.
 
         Args:
             message (str): The message to be added.
+            metadata (dict, optional): 'author' (str, parsed from the message if not given) and 'subscriber' (bool).
         """
         with self.__lock:
-            self.__pool.pop(0)
-            self.__pool.append(message)
+            if self.__paused:
+                self.__held.append((message, metadata))
+                return
 
-    def pick_message(self):
+            self.__insert(message, metadata)
+
+    def pick_message(self, blocking: bool = True):
         """
-        Picks a random message from the message pool and returns it. The picked message
+        Picks a random message from the message pool, weighted by its traits, and returns it. The picked message
         is removed from the pool. If the pool is empty, an empty string is returned.
 
+        Args:
+            blocking (bool): Whether to wait for the pool to be un-paused. If False, an empty string is returned
+            while the pool is paused.
+
         Returns:
             The picked message as a string. If the pool is empty, an empty string is returned.
         """
-        helper = ''
         with self.__lock:
-            if not self.is_empty():
-                while True:
-                    index = random.randint(0, len(self.__pool) - 1)
-                    helper = self.__pool[index]
-                    self.__pool[index] = ''
+            if self.__paused and not blocking:
+                return ''
+            self.__resumed.wait_for(lambda: not self.__paused)
 
-                    if helper != '':
-                        break
-            return helper
+            if not self.__live:
+                return ''
+
+            index = self.__sampler.sample()
+            if index not in self.__live:
+                # floating point errors left some weight on an empty slot
+                self.__sampler.rebuild()
+                index = self.__sampler.sample()
+
+            message = self.__remove(index)
+
+            self.__answered[message.author] = None
+            if len(self.__answered) > self.max_answered_authors:
+                del self.__answered[next(iter(self.__answered))]
+
+            return message.text
 
     def edit_message(self, original_content: str, new_content: str):
         with self.__lock:
-            if original_content in self.__pool:
-                msg_index = self.__pool.index(original_content)
-                self.__pool[msg_index] = new_content
-            else:
+            index = self.__by_text.get(original_content)
+            if index is None:
                 raise ValueError('Message does not exist in pool.')
 
+            del self.__by_text[original_content]
+            message = self.__slots[index]
+            message.text = new_content
+            self.__by_text[new_content] = index
+            self.__sampler.set(index, self.__weigh(message))
+
     def delete_message(self, index: int):
-        if index > 10:
-            raise ValueError("Index can't be higher than 10.")
+        if not 0 <= index < self.__size:
+            raise ValueError(f"Index must be between 0 and {self.__size - 1}.")
 
-        self.__pool[index] = ''
+        with self.__lock:
+            if self.__slots[index] is not None:
+                self.__remove(index)
+
+    def clear(self):
+        with self.__lock:
+            for index in list(self.__live):
+                self.__remove(index)
+            self.__held.clear()
 
     def get_pool_reference(self):
-        return self.__pool
+        """
+        Returns the pool's messages by slot, with empty strings for empty slots.
+        """
+        with self.__lock:
+            return [('' if message is None else message.text) for message in self.__slots]
+
+    @property
+    def size(self):
+        return self.__size
+
+    @property
+    def paused(self):
+        return self.__paused
 
     def pause(self):
         """
@@ -245,18 +654,25 @@ class MessagePool:
         any messages. If the add_message method is called during the pause state, the message will be added after the
         pool is un-paused.
         """
-        if self.__paused:
-            self.__paused = False
-            self.__lock.release()
-        else:
-            self.__paused = True
-            self.__lock.acquire()
+        with self.__lock:
+            self.__paused = not self.__paused
+
+            if not self.__paused:
+                for message, metadata in self.__held:
+                    self.__insert(message, metadata)
+                self.__held.clear()
+                self.__resumed.notify_all()
+
+        if not self.__paused and self.__on_resume is not None:
+            self.__on_resume()
+
+
 # ----------------------------------------------------------------------------
 
 
 class MasterQueue:
     """
-    A singleton class which acts as a priority queue to control and return specific types of messages.
+    A priority queue to control and return specific types of messages.
     The message types and the priority order are the following:
 
     - system (handled by the MessageQueue class)
@@ -269,53 +685,59 @@ class MasterQueue:
     Public Methods:
     - add_message(message : str, message_type : str): Adds a message to the master queue.
     - edit_chat_message(original_content : str, new_content : str): Edit "chat" type messages by content.
-    - get_next(): Retrieves the next message from the master queue based on priority.
-    """
-    __instance = None
-    __lock = Lock()
+    - get_next(timeout : float): Blocks until a message is ready, then retrieves it based on priority.
 
-    def __new__(cls):
-        """
-        Ensures that only one instance of the class can be created.
-        """
-        if cls.__instance is None:
-            with cls.__lock:
-                if not cls.__instance:
-                    cls.__instance = super().__new__(cls)
-                    cls.__instance.__initialized = False
-        return cls.__instance
+    Each message returned by get_next gets a tracing span, which becomes the calling thread's current span.
 
-    def __init__(self):
-        if self.__initialized:
-            return
+    Args:
+        scheduler (Scheduler, optional): Handles chat cooldowns. Uses the default scheduler if not given.
+        config (ConfigParser, optional): Settings, shared with the queue's containers. Uses the shared config if not
+        given.
+    """
+    # max number of messages whose arrival times are tracked. chat messages can leave the pool without being returned
+    max_tracked_messages = 1000
 
-        self.__initialized = True
+    def __init__(self, scheduler: Scheduler = None, config: ConfigParser = None):
+        # scheduler which handles chat cooldowns
+        self.__scheduler = scheduler if scheduler is not None else default_scheduler()
+
+        # gets chat cooldown times and pool settings from config
+        config = load_config() if config is None else config
 
         self.__system_messages = MessageQueue()
-        self.__mic_messages = MessageContainer()
-        self.__chat_messages = MessagePool()
+        self.__mic_messages = MessageContainer(self.__scheduler, config)
+        self.__chat_messages = MessagePool(on_resume=self.__notify, size=config.getint('LIVESTREAM', 'chat_pool_size'),
+                                           weights=PoolWeights.from_config(config))
 
         self.__allow_chat = True
 
-        # gets chat cooldown times from config
-        config = ConfigParser()
-        config.read('AIkoPrefs.ini')
+        # notified whenever a message might have become ready
+        self.__ready = Condition()
+
+        # arrival times of queued messages, for tracing
+        self.__tracer = get_tracer()
+        self.__arrivals = {}
 
         self.__chat_min_cooldown = config.getint('LIVESTREAM', 'chat_min_cooldown')
         self.__chat_max_cooldown = config.getint('LIVESTREAM', 'chat_max_cooldown')
 
-    def __chat_cooldown__(self, cooldown : int):
-        self.__allow_chat = False
-        time.sleep(cooldown)
+    def __end_chat_cooldown(self):
         self.__allow_chat = True
+        self.__notify()
+
+    def __notify(self):
+        # wakes up threads waiting on get_next
+        with self.__ready:
+            self.__ready.notify_all()
 
-    def add_message(self, message : str, message_type : str):
+    def add_message(self, message : str, message_type : str, metadata : dict = None):
         """
         Adds a message to the master queue based on its type.
 
         Args:
         - message: A string representing the message to be added.
         - message_type: A string indicating the type of the message ('system', 'mic', 'chat').
+        - metadata: Optional information about chat messages used to weigh them (see MessagePool.add_message).
 
         Raises:
         - TypeError: If the message_type is not a valid type.
@@ -325,10 +747,29 @@ class MasterQueue:
         elif message_type == "mic":
             self.__mic_messages.switch_message(message)
         elif message_type == "chat":
-            self.__chat_messages.add_message(message)
+            self.__chat_messages.add_message(message, metadata)
         else:
             raise TypeError(f"{message_type} is not a valid message type")
 
+        self.__track_arrival(message)
+        self.__notify()
+
+    def __track_arrival(self, message: str, arrival: float = None):
+        with self.__ready:
+            # keeps the first arrival time of repeated messages
+            self.__arrivals.setdefault(message, time.monotonic() if arrival is None else arrival)
+            if len(self.__arrivals) > self.max_tracked_messages:
+                # forgets the oldest one
+                del self.__arrivals[next(iter(self.__arrivals))]
+
+    def __start_span(self, message_type: str, message: str):
+        # called with self.__ready held
+        arrival = self.__arrivals.pop(message, None)
+        span = self.__tracer.start_span(message_type, arrival)
+        span.mark('dequeued')
+        if arrival is not None:
+            self.__tracer.record('queue_wait', time.monotonic() - arrival)
+
     def get_chat_messages(self):
         """
         Useful for display/check needs. If you want to modify the object, use the MasterQueue's own methods.
@@ -338,17 +779,19 @@ class MasterQueue:
     def edit_chat_message(self, original_content : str, new_content : str):
         self.__chat_messages.edit_message(original_content, new_content)
 
+        # merged messages keep the original message's arrival time
+        with self.__ready:
+            arrival = self.__arrivals.pop(original_content, None)
+        self.__track_arrival(new_content, arrival)
+
     def delete_chat_message(self, index: int):
         self.__chat_messages.delete_message(index)
 
-    def get_next(self):
-        """
-        Retrieves the next message from the master queue based on priority.
+    def clear_chat_messages(self):
+        self.__chat_messages.clear()
 
-        Returns:
-        - A tuple containing the message type and the message content.
-        - A tuple containing empty strings if there are no messages in the queue / 'chat' is in cooldown mode.
-        """
+    def __pop_next(self):
+        # returns the next (type, message) tuple based on priority, or None if there is nothing ready
         msg = self.__system_messages.get_next()
 
         if not is_empty_string(msg):
@@ -359,92 +802,731 @@ class MasterQueue:
         if not is_empty_string(msg):
             return "mic", msg
 
-        if self.__allow_chat:
-            cooldown_time = random.randint(self.__chat_min_cooldown, self.__chat_max_cooldown)
-            Thread(target=self.__chat_cooldown__, kwargs={'cooldown': cooldown_time}).start()
-            return "chat", self.__chat_messages.pick_message()
+        if self.__allow_chat and not self.__chat_messages.paused and not self.__chat_messages.is_empty():
+            # doesn't block, in case the pool gets paused in the meantime
+            msg = self.__chat_messages.pick_message(blocking=False)
 
-        return '', ''
+            if not is_empty_string(msg):
+                cooldown_time = random.randint(self.__chat_min_cooldown, self.__chat_max_cooldown)
+                self.__allow_chat = False
+                self.__scheduler.schedule(cooldown_time, self.__end_chat_cooldown)
+                return "chat", msg
 
+        return None
 
-class Pytwitch:
-    def __init__(self, token: str, channel: str):
+    def get_next(self, timeout: float = None):
         """
-        Basic class for acquiring twitch chat messages.
+        Retrieves the next message from the master queue based on priority. Blocks until a system, mic or chat message
+        is ready, or the timeout runs out.
 
         Args:
-        token: OAuth token. Can be acquired at https://twitchapps.com/tmi/.
-        channel: Target channel's name.
+        - timeout: Maximum number of seconds to block for. Blocks indefinitely if None.
+
+        Returns:
+        - A tuple containing the message type and the message content.
+        - A tuple containing empty strings if the timeout ran out before a message was ready.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.__ready:
+            while True:
+                message = self.__pop_next()
+                if message is not None:
+                    self.__start_span(*message)
+                    return message
+
+                if deadline is None:
+                    self.__ready.wait()
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return '', ''
+                self.__ready.wait(remaining)
+
+
+# ----------------------------------------------------------------------------
+
+
+class RateMeter:
+    """
+    Counts events over a sliding window of whole seconds. Not thread safe.
+
+    Args:
+        window (int): Seconds the rate is averaged over.
+    """
+    __slots__ = ('__window', '__buckets', 'total')
+
+    def __init__(self, window: int = 10):
+        self.__window = window
+        # [second, count] pairs, oldest first
+        self.__buckets = deque()
+        self.total = 0
+
+    def __trim(self, second: int):
+        while self.__buckets and self.__buckets[0][0] <= second - self.__window:
+            self.__buckets.popleft()
+
+    def mark(self, count: int = 1, now: float = None):
+        second = int(time.monotonic() if now is None else now)
+
+        if self.__buckets and self.__buckets[-1][0] == second:
+            self.__buckets[-1][1] += count
+        else:
+            self.__buckets.append([second, count])
+            self.__trim(second)
+
+        self.total += count
+
+    def rate(self, now: float = None):
         """
+        Returns the average number of events per second over the window.
+        """
+        self.__trim(int(time.monotonic() if now is None else now))
+        return sum(count for _, count in self.__buckets) / self.__window
+
 
-        self.__sock = socket.socket()
-        self.__CHAT_MSG = re.compile(r"^:\w+!\w+@\w+\.tmi\.twitch\.tv PRIVMSG #\w+ :")
+# characters repeated 3 or more times in a row (EG 'hiiiii'), and anything that isn't a letter, digit or space
+repeated_characters = re.compile(r'(.)\1{2,}')
+non_word_characters = re.compile(r'[^\w\s]+')
 
-        # Connect socket to Twitch
-        self.__sock.connect(("irc.twitch.tv", 6667))
 
-        # Authenticate and connect to channel over socket
-        self.__sock.send("PASS {}\r\n".format(token).encode("utf-8"))
-        self.__sock.send("NICK {}\r\n".format(channel).encode("utf-8"))
-        self.__sock.send("JOIN {}\r\n".format(f'#{channel}').encode("utf-8"))
+def normalize_chat_message(message: str):
+    """
+    Reduces a chat message to a key shared by its near-duplicates: lowercase, without punctuation or numbers, with
+    characters repeated in a row shortened and words repeated in a row collapsed. EG 'LUL LUL LUL!!!' -> 'lul'.
+    """
+    message = non_word_characters.sub(' ', repeated_characters.sub(r'\1\1', message.lower()))
+
+    words = []
+    for word in message.split():
+        # words without letters (EG, numbers or what's left of '<3') are left out
+        if (not words or words[-1] != word) and not word.isdigit():
+            words.append(word)
+
+    return ' '.join(words)
+
+
+def score_chat_message(message: str, authors: int = 1):
+    """
+    Scores how worth answering a chat message is. Longer messages and questions score higher, messages sent by
+    several authors (EG, copypastas) score higher, and messages made of repeated words (EG, emote walls) score lower.
+    """
+    words = message.split()
+    if not words:
+        return 0.0
+
+    score = 1.0
+    score += min(len(words), 20) / 10
+    if '?' in message:
+        score += 1.0
+    score += math.log2(authors)
+
+    # penalizes repeated words
+    return score * len(set(word.lower() for word in words)) / len(words)
+
+
+def is_subscriber(tags: dict):
+    """
+    Whether a chat message's tags (IRCv3 tags for Twitch, or the same keys for other platforms) say its author is a
+    subscriber.
+    """
+    if not tags:
+        return False
+    return tags.get('subscriber') == '1' or 'subscriber/' in tags.get('badges', '')
+
+
+class ChatMessage:
+    """
+    A chat message buffered by the ChatIngestor.
+    """
+    __slots__ = ('author', 'text', 'key', 'tags', 'arrival', 'updated', 'authors', 'score', 'version')
+
+    def __init__(self, author: str, text: str, key: str, tags: dict, arrival: float):
+        self.author = author
+        self.text = text
+        self.key = key
+        self.tags = tags
+        self.arrival = arrival
+        self.updated = arrival
+        self.authors = {author}
+        self.score = 0.0
+        # changes whenever the score does, invalidating older eviction heap entries
+        self.version = 0
+
+
+class ChatIngestor:
+    """
+    Sits between the chat readers and the MasterQueue, so bursts of chat (EG, raids) don't flood the message pool.
+
+    Submitted messages are buffered, and every forward_interval seconds the best scored ones are forwarded to the
+    MasterQueue as 'chat' messages. Submitting never blocks the readers: once the buffer is full, the lowest scored
+    message is dropped. Along the way:
+
+    - Near-duplicates (same normalized text, EG copypastas) collapse into the buffered message, raising its score.
+    Duplicates of recently forwarded messages are dropped.
+    - Follow-up messages from an author whose previous message is still buffered are merged into it.
+    - Messages which waited longer than max_age seconds are dropped.
+
+    Args:
+        queue (MasterQueue): Where the selected messages are forwarded to.
+        capacity (int): Maximum number of buffered messages.
+        forward_interval (float): Seconds between forwards.
+        forward_count (int): Maximum number of messages forwarded each time.
+        duplicate_window (float): Seconds a forwarded message's duplicates keep being dropped for.
+        max_age (float): Seconds a message can stay buffered for.
+        merge_window (float): Seconds after an author's last message in which their next one is merged into it.
+        scorer (callable): Scores messages, given their text and the number of distinct authors who sent it.
+        on_forward (callable, optional): Called after messages have been forwarded.
+        scheduler (Scheduler, optional): Runs the forwards. Uses the default scheduler if not given.
+
+    Public Methods:
+    - submit(author : str, message : str, tags : dict) -> bool: Buffers a message. Returns False if it was collapsed,
+    merged or dropped.
+    - forward(): Forwards the best buffered messages right away.
+    - start(), stop(): Starts/stops forwarding periodically.
+    - stats() -> dict: Counters and the incoming message rate.
+    """
+    max_merged_length = 500
+
+    def __init__(self, queue, capacity: int = 200, forward_interval: float = 1.0, forward_count: int = 2,
+                 duplicate_window: float = 30.0, max_age: float = 60.0, merge_window: float = 10.0,
+                 scorer: callable = score_chat_message, on_forward: callable = None, scheduler: Scheduler = None):
+        self.__queue = queue
+        self.__capacity = capacity
+        self.__forward_interval = forward_interval
+        self.__forward_count = forward_count
+        self.__duplicate_window = duplicate_window
+        self.__max_age = max_age
+        self.__merge_window = merge_window
+        self.__scorer = scorer
+        self.__on_forward = on_forward
+        self.__scheduler = scheduler if scheduler is not None else default_scheduler()
+
+        # key: ChatMessage, in arrival order
+        self.__buffer = {}
+        # author: key of their latest buffered message
+        self.__latest = {}
+        # key: forward time, of recently forwarded messages
+        self.__forwarded = {}
+        # (score, version, sequence, key) min heap, for evicting the lowest scored message
+        self.__eviction_heap = []
+        self.__sequence = itertools.count()
 
-        # Avoids returning initial debug text
-        self.get_message()
-        self.get_message()
-        self.get_message()
+        self.__lock = Lock()
+        self.__call = None
+        self.__running = False
+
+        self.__incoming = RateMeter()
+        self.__counters = dict.fromkeys(('accepted', 'collapsed', 'merged', 'dropped', 'expired', 'forwarded'), 0)
+
+    def __rescore(self, entry: ChatMessage):
+        entry.score = self.__scorer(entry.text, len(entry.authors))
+        # versions come from a counter shared by every entry, so heap entries left behind by a removed message can't
+        # match a new message buffered under the same key
+        entry.version = next(self.__sequence)
+        heapq.heappush(self.__eviction_heap, (entry.score, entry.version, next(self.__sequence), entry.key))
+
+    def __remove(self, key: str):
+        entry = self.__buffer.pop(key)
+        if self.__latest.get(entry.author) == key:
+            del self.__latest[entry.author]
+        return entry
+
+    def __evict(self, score: float):
+        # drops the lowest scored buffered message, if it scores lower than the given score. returns whether it did
+        while self.__eviction_heap:
+            lowest, version, _, key = self.__eviction_heap[0]
+            entry = self.__buffer.get(key)
+            if entry is None or entry.version != version:
+                # outdated heap entry
+                heapq.heappop(self.__eviction_heap)
+                continue
+
+            if lowest >= score:
+                return False
 
-    def __check_connection(self, msg):
-        # Respond to Twitch checking if the bot is still active
-        if msg == "PING :tmi.twitch.tv\r\n":
-            self.__sock.send("PONG :tmi.twitch.tv\r\n".encode("utf-8"))
+            heapq.heappop(self.__eviction_heap)
+            self.__remove(key)
             return True
+
         return False
 
-    def get_message(self) -> str:
-        """
-        Returns the next chat message. Blocks until a message is received.
+    def submit(self, author: str, message: str, tags: dict = None):
+        now = time.monotonic()
+        key = normalize_chat_message(message)
+
+        with self.__lock:
+            self.__incoming.mark(now=now)
+
+            if not key:
+                self.__counters['dropped'] += 1
+                return False
+
+            # near-duplicates of buffered messages raise their score
+            entry = self.__buffer.get(key)
+            if entry is not None:
+                if author not in entry.authors:
+                    entry.authors.add(author)
+                    self.__rescore(entry)
+                self.__counters['collapsed'] += 1
+                return False
+
+            forwarded = self.__forwarded.get(key)
+            if forwarded is not None and now - forwarded < self.__duplicate_window:
+                self.__counters['collapsed'] += 1
+                return False
+
+            # follow-ups are merged into the author's latest buffered message, unless they would make it too long
+            latest = self.__buffer.get(self.__latest.get(author))
+            if (latest is not None and now - latest.updated < self.__merge_window
+                    and len(latest.text) + len(message) < self.max_merged_length):
+                latest.text = f'{latest.text} {message}'
+                latest.updated = now
+                self.__rescore(latest)
+                self.__counters['merged'] += 1
+                return False
+
+            entry = ChatMessage(author, message, key, tags, now)
+            entry.score = self.__scorer(message)
+
+            if len(self.__buffer) >= self.__capacity:
+                # either the new message or the lowest scored buffered one is dropped
+                self.__counters['dropped'] += 1
+                if not self.__evict(entry.score):
+                    return False
+
+            self.__buffer[key] = entry
+            self.__latest[author] = key
+            entry.version = next(self.__sequence)
+            heapq.heappush(self.__eviction_heap, (entry.score, entry.version, next(self.__sequence), key))
+            self.__counters['accepted'] += 1
+
+            # keeps the eviction heap from growing with outdated entries
+            if len(self.__eviction_heap) > 4 * self.__capacity:
+                self.__eviction_heap = [(e.score, e.version, next(self.__sequence), e.key)
+                                        for e in self.__buffer.values()]
+                heapq.heapify(self.__eviction_heap)
+
+            return True
+
+    def __expire(self, now: float):
+        # buffered and forwarded dictionaries are in insertion order, so the oldest entries are first
+        while self.__buffer:
+            entry = next(iter(self.__buffer.values()))
+            if now - entry.arrival < self.__max_age:
+                break
+            self.__remove(entry.key)
+            self.__counters['expired'] += 1
+
+        while self.__forwarded:
+            key, forwarded = next(iter(self.__forwarded.items()))
+            if now - forwarded < self.__duplicate_window:
+                break
+            del self.__forwarded[key]
+
+    def forward(self):
+        now = time.monotonic()
+
+        with self.__lock:
+            self.__expire(now)
+
+            selected = heapq.nlargest(self.__forward_count, self.__buffer.values(), key=lambda entry: entry.score)
+            for entry in selected:
+                self.__remove(entry.key)
+                self.__forwarded[entry.key] = now
+            self.__counters['forwarded'] += len(selected)
+
+        for entry in selected:
+            self.__queue.add_message(f'{entry.author}: {entry.text}', 'chat', {
+                'author': entry.author,
+                'subscriber': is_subscriber(entry.tags),
+            })
+
+        if selected and self.__on_forward is not None:
+            self.__on_forward()
+
+    def __tick(self):
+        if not self.__running:
+            return
+
+        self.forward()
+        self.__call = self.__scheduler.schedule(self.__forward_interval, self.__tick)
+
+    def start(self):
+        self.__running = True
+        self.__call = self.__scheduler.schedule(self.__forward_interval, self.__tick)
+
+    def stop(self):
+        self.__running = False
+        if self.__call is not None:
+            self.__call.cancel()
+
+    def stats(self):
+        with self.__lock:
+            return {'incoming_rate': self.__incoming.rate(), 'received': self.__incoming.total,
+                    'buffered': len(self.__buffer), **self.__counters}
+
+
+# ----------------------------------------------------------------------------
+
+
+# irc message, as parsed by parse_irc_line
+IRCMessage = namedtuple('IRCMessage', ['tags', 'prefix', 'command', 'params'])
+
+# escaped characters in IRCv3 tag values
+tag_escapes = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+# removes invisible characters that mess with string comparison
+control_characters = dict.fromkeys(range(32))
+
+
+def unescape_tag_value(value: str):
+    if '\\' not in value:
+        return value
+
+    unescaped = []
+    characters = iter(value)
+    for character in characters:
+        if character == '\\':
+            # a trailing backslash is dropped
+            escaped = next(characters, '')
+            character = tag_escapes.get(escaped, escaped)
+        unescaped.append(character)
+
+    return ''.join(unescaped)
+
+
+def parse_irc_line(line: str):
+    """
+    Parses a single IRC line (without the trailing CRLF), including IRCv3 tags.
+
+    Returns:
+        IRCMessage: The message's tags (dict), prefix (str, EG 'nick!user@host'), command (str, uppercase) and
+        params (list, the trailing param included as the last item).
+    """
+    tags = {}
+    if line.startswith('@'):
+        raw_tags, _, line = line[1:].partition(' ')
+        for tag in raw_tags.split(';'):
+            key, _, value = tag.partition('=')
+            tags[key] = unescape_tag_value(value)
+
+    prefix = ''
+    if line.startswith(':'):
+        prefix, _, line = line[1:].partition(' ')
+
+    line, has_trailing, trailing = line.partition(' :')
+    params = line.split()
+    command = params.pop(0).upper() if params else ''
+    if has_trailing:
+        params.append(trailing)
+
+    return IRCMessage(tags, prefix, command, params)
+
+
+class TwitchChat:
+    """
+    Asyncio client for Twitch chat (IRC). Iterating over it asynchronously yields (author, message) tuples:
+
+    async for author, message in TwitchChat(token, 'aikochannel'):
+        ...
+
+    Received data is buffered and split on CRLF, so several messages arriving together (or one message arriving in
+    parts) are handled correctly. PINGs are answered as soon as they are read, and the connection is re-established
+    with exponential backoff (and jitter) whenever it's lost or Twitch asks for a reconnect.
+
+    Parameters:
+        token (str): OAuth token. Can be acquired at https://twitchapps.com/tmi/.
+        channel (str): Target channel's name.
+        host (str), port (int): Chat server's address.
+        backoff_base (float): Max seconds to wait before the first reconnection attempt. Doubles on every failure.
+        backoff_max (float): Max seconds to wait between reconnection attempts.
+
+    Public Methods:
+    - events(): Async generator of the IRCMessage of every chat message (PRIVMSG), tags included.
+    - close(): Stops iterating and closes the connection.
+    """
+    def __init__(self, token: str, channel: str, host: str = 'irc.chat.twitch.tv', port: int = 6667,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0):
+        self.__token = token
+        self.__channel = channel.lower().lstrip('#')
+        self.__host = host
+        self.__port = port
+        self.__backoff_base = backoff_base
+        self.__backoff_max = backoff_max
+
+        self.__writer = None
+        self.__closed = False
+
+    async def __connect(self):
+        reader, writer = await asyncio.open_connection(self.__host, self.__port)
+        writer.write((
+            'CAP REQ :twitch.tv/tags twitch.tv/commands\r\n'
+            f'PASS {self.__token}\r\n'
+            f'NICK {self.__channel}\r\n'
+            f'JOIN #{self.__channel}\r\n'
+        ).encode('utf-8'))
+        await writer.drain()
+        return reader, writer
+
+    async def __backoff(self, attempt: int):
+        # full jitter
+        await asyncio.sleep(random.uniform(0, min(self.__backoff_max, self.__backoff_base * 2 ** attempt)))
+
+    async def events(self):
+        attempt = 0
+
+        while not self.__closed:
+            try:
+                reader, self.__writer = await self.__connect()
+            except OSError as e:
+                print('AIkoStreamingTools.py:')
+                print(f'Could not connect to Twitch chat: {e}')
+                print()
+                await self.__backoff(attempt)
+                attempt += 1
+                continue
+
+            try:
+                while True:
+                    line = await reader.readuntil(b'\r\n')
+                    message = parse_irc_line(line[:-2].decode('utf-8', errors='replace'))
+
+                    if message.command == 'PRIVMSG':
+                        yield message
+                    elif message.command == 'PING':
+                        # respond to Twitch checking if the bot is still active
+                        self.__writer.write(f'PONG :{message.params[-1] if message.params else ""}\r\n'.encode('utf-8'))
+                        await self.__writer.drain()
+                    elif message.command == '001':
+                        # logged in
+                        attempt = 0
+                    elif message.command == 'RECONNECT':
+                        break
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError) as e:
+                if not self.__closed:
+                    print('AIkoStreamingTools.py:')
+                    print(f'Lost connection to Twitch chat: {e!r}')
+                    print()
+            finally:
+                self.__writer.close()
+
+            if not self.__closed:
+                await self.__backoff(attempt)
+                attempt += 1
+
+    async def __aiter__(self):
+        async for message in self.events():
+            author = message.prefix.split('!', 1)[0]
+            yield author, message.params[-1].translate(control_characters)
+
+    def close(self):
+        self.__closed = True
+        if self.__writer is not None:
+            self.__writer.close()
+
+
+class Pytwitch:
+    def __init__(self, token: str, channel: str, host: str = 'irc.chat.twitch.tv', port: int = 6667):
         """
-        try:
-            # Hangs until something is received
-            message = self.__sock.recv(2048).decode("utf-8")
+        Basic class for acquiring twitch chat messages. Reads them through a TwitchChat client running on a separate
+        thread.
 
-        except socket.error:
-            return self.get_message()
+        Args:
+        token: OAuth token. Can be acquired at https://twitchapps.com/tmi/.
+        channel: Target channel's name.
+        """
+        self.__chat = TwitchChat(token, channel, host, port)
+        self.__loop = asyncio.new_event_loop()
+        self.__messages = Queue()
 
-        if self.__check_connection(message):
-            return self.get_message()
+        Thread(target=self.__loop.run_until_complete, args=(self.__read(),), name='twitch-chat', daemon=True).start()
 
-        # Avoid AttributeError and TypeError
-        if message:
-            # Use regex to separate string
-            username = re.search(r"\w+", message).group(0)
-            message = self.__CHAT_MSG.sub("", message)
+    async def __read(self):
+        async for message in self.__chat.events():
+            author = message.prefix.split('!', 1)[0]
+            # force lowercase for fewer comparisons
+            text = message.params[-1].translate(control_characters).lower()
+            self.__messages.put((author, text, message.tags))
 
-            # Force lowercase for fewer comparisons
-            message = message.lower()
+    def get_message(self, timeout: float = None):
+        """
+        Returns the next (author, message) tuple. Blocks until a message is received.
 
-            # Remove invisible characters that mess with string comparison
-            mapping = dict.fromkeys(range(32))
-            clean_message = message.translate(mapping)
+        Raises:
+            queue.Empty: If the timeout runs out before a message is received.
+        """
+        return self.get_tagged_message(timeout)[:2]
 
-            return username, clean_message
+    def get_tagged_message(self, timeout: float = None):
+        """
+        Returns the next (author, message, tags) tuple, tags being the message's IRCv3 tags (EG 'subscriber',
+        'badges'). Blocks until a message is received.
+        """
+        return self.__messages.get(timeout=timeout)
 
     def close_socket(self):
         """
         Closes connection with the Twitch API.
         """
-        self.__sock.close()
+        self.__loop.call_soon_threadsafe(self.__chat.close)
+
+
+# ----------------------------------------------------------------------------
+
+
+class SidePromptServer:
+    """
+    Receives side prompts from remote operators (see RemoteSP.py). Runs an asyncio server on a separate thread, so any
+    number of operators can stay connected at once, each over a single persistent connection.
+
+    Requests and replies are JSON objects, UTF-8 encoded, one per line. Every request is answered with a reply carrying
+    the request's id, once the prompt has been delivered (or refused):
+
+    - {"id": 1, "action": "hello", "operator": "name", "secret": "..."}: Names the operator in the streamer's
+    printouts. If the server has a secret, prompts are refused until a hello carrying it has been sent.
+    - {"id": 2, "action": "system", "prompt": "..."}: Queues the prompt as a system message, answered right away.
+    - {"id": 3, "action": "side_prompt", "prompt": "..."}: Adds the prompt to the character's side prompts.
+    - {"id": 4, "action": "ping"}
+
+    Replies are {"id": 2, "ok": true} or {"id": 2, "ok": false, "error": "..."}.
+
+    Parameters:
+        on_prompt (callable): Called with (action, prompt, operator) for each prompt received, on the server's thread.
+        Can raise ValueError to refuse the prompt.
+        host (str): Address to listen on. Only local operators can connect by default.
+        port (int): Port to listen on. 0 picks a free port.
+        max_request_size (int): Requests longer than this many bytes close the connection.
+        secret (str): Shared secret operators must send in their hello. Empty for no authentication.
+
+    Public Methods:
+    - start() -> tuple: Starts listening and returns the server's (host, port) address.
+    - stop(): Closes every connection and stops listening.
+    """
+    actions = ('hello', 'system', 'side_prompt', 'ping')
+
+    def __init__(self, on_prompt: callable, host: str = '127.0.0.1', port: int = 5004, max_request_size: int = 65536,
+                 secret: str = ''):
+        self.__on_prompt = on_prompt
+        self.__secret = secret
+        self.__host = host
+        self.__port = port
+        self.__max_request_size = max_request_size
+
+        self.__server = None
+        self.__writers = set()
+        self.__loop = asyncio.new_event_loop()
+        Thread(target=self.__loop.run_forever, name='side-prompt-server', daemon=True).start()
+
+    @property
+    def connections(self):
+        """
+        How many operators are currently connected.
+        """
+        return len(self.__writers)
+
+    def start(self):
+        async def start_server():
+            self.__server = await asyncio.start_server(self.__handle, self.__host, self.__port,
+                                                       limit=self.__max_request_size)
+            return self.__server.sockets[0].getsockname()[:2]
+
+        return asyncio.run_coroutine_threadsafe(start_server(), self.__loop).result()
+
+    def stop(self):
+        async def stop_server():
+            if self.__server is not None:
+                self.__server.close()
+            for writer in list(self.__writers):
+                writer.close()
+
+        asyncio.run_coroutine_threadsafe(stop_server(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+
+    def __process(self, line: bytes, operator: str, authenticated: bool):
+        """
+        Handles a single request. Returns the reply, the (possibly renamed) operator and whether the operator is
+        authenticated.
+        """
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('requests must be JSON objects')
+        except ValueError as e:
+            return {'id': None, 'ok': False, 'error': f'Invalid request: {e}'}, operator, authenticated
+
+        reply = {'id': request.get('id'), 'ok': True}
+        action = request.get('action')
+
+        if action not in self.actions:
+            reply.update(ok=False, error=f'Unknown action {action!r}.')
+
+        elif action == 'hello':
+            operator = str(request.get('operator') or operator)
+            if self.__secret:
+                authenticated = hmac.compare_digest(str(request.get('secret', '')).encode('utf-8'),
+                                                    self.__secret.encode('utf-8'))
+                if not authenticated:
+                    reply.update(ok=False, error='Wrong secret.')
+
+        elif not authenticated and action in ('system', 'side_prompt'):
+            reply.update(ok=False, error='Send a hello with the secret first.')
+
+        elif action in ('system', 'side_prompt'):
+            prompt = request.get('prompt')
+            if not isinstance(prompt, str) or not prompt.strip():
+                reply.update(ok=False, error='Empty prompt.')
+            else:
+                try:
+                    self.__on_prompt(action, prompt.strip(), operator)
+                except ValueError as e:
+                    reply.update(ok=False, error=str(e))
+
+        return reply, operator, authenticated
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info('peername')
+        operator = f'{peer[0]}:{peer[1]}' if peer else 'unknown'
+        authenticated = not self.__secret
+        self.__writers.add(writer)
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # the request went over the size limit, and the rest of it can't be told apart from the next one
+                    writer.write(json.dumps({'id': None, 'ok': False, 'error': f'Requests are limited to '
+                                             f'{self.__max_request_size} bytes.'}).encode('utf-8') + b'\n')
+                    await writer.drain()
+                    break
+
+                # connection closed by the operator
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                reply, operator, authenticated = self.__process(line, operator, authenticated)
+                writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.__writers.discard(writer)
+            writer.close()
 
 
 if __name__ == '__main__':
     chat = Pytwitch(open('keys/key_twitch.txt', 'r').read().strip(), 'aikochannel')
 
     while True:
-        comment = chat.get_message()
+        author, comment = chat.get_message()
         print('Got comment!')
-        print(comment)
+        print(f'{author}: {comment}')
 
-        if 'code red' in comment.lower():
+        if 'code red' in comment:
             chat.close_socket()
             break
 
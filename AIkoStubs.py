@@ -0,0 +1,391 @@
+"""
+AIkoStubs.py
+
+Local stand-ins for the external services Aiko's scripts talk to, so they can be tested and benchmarked offline.
+
+Changelog:
+
+001:
+- Initial release. Added StubOpenAIServer, a local stand-in for OpenAI's chat completion API.
+- Added constant_latency and lognormal_latency functions for building latency distributions.
+002:
+- Added StubTwitchIRCServer, a local stand-in for Twitch's chat (IRC) server.
+003:
+- Added StubSentimentBackend and StubSynthesisBackend, local stand-ins for Azure's sentiment analysis and text to speech
+with configurable latency distributions.
+"""
+import json
+import math
+import random
+from time import sleep
+from threading import Thread, Lock, Condition
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+
+
+# ------------------------------------------ LATENCY DISTRIBUTIONS ----------------------------------------------------
+
+
+def constant_latency(seconds: float):
+    """
+    Returns a latency distribution which always returns the given amount of seconds.
+    """
+    return lambda: seconds
+
+
+def lognormal_latency(median: float, sigma: float = 0.5):
+    """
+    Returns a log-normal latency distribution with the given median in seconds. Higher sigma values mean longer tails.
+    """
+    mu = math.log(median)
+    return lambda: random.lognormvariate(mu, sigma)
+
+
+# ------------------------------------------ OPENAI -------------------------------------------------------------------
+
+
+class StubOpenAIServer:
+    """
+    A local HTTP server which answers chat completion requests the way OpenAI's API does, both streamed and not
+    streamed. Connections are kept alive between requests.
+
+    Parameters:
+        reply (str or callable): The reply's text, or a function which builds it from the request's messages.
+        latency (callable): Returns how many seconds to wait before answering each request.
+        token_interval (float): Seconds between each streamed token.
+        rate_limit_chance (float): Chance (0-1) of answering a request with a 429 error.
+        retry_after (float, optional): Value of the Retry-After header sent with 429 errors.
+        port (int): Port to listen on. 0 picks a free port.
+
+    Attributes:
+        requests (int): How many requests have been received.
+        connections (int): How many connections have been opened.
+
+    Public Methods:
+    - start(): Starts serving on a separate thread and returns the server's API base URL.
+    - stop(): Stops the server.
+    """
+    def __init__(self, reply='Aiko: Hello! This is a stub reply.', latency: callable = constant_latency(0.0),
+                 token_interval: float = 0.0, rate_limit_chance: float = 0.0, retry_after: float = None,
+                 port: int = 0):
+        self.reply = reply
+        self.latency = latency
+        self.token_interval = token_interval
+        self.rate_limit_chance = rate_limit_chance
+        self.retry_after = retry_after
+
+        self.requests = 0
+        self.connections = 0
+        self.__lock = Lock()
+
+        self.__server = ThreadingHTTPServer(('127.0.0.1', port), self.__build_handler())
+        self.__server.daemon_threads = True
+
+    def record(self, attribute: str):
+        with self.__lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def build_reply(self, messages: list):
+        if callable(self.reply):
+            return self.reply(messages)
+        return self.reply
+
+    def __build_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                stub.record('connections')
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up on the request (EG, it timed out or was hedged)
+                    pass
+
+            def send_json(self, status: int, body: dict, headers: dict = None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_chunk(self, data: str):
+                data = data.encode('utf-8')
+                self.wfile.write(f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.record('requests')
+
+                sleep(stub.latency())
+
+                if random.random() < stub.rate_limit_chance:
+                    headers = {} if stub.retry_after is None else {'Retry-After': str(stub.retry_after)}
+                    self.send_json(429, {'error': {'message': 'Rate limit reached.', 'type': 'requests'}}, headers)
+                    return
+
+                reply = stub.build_reply(request['messages'])
+                tokens = reply.split(' ')
+                prompt_tokens = sum(len(message['content'].split()) for message in request['messages'])
+
+                if not request.get('stream'):
+                    self.send_json(200, {
+                        'object': 'chat.completion',
+                        'model': request['model'],
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply},
+                                     'finish_reason': 'stop'}],
+                        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                                  'total_tokens': prompt_tokens + len(tokens)}
+                    })
+                    return
+
+                # streams the reply as server sent events, one token per event
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                for i, token in enumerate(tokens):
+                    content = token if i == len(tokens) - 1 else f'{token} '
+                    chunk = {'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': content}}]}
+                    self.send_chunk(f'data: {json.dumps(chunk)}\n\n')
+                    sleep(stub.token_interval)
+
+                self.send_chunk('data: [DONE]\n\n')
+                self.send_chunk('')
+
+        return Handler
+
+    @property
+    def api_base(self):
+        host, port = self.__server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self.api_base
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+# ------------------------------------------ TWITCH CHAT --------------------------------------------------------------
+
+
+def escape_tag_value(value: str):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\:').replace(' ', '\\s')
+            .replace('\r', '\\r').replace('\n', '\\n'))
+
+
+class StubTwitchIRCServer:
+    """
+    A local IRC server which answers logins the way Twitch's chat server does, then sends whatever chat messages it's
+    told to to every client which joined a channel.
+
+    Parameters:
+        port (int): Port to listen on. 0 picks a free port.
+
+    Attributes:
+        connections (int): How many connections have been opened.
+        joins (int): How many times a channel has been joined.
+        pongs (int): How many PONGs have been received.
+        lines (list): Every line received, in order.
+
+    Public Methods:
+    - start(): Starts serving on a separate thread and returns the server's (host, port) address.
+    - send_message(author : str, message : str, tags : dict): Sends a chat message from author to every client.
+    - send_raw(data : bytes): Sends raw data to every client, EG several lines at once or part of a line.
+    - ping(): Sends a PING to every client.
+    - request_reconnect(): Sends a RECONNECT to every client.
+    - disconnect(): Closes every client's connection.
+    - wait_for_joins(count : int, timeout : float) -> bool: Blocks until the channel has been joined count times.
+    - stop(): Stops the server.
+    """
+    def __init__(self, port: int = 0):
+        self.connections = 0
+        self.joins = 0
+        self.pongs = 0
+        self.lines = []
+
+        self.channel = None
+        self.__clients = []
+        self.__condition = Condition()
+
+        self.__server = ThreadingTCPServer(('127.0.0.1', port), self.__build_handler())
+        self.__server.daemon_threads = True
+
+    def connected(self):
+        with self.__condition:
+            self.connections += 1
+
+    def record(self, line: str, handler):
+        with self.__condition:
+            self.lines.append(line)
+
+            command = line.split(' ', 1)[0].upper()
+            if command == 'PONG':
+                self.pongs += 1
+            elif command == 'JOIN':
+                self.channel = line.split(' ', 1)[1].lstrip('#')
+                self.joins += 1
+                self.__clients.append(handler)
+                self.__condition.notify_all()
+
+    def forget(self, handler):
+        with self.__condition:
+            if handler in self.__clients:
+                self.__clients.remove(handler)
+
+    def __build_handler(self):
+        stub = self
+
+        class Handler(StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                self.nick = None
+                stub.connected()
+
+            def send(self, data: bytes):
+                try:
+                    self.wfile.write(data)
+                    self.wfile.flush()
+                except OSError:
+                    pass
+
+            def handle(self):
+                try:
+                    for line in self.rfile:
+                        line = line.decode('utf-8').rstrip('\r\n')
+                        command = line.split(' ', 1)[0].upper()
+
+                        if command == 'CAP':
+                            self.send(f':tmi.twitch.tv CAP * ACK :{line.split(":", 1)[-1]}\r\n'.encode('utf-8'))
+                        elif command == 'NICK':
+                            self.nick = line.split(' ', 1)[1]
+                            self.send(f':tmi.twitch.tv 001 {self.nick} :Welcome, GLHF!\r\n'.encode('utf-8'))
+                        elif command == 'JOIN':
+                            channel = line.split(' ', 1)[1]
+                            self.send(f':{self.nick}!{self.nick}@{self.nick}.tmi.twitch.tv JOIN {channel}\r\n'
+                                      .encode('utf-8'))
+
+                        # recorded after answering, so clients are only sent messages once they have joined
+                        stub.record(line, self)
+                except OSError:
+                    pass
+                finally:
+                    stub.forget(self)
+
+        return Handler
+
+    def send_raw(self, data: bytes):
+        with self.__condition:
+            clients = list(self.__clients)
+
+        for client in clients:
+            client.send(data)
+
+    def send_message(self, author: str, message: str, tags: dict = None):
+        login = author.lower()
+        tags = {'display-name': author, **(tags or {})}
+        raw_tags = ';'.join(f'{key}={escape_tag_value(value)}' for key, value in tags.items())
+        self.send_raw(f'@{raw_tags} :{login}!{login}@{login}.tmi.twitch.tv PRIVMSG #{self.channel} :{message}\r\n'
+                      .encode('utf-8'))
+
+    def ping(self):
+        self.send_raw(b'PING :tmi.twitch.tv\r\n')
+
+    def request_reconnect(self):
+        self.send_raw(b':tmi.twitch.tv RECONNECT\r\n')
+
+    def disconnect(self):
+        with self.__condition:
+            clients = list(self.__clients)
+            self.__clients.clear()
+
+        for client in clients:
+            try:
+                client.connection.shutdown(2)
+            except OSError:
+                pass
+
+    def wait_for_joins(self, count: int, timeout: float = None):
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.joins >= count, timeout)
+
+    @property
+    def address(self):
+        return self.__server.server_address[:2]
+
+    def start(self):
+        Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self.address
+
+    def stop(self):
+        self.disconnect()
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+# ------------------------------------------ AZURE --------------------------------------------------------------------
+
+
+class StubSentimentBackend:
+    """
+    A sentiment backend which behaves like Azure's: batches of up to 10 messages, each taking a while to be answered.
+    Messages are scored by the local lexicon backend.
+
+    Parameters:
+        latency (callable): Returns how many seconds each batch takes.
+    """
+    max_batch_size = 10
+    batch_delay = 0.05
+
+    def __init__(self, latency: callable = constant_latency(0.0)):
+        from AikoSentiment import LexiconSentimentBackend
+
+        self.latency = latency
+        self.__lexicon = LexiconSentimentBackend()
+
+    def analyze_batch(self, texts: list) -> list:
+        sleep(self.latency())
+        return self.__lexicon.analyze_batch(texts)
+
+
+class StubSynthesisBackend:
+    """
+    A synthesis backend which behaves like Azure's text to speech: each render takes a while, and returns a silent clip
+    lasting as long as the text would take to be said.
+
+    Parameters:
+        latency (callable): Returns how many seconds each render takes.
+        words_per_minute (float): Speaking speed at a rate of 1.0.
+    """
+    def __init__(self, latency: callable = constant_latency(0.0), words_per_minute: float = 150.0):
+        from AIkoVoice import LocalSynthesisBackend
+
+        self.latency = latency
+        self.__local = LocalSynthesisBackend(words_per_minute)
+
+    def render(self, ssml: str):
+        sleep(self.latency())
+        return self.__local.render(ssml)
+
+
+if __name__ == '__main__':
+    server = StubOpenAIServer(latency=lognormal_latency(0.5))
+    print(f'Stub OpenAI API running at {server.start()}. Press enter to stop.')
+    input()
+    server.stop()
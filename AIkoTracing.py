@@ -0,0 +1,218 @@
+"""
+AIkoTracing.py
+
+Lightweight latency tracing for Aiko's interaction pipeline. Stage durations are kept in rolling histograms, and each
+message gets a span which collects timestamps as it moves through the pipeline (queue, prompt, completion, synthesis,
+playback).
+
+All timestamps come from time.monotonic, so they are only meaningful relative to each other.
+
+Changelog:
+
+001:
+- Initial release. Added LatencyHistogram, Span and Tracer classes, and get_tracer function.
+"""
+import threading
+from time import monotonic
+from collections import deque
+from contextlib import contextmanager
+
+# stages reported by Aiko's scripts, in pipeline order. other stage names can be recorded as well
+stages = (
+    'queue_wait',
+    'prompt_build',
+    'completion',
+    'first_sentence',
+    'sentiment',
+    'synthesis',
+    'playback',
+    'total',
+)
+
+# tracer shared by every script, created on first use
+tracer = None
+tracer_lock = threading.Lock()
+
+
+class LatencyHistogram:
+    """
+    Keeps the latest durations recorded for a stage and calculates percentiles over them.
+
+    Parameters:
+        window (int): How many of the latest durations are kept.
+    """
+    __slots__ = ('__samples', '__count')
+
+    def __init__(self, window: int = 1000):
+        self.__samples = deque(maxlen=window)
+        self.__count = 0
+
+    def record(self, seconds: float):
+        self.__samples.append(seconds)
+        self.__count += 1
+
+    @property
+    def count(self):
+        """
+        How many durations have been recorded in total, including the ones which already left the window.
+        """
+        return self.__count
+
+    def summary(self):
+        """
+        Returns a dictionary with the sample count and the p50, p95, p99 and max durations (in seconds) of the window.
+        """
+        samples = sorted(self.__samples)
+        if not samples:
+            return {'count': self.__count, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+        return {'count': self.__count, 'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99),
+                'max': samples[-1]}
+
+
+class Span:
+    """
+    Timestamps collected for one message as it moves through the pipeline.
+
+    Attributes:
+        label (str): What the span is for, EG the message's type.
+        start (float): When the message arrived.
+        marks (list): (event, timestamp) tuples, in the order they were marked.
+    """
+    __slots__ = ('label', 'start', 'marks', 'end', '__tracer')
+
+    def __init__(self, tracer, label: str, start: float = None):
+        self.label = label
+        self.start = monotonic() if start is None else start
+        self.marks = []
+        self.end = None
+        self.__tracer = tracer
+
+    def mark(self, event: str):
+        """
+        Records the current time under the given event name.
+        """
+        self.marks.append((event, monotonic()))
+
+    def finish(self):
+        """
+        Ends the span, recording its total duration. Finishing a span more than once has no effect.
+        """
+        if self.end is None:
+            self.end = monotonic()
+            self.__tracer.finish_span(self)
+
+    def as_dict(self):
+        """
+        Returns the span as a dictionary, with every mark as an offset in seconds from the span's start.
+        """
+        return {
+            'label': self.label,
+            'total': None if self.end is None else self.end - self.start,
+            'marks': [(event, timestamp - self.start) for event, timestamp in self.marks],
+        }
+
+
+class Tracer:
+    """
+    Collects stage durations and message spans. Thread safe.
+
+    Each thread can have a current span, which the pipeline's stages mark as the message goes through them. Work done
+    on other threads (EG, speech synthesis) should capture the current span when it's queued.
+
+    Parameters:
+        window (int): How many of the latest durations each stage's histogram keeps.
+        max_spans (int): How many finished spans are kept until drained.
+
+    Public Methods:
+    - record(stage : str, seconds : float): Records a stage's duration.
+    - measure(stage : str): Context manager which records the duration of its block.
+    - start_span(label : str, start : float) -> Span: Starts a span and makes it the current thread's current span.
+    - current() -> Span: Returns the current thread's span, or None.
+    - finish_current(): Finishes the current thread's span, if there is one.
+    - stats() -> dict: Summaries of every stage recorded so far.
+    - format_stats() -> str: The stats as a table.
+    - drain_spans() -> list: Returns and forgets the finished spans.
+    """
+    def __init__(self, window: int = 1000, max_spans: int = 200):
+        self.__window = window
+        self.__histograms = {}
+        self.__spans = deque(maxlen=max_spans)
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    def record(self, stage: str, seconds: float):
+        with self.__lock:
+            histogram = self.__histograms.get(stage)
+            if histogram is None:
+                histogram = self.__histograms[stage] = LatencyHistogram(self.__window)
+            histogram.record(seconds)
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, monotonic() - start)
+
+    def start_span(self, label: str, start: float = None):
+        span = Span(self, label, start)
+        self.__local.span = span
+        return span
+
+    def current(self):
+        return getattr(self.__local, 'span', None)
+
+    def finish_current(self):
+        span = self.current()
+        if span is not None:
+            self.__local.span = None
+            span.finish()
+
+    def finish_span(self, span: Span):
+        # called by Span.finish
+        self.record('total', span.end - span.start)
+        with self.__lock:
+            self.__spans.append(span)
+
+    def drain_spans(self):
+        with self.__lock:
+            spans = list(self.__spans)
+            self.__spans.clear()
+        return spans
+
+    def stats(self):
+        with self.__lock:
+            summaries = {stage: histogram.summary() for stage, histogram in self.__histograms.items()}
+
+        # known stages first, in pipeline order
+        order = {stage: i for i, stage in enumerate(stages)}
+        return dict(sorted(summaries.items(), key=lambda item: (order.get(item[0], len(order)), item[0])))
+
+    def format_stats(self):
+        rows = [f'{"stage":<16}{"count":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}']
+
+        for stage, summary in self.stats().items():
+            columns = [f'{summary[key] * 1000:.0f}' if summary[key] is not None else '-'
+                       for key in ('p50', 'p95', 'p99', 'max')]
+            rows.append(f'{stage:<16}{summary["count"]:>8}' + ''.join(f'{column:>10}' for column in columns))
+
+        if len(rows) == 1:
+            return 'No latencies recorded yet.'
+        return '\n'.join(rows)
+
+
+def get_tracer():
+    """
+    Returns the Tracer shared by every script, creating it on first use.
+    """
+    global tracer
+
+    with tracer_lock:
+        if tracer is None:
+            tracer = Tracer()
+        return tracer
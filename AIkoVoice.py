@@ -4,11 +4,13 @@ Voicelink.py
 Handles voice related functionality such as text to speech and speech to text for Aiko's scripts.
 
 File requirements:
-- AIkoINIhandler.py >= 2.3
+- AIkoINIhandler.py >= 48
+- AIkoTracing.py >= 001
+- AIkoDevices.py >= 001
 
 pip install:
 - azure.cognitiveservices.speech
-- keyboard
+- sounddevice
 
 Changelog:
 
@@ -23,47 +25,68 @@ Changelog:
 112:
 - Added "pitch" parameter to synthesizer's say method.
 - Default pitch when no parameter is given is configurable.
+116:
+- Synthesizer now renders speech to in-memory audio on a worker thread and plays it on a separate playback thread,
+so the next utterance can be synthesized while the current one is playing.
+- Added say_async method to Synthesizer, which queues an utterance and returns without waiting for it to be played.
+- Added LocalSynthesisBackend and NullPlayer, which allow the synthesis pipeline to run without Azure or audio devices.
+117:
+- Synthesis and playback latencies are now recorded by the tracer. Utterances are marked on the span which was current
+when they were queued.
+118:
+- SynthesisPipeline's threads are now named, so they can be told apart when profiling.
+119:
+- Importing AIkoVoice.py no longer reads the config or loads Azure's speech SDK. Both are loaded when first needed, and
+Recognizer and Synthesizer read their default devices and voice from the config when created.
+- Removed unused keyboard import.
+120:
+- Device endpoint IDs are looked up in AIkoDevices.py's shared DeviceRegistry, which caches the enumerated devices
+instead of running pnputil for every lookup, and also works on Linux.
+121:
+- Added PhraseCache class, which keeps rendered speech in memory (least recently used first out) and in size-bounded
+WAV files. Synthesizer looks utterances up in it before rendering them, so repeated phrases (greetings, thank-yous,
+generic messages, chat read aloud) are only synthesized once. Cache sizes and folder are configurable.
+122:
+- PhraseCache saves files on its own thread, and reads them without holding its lock. Rendered clips are cached after
+being queued for playback, so a cache miss no longer waits for the disk before being played.
 """
-import azure.cognitiveservices.speech as speechsdk
-import subprocess
-import keyboard
+import os
 import time
-from configparser import ConfigParser
-from threading import Event
+import re
+import wave
+import hashlib
+from queue import Queue
+from collections import OrderedDict
+from threading import Event, Thread, Lock
+from AIkoTracing import get_tracer
+from AIkoINIhandler import load_config
+from AIkoDevices import get_device_registry
 
+# phrase cache shared by every synthesizer, created on first use
+phrase_cache = None
+phrase_cache_lock = Lock()
 
-# reads config file
-config = ConfigParser()
-config.read('AIkoPrefs.ini')
 
+def load_speech_sdk():
+    """
+    Returns Azure's speech SDK module, importing it on first use.
+    """
+    import azure.cognitiveservices.speech as speechsdk
 
-def get_device_endpoint_id(device : str):
-    sd = subprocess.run(
-        ["pnputil", "/enum-devices", "/connected", "/class", "AudioEndpoint"],
-        capture_output=True,
-        text=True,
-    )
+    return speechsdk
 
-    device_info = sd.stdout.split("\n")[1:-1]
 
-    found_curly = False
-
-    virtual_cable_device_id = ''
-
-    for line in range(len(device_info)):
-        if device.lower() in device_info[line + 1].lower():
-            for letter in device_info[line]:
-                if letter == '{':
-                    found_curly = True
-                if found_curly:
-                    virtual_cable_device_id += letter
-            break
-
-    return(virtual_cable_device_id)
+def get_device_endpoint_id(device : str, kind : str = None):
+    # devices are enumerated once and cached by the shared registry
+    return get_device_registry().endpoint_id(device, kind)
 
 
 class Recognizer:
-    def __init__(self, microphone: str = config.get('VOICE', 'mic_device')):
+    def __init__(self, microphone: str = None):
+        if microphone is None:
+            microphone = load_config().get('VOICE', 'mic_device')
+
+        self.__speechsdk = load_speech_sdk()
         self.__set_speech_config()
         self.__set_audio_config(microphone)
         self.__set_speech_recognizer()
@@ -71,16 +94,16 @@ class Recognizer:
 
     def __set_speech_config(self):
         # builds SpeechConfig class
-        self.__speech_config = speechsdk.SpeechConfig(
+        self.__speech_config = self.__speechsdk.SpeechConfig(
         subscription = open('keys/key_azurespeech.txt', 'r').read().strip(),
-        region = config.get('VOICE', 'azure_region')
+        region = load_config().get('VOICE', 'azure_region')
             )
 
     def __set_audio_config(self, mic_device: str):
         # get the users chosen microphone device's endpoint id and builds AudioConfig class
         try:
-            mic_id = get_device_endpoint_id(mic_device)
-            self.__audio_config = speechsdk.audio.AudioConfig(
+            mic_id = get_device_endpoint_id(mic_device, 'input')
+            self.__audio_config = self.__speechsdk.audio.AudioConfig(
             use_default_microphone = False,
             device_name = mic_id
                 )
@@ -89,11 +112,11 @@ class Recognizer:
 
     def __set_speech_recognizer(self):
         # builds SpeechRecognizer class
-        self.__speech_recognizer = speechsdk.SpeechRecognizer(
+        self.__speech_recognizer = self.__speechsdk.SpeechRecognizer(
         speech_config = self.__speech_config,
         audio_config = self.__audio_config)
 
-    def start(self, parse_func, event: Event):  # hotkey: str = config.get('LIVESTREAM', 'toggle_listening')
+    def start(self, parse_func, event: Event):
         self.__speech_recognizer.start_continuous_recognition()
         self.__speech_recognizer.recognized.connect(lambda evt: parse_func(evt))
 
@@ -119,58 +142,508 @@ class Recognizer:
         self.__loop_started = False
 
 
+class AudioClip:
+    """
+    A rendered piece of speech, stored in memory as raw 16-bit mono PCM.
+
+    Parameters:
+        pcm (bytes): The audio samples.
+        sample_rate (int): The audio's sample rate in Hz.
+    """
+    def __init__(self, pcm: bytes, sample_rate: int = 24000):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self):
+        """
+        The clip's duration in seconds.
+        """
+        return len(self.pcm) / (2 * self.sample_rate)
+
+
+class AzureSynthesisBackend:
+    """
+    Renders SSML into AudioClips using Azure's text to speech service.
+    """
+    def __init__(self):
+        speechsdk = self.__speechsdk = load_speech_sdk()
+
+        # builds SpeechConfig class
+        speech_config = speechsdk.SpeechConfig(
+            subscription=open('keys/key_azurespeech.txt', 'r').read().strip(),
+            region=load_config().get('VOICE', 'azure_region')
+        )
+        speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Raw24Khz16BitMonoPcm)
+
+        # no audio config, so the synthesized audio is returned instead of played
+        self.__speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+
+    def render(self, ssml: str) -> AudioClip:
+        result = self.__speech_synthesizer.speak_ssml_async(ssml).get()
+
+        if result.reason != self.__speechsdk.ResultReason.SynthesizingAudioCompleted:
+            raise RuntimeError(f'Speech synthesis failed: {result.reason}')
+
+        return AudioClip(result.audio_data, 24000)
+
+
+class LocalSynthesisBackend:
+    """
+    Fake synthesis backend which renders silent AudioClips lasting roughly as long as the given text would take to be
+    said. Allows testing the synthesis pipeline without Azure.
+
+    Parameters:
+        words_per_minute (float): Speaking speed at a rate of 1.0.
+        latency (float): How many seconds each render takes.
+        sample_rate (int): The sample rate of the rendered clips.
+    """
+    def __init__(self, words_per_minute: float = 150.0, latency: float = 0.0, sample_rate: int = 24000):
+        self.__words_per_minute = words_per_minute
+        self.__latency = latency
+        self.__sample_rate = sample_rate
+
+    def render(self, ssml: str) -> AudioClip:
+        time.sleep(self.__latency)
+
+        rate = re.search(r'rate="([\d.]+)"', ssml)
+        rate = float(rate.group(1)) if rate else 1.0
+
+        words = len(re.sub(r'<[^>]+>', ' ', ssml).split())
+        duration = words / (self.__words_per_minute * rate / 60)
+
+        return AudioClip(bytes(2 * int(duration * self.__sample_rate)), self.__sample_rate)
+
+
+class SoundDevicePlayer:
+    """
+    Plays AudioClips on an output device through the sounddevice package.
+
+    Parameters:
+        device (str): The output device's name, or part of it. Uses the default speakers if not found.
+    """
+    def __init__(self, device: str = None):
+        import sounddevice
+
+        self.__sounddevice = sounddevice
+
+        try:
+            sounddevice.query_devices(device, 'output')
+        except ValueError:
+            print(f"Couldn't find {device} audio device. Using default speakers.")
+            device = None
+
+        self.__device = device
+
+    def play(self, clip: AudioClip):
+        with self.__sounddevice.RawOutputStream(
+                samplerate=clip.sample_rate, channels=1, dtype='int16', device=self.__device) as stream:
+            stream.write(clip.pcm)
+
+
+class NullPlayer:
+    """
+    Fake player which waits for as long as each clip would take to be played, without playing anything.
+    """
+    def play(self, clip: AudioClip):
+        time.sleep(clip.duration)
+
+
+class PhraseCache:
+    """
+    Keeps rendered speech so it doesn't have to be synthesized again. Clips are kept in memory, and the least recently
+    used ones are dropped once the memory tier is full. They are also saved as WAV files named after their key, which
+    are deleted (least recently used first) once the folder goes over its size limit. Files are written on a separate
+    thread, so caching a clip never waits for the disk. Thread safe.
+
+    Parameters:
+        max_memory (int): Maximum bytes of audio kept in memory. 0 disables the memory tier.
+        folder (str, optional): Folder the WAV files are saved to. The disk tier is disabled if not given.
+        max_disk (int): Maximum bytes of WAV files kept in the folder.
+
+    Public Methods:
+    - get(key : str) -> AudioClip: Returns the cached clip, or None.
+    - put(key : str, clip : AudioClip): Caches the clip.
+    - flush(): Blocks until every queued file has been written.
+    - stats() -> dict: Hit and miss counters, and the size of each tier.
+    """
+    def __init__(self, max_memory: int = 32 * 1024 * 1024, folder: str = None, max_disk: int = 256 * 1024 * 1024):
+        self.__max_memory = max_memory
+        self.__folder = folder if max_disk > 0 else None
+        self.__max_disk = max_disk
+
+        # key: clip, least recently used first
+        self.__memory = OrderedDict()
+        self.__memory_size = 0
+        # file name: size in bytes, least recently used first
+        self.__files = OrderedDict()
+        self.__disk_size = 0
+
+        self.__hits = 0
+        self.__disk_hits = 0
+        self.__misses = 0
+        self.__lock = Lock()
+
+        if self.__folder is not None:
+            os.makedirs(self.__folder, exist_ok=True)
+
+            # files left by previous runs, oldest first
+            entries = [entry for entry in os.scandir(self.__folder) if entry.name.endswith('.wav') and entry.is_file()]
+            for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+                self.__files[entry.name] = entry.stat().st_size
+                self.__disk_size += entry.stat().st_size
+            self.__delete_files(self.__evict_files())
+
+            # (key, clip) tuples waiting to be saved
+            self.__writes = Queue()
+            Thread(target=self.__write_loop, name='phrase-cache-writer', daemon=True).start()
+
+    @staticmethod
+    def make_key(text: str, voice: str, style: str, rate: float, pitch: float, backend: str = ''):
+        """
+        Returns the cache key of an utterance, a hash of everything which changes how it sounds. The backend's name
+        keeps clips rendered by test backends apart from real ones.
+        """
+        fields = (text, voice, style, rate, pitch, backend)
+        return hashlib.sha256('\x1f'.join(str(field) for field in fields).encode('utf-8')).hexdigest()
+
+    def __remember(self, key: str, clip: AudioClip):
+        if len(clip.pcm) > self.__max_memory:
+            return
+
+        if key in self.__memory:
+            self.__memory_size -= len(self.__memory.pop(key).pcm)
+        self.__memory[key] = clip
+        self.__memory_size += len(clip.pcm)
+
+        while self.__memory_size > self.__max_memory:
+            self.__memory_size -= len(self.__memory.popitem(last=False)[1].pcm)
+
+    def __evict_files(self):
+        # forgets the least recently used files until the folder fits its limit. returns their names, so they can be
+        # deleted without holding the lock
+        evicted = []
+        while self.__disk_size > self.__max_disk and self.__files:
+            name, size = self.__files.popitem(last=False)
+            self.__disk_size -= size
+            evicted.append(name)
+        return evicted
+
+    def __delete_files(self, names: list):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.__folder, name))
+            except OSError:
+                pass
+
+    def __read_file(self, name: str):
+        path = os.path.join(self.__folder, name)
+        try:
+            with wave.open(path, 'rb') as wav:
+                clip = AudioClip(wav.readframes(wav.getnframes()), wav.getframerate())
+        except (OSError, EOFError, wave.Error):
+            return None
+
+        try:
+            # marks the file as recently used, for the next run's eviction order
+            os.utime(path)
+        except OSError:
+            pass
+        return clip
+
+    def __write_loop(self):
+        while True:
+            key, clip = self.__writes.get()
+            try:
+                self.__write_file(key, clip)
+            finally:
+                self.__writes.task_done()
+
+    def __write_file(self, key: str, clip: AudioClip):
+        name = f'{key}.wav'
+        path = os.path.join(self.__folder, name)
+
+        try:
+            # written under a temporary name, so a crash never leaves a partial file behind
+            with wave.open(f'{path}.tmp', 'wb') as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(clip.sample_rate)
+                wav.writeframes(clip.pcm)
+            os.replace(f'{path}.tmp', path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print('AIkoVoice.py:')
+            print(f"Couldn't save phrase to the cache: {e}")
+            print()
+            return
+
+        with self.__lock:
+            if name in self.__files:
+                self.__disk_size -= self.__files.pop(name)
+            self.__files[name] = size
+            self.__disk_size += size
+            evicted = self.__evict_files()
+
+        self.__delete_files(evicted)
+
+    def get(self, key: str):
+        name = f'{key}.wav'
+        with self.__lock:
+            clip = self.__memory.get(key)
+            if clip is not None:
+                self.__memory.move_to_end(key)
+                self.__hits += 1
+                return clip
+
+            on_disk = self.__folder is not None and name in self.__files
+
+        # read without holding the lock, so other lookups don't wait for the disk
+        if on_disk:
+            clip = self.__read_file(name)
+
+        with self.__lock:
+            if clip is None:
+                if on_disk and name in self.__files:
+                    # deleted or corrupted since it was indexed
+                    self.__disk_size -= self.__files.pop(name)
+                self.__misses += 1
+                return None
+
+            if name in self.__files:
+                self.__files.move_to_end(name)
+            self.__remember(key, clip)
+            self.__hits += 1
+            self.__disk_hits += 1
+            return clip
+
+    def put(self, key: str, clip: AudioClip):
+        """
+        Keeps the clip in memory and queues it to be saved. Returns without waiting for the file to be written.
+        """
+        with self.__lock:
+            self.__remember(key, clip)
+
+        if self.__folder is not None:
+            self.__writes.put((key, clip))
+
+    def flush(self):
+        if self.__folder is not None:
+            self.__writes.join()
+
+    def stats(self):
+        with self.__lock:
+            return {'hits': self.__hits, 'disk_hits': self.__disk_hits, 'misses': self.__misses,
+                    'memory_size': self.__memory_size, 'disk_size': self.__disk_size}
+
+
+def get_phrase_cache():
+    """
+    Returns the PhraseCache shared by every synthesizer, creating it on first use. Returns None if both of its tiers
+    are disabled in the config.
+    """
+    global phrase_cache
+
+    with phrase_cache_lock:
+        if phrase_cache is None:
+            config = load_config()
+            max_memory = int(config.getfloat('VOICE', 'phrase_cache_memory') * 1024 * 1024)
+            max_disk = int(config.getfloat('VOICE', 'phrase_cache_disk') * 1024 * 1024)
+            if max_memory <= 0 and max_disk <= 0:
+                return None
+
+            phrase_cache = PhraseCache(max_memory, config.get('VOICE', 'phrase_cache_folder'), max_disk)
+        return phrase_cache
+
+
+class Utterance:
+    """
+    A piece of SSML going through the synthesis pipeline.
+
+    Public Methods:
+    - wait(timeout): Blocks until the utterance has been played.
+    """
+    def __init__(self, ssml: str, pause: float = 0.0, span=None, key: str = None):
+        self.ssml = ssml
+        self.pause = pause
+        # phrase cache key, if the utterance can be cached
+        self.key = key
+        self.clip = None
+        # tracing span of the message the utterance belongs to, if any
+        self.span = span
+        self.__played = Event()
+
+    def set_played(self):
+        self.__played.set()
+
+    @property
+    def played(self):
+        return self.__played.is_set()
+
+    def wait(self, timeout: float = None):
+        """
+        Blocks until the utterance has been played. Returns False if the timeout ran out first.
+        """
+        return self.__played.wait(timeout)
+
+
+class SynthesisPipeline:
+    """
+    Renders utterances to in-memory audio on a worker thread and plays them, in order, on a separate playback thread,
+    so the next utterance can be rendered while the current one is playing.
+
+    Parameters:
+        backend: Object with a render(ssml) method returning an AudioClip.
+        player: Object with a play(clip) method.
+        max_ready (int): Maximum number of rendered clips waiting to be played. Rendering pauses once it is reached.
+        cache (PhraseCache, optional): Where utterances with a key are looked up before being rendered.
+
+    Public Methods:
+    - submit(ssml, pause, key): Queues SSML for rendering and playback, returns its Utterance.
+    - close(): Stops the pipeline's threads after everything submitted has been played.
+    """
+    def __init__(self, backend, player, max_ready: int = 2, cache: PhraseCache = None):
+        self.__backend = backend
+        self.__player = player
+        self.__cache = cache
+
+        self.__pending = Queue()
+        self.__ready = Queue(maxsize=max_ready)
+
+        self.__tracer = get_tracer()
+
+        Thread(target=self.__render_loop, name='synthesis', daemon=True).start()
+        Thread(target=self.__playback_loop, name='playback', daemon=True).start()
+
+    def __render_loop(self):
+        while True:
+            utterance = self.__pending.get()
+            if utterance is None:
+                self.__ready.put(None)
+                return
+
+            cacheable = self.__cache is not None and utterance.key is not None
+            rendered = False
+            try:
+                if cacheable:
+                    utterance.clip = self.__cache.get(utterance.key)
+
+                if utterance.clip is None:
+                    with self.__tracer.measure('synthesis'):
+                        utterance.clip = self.__backend.render(utterance.ssml)
+                    rendered = True
+
+                if utterance.span is not None:
+                    utterance.span.mark('synthesized')
+            except Exception as e:
+                print('AIkoVoice.py:')
+                print(e)
+                print()
+
+            # blocks while the ready queue is full
+            self.__ready.put(utterance)
+
+            # cached once it's on its way to be played, so caching never delays playback
+            if cacheable and rendered:
+                self.__cache.put(utterance.key, utterance.clip)
+
+    def __playback_loop(self):
+        while True:
+            utterance = self.__ready.get()
+            if utterance is None:
+                return
+
+            try:
+                if utterance.clip is not None:
+                    if utterance.span is not None:
+                        utterance.span.mark('playing')
+                    with self.__tracer.measure('playback'):
+                        self.__player.play(utterance.clip)
+                    if utterance.span is not None:
+                        utterance.span.mark('played')
+                time.sleep(utterance.pause)
+            except Exception as e:
+                print('AIkoVoice.py:')
+                print(e)
+                print()
+            finally:
+                utterance.set_played()
+
+    def submit(self, ssml: str, pause: float = 0.0, key: str = None) -> Utterance:
+        """
+        Queues SSML for rendering and playback.
+
+        Args:
+            ssml (str): The SSML to be synthesized.
+            pause (float): Seconds of silence to keep after the utterance has been played.
+            key (str, optional): The utterance's phrase cache key. The utterance isn't cached if not given.
+
+        Returns:
+            Utterance: The queued utterance, which can be waited on.
+        """
+        utterance = Utterance(ssml, pause, self.__tracer.current(), key)
+        self.__pending.put(utterance)
+        return utterance
+
+    def close(self):
+        self.__pending.put(None)
+
+
 class Synthesizer:
-    def __init__(self, speakers: str = config.get('VOICE', 'audio_device'), voice: str = config.get('VOICE', 'azure_voice')):
-        self.__set_speech_config()
-        self.__set_audio_config(speakers)
-        self.__set_speech_synthesizer()
+    """
+    Voices text through a SynthesisPipeline.
+
+    Parameters:
+        speakers (str): The output device's name.
+        voice (str): The Azure voice to be used.
+        backend (optional): The pipeline's synthesis backend. Chosen according to the config if not given.
+        player (optional): The pipeline's player. Plays on the speakers device if not given.
+        cache (PhraseCache or bool): Cache for rendered phrases. True uses the shared one (see get_phrase_cache), False
+        disables caching.
+
+    Public Methods:
+    - say(text, rate, style, pitch): Voices the text, blocking until it has been played.
+    - say_async(text, rate, style, pitch, pause): Queues the text to be voiced and returns its Utterance.
+    - close(): Stops the synthesis pipeline.
+    """
+    def __init__(self, speakers: str = None, voice: str = None, backend=None, player=None, cache=True):
+        config = load_config()
+        if speakers is None:
+            speakers = config.get('VOICE', 'audio_device')
+        if voice is None:
+            voice = config.get('VOICE', 'azure_voice')
 
         self.voice = voice
         self.default_style = config.get('VOICE', 'default_style')
         self.default_rate = config.getfloat('VOICE', 'default_rate')
         self.default_pitch = config.getfloat('VOICE', 'default_pitch')
 
-    def __set_speech_config(self):
-        # builds SpeechConfig class
-        self.__speech_config = speechsdk.SpeechConfig(
-        subscription = open('keys/key_azurespeech.txt', 'r').read().strip(),
-        region = config.get('VOICE', 'azure_region')
-        )
+        if backend is None:
+            backend = self.__create_backend(config.get('VOICE', 'synthesis_backend'))
+        if player is None:
+            player = NullPlayer() if isinstance(backend, LocalSynthesisBackend) else SoundDevicePlayer(speakers)
+        self.__backend_name = type(backend).__name__
 
-    def __set_audio_config(self, speakers: str):
-        # get the users chosen device's endpoint id
-        try:
-            device_id = get_device_endpoint_id(speakers)
-            default_speaker = False
-        except:
-            print(f"Couldn't find {speakers} audio device. Using default speakers.")
-            device_id = ''
-            default_speaker = True
-
-        # builds AudioOutputConfig class
-        self.__audio_config = speechsdk.audio.AudioOutputConfig(
-            use_default_speaker=default_speaker,
-            device_name=device_id
-            )
+        if cache is True:
+            cache = get_phrase_cache()
+        self.__cache = cache or None
 
-    def __set_speech_synthesizer(self):
-        # builds SpeechSynthesizer class
-        self.__speech_synthesizer = speechsdk.SpeechSynthesizer(
-            speech_config=self.__speech_config,
-            audio_config=self.__audio_config
-            )
+        self.__pipeline = SynthesisPipeline(backend, player, config.getint('VOICE', 'ready_clips'), self.__cache)
 
-    def say(self, text: str, rate: int = None, style: str = None, pitch: str = None):
-        if rate is None:
-            rate = self.default_rate
-        if style is None:
-            style = self.default_style
-        if pitch is None:
-            pitch = self.default_pitch
+    @staticmethod
+    def __create_backend(name: str):
+        name = name.lower()
+        if name == 'azure':
+            return AzureSynthesisBackend()
+        if name == 'local':
+            return LocalSynthesisBackend()
+
+        raise ValueError(f'{name} is not a valid synthesis backend.')
 
+    def __build_ssml(self, text: str, rate: float, style: str, pitch: float):
         pitch = f'{int(pitch * 10)}%'
 
-        ssml = f"""
+        return f"""
         <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis"
         xmlns:mstts="https://www.w3.org/2001/mstts" xml:lang="en-US">
             <voice name="{self.voice}">
@@ -180,13 +653,35 @@ class Synthesizer:
             </voice>
         </speak>"""
 
-        speech_synthesis_result = self.__speech_synthesizer.speak_ssml_async(ssml).get()
+    def say_async(self, text: str, rate: float = None, style: str = None, pitch: float = None,
+                  pause: float = 0.0) -> Utterance:
+        """
+        Queues the text to be voiced. Returns immediately with an Utterance object, which can be waited on.
+        """
+        if rate is None:
+            rate = self.default_rate
+        if style is None:
+            style = self.default_style
+        if pitch is None:
+            pitch = self.default_pitch
 
+        key = None
+        if self.__cache is not None:
+            key = PhraseCache.make_key(text, self.voice, style, rate, pitch, self.__backend_name)
 
-if __name__ == '__main__':
-    from AIkoINIhandler import handle_ini
+        return self.__pipeline.submit(self.__build_ssml(text, rate, style, pitch), pause, key)
+
+    def say(self, text: str, rate: float = None, style: str = None, pitch: float = None):
+        """
+        Voices the text, blocking until it has been played.
+        """
+        self.say_async(text, rate, style, pitch).wait()
 
-    handle_ini()
+    def close(self):
+        self.__pipeline.close()
+
+
+if __name__ == '__main__':
     # tests synthesizer class
     synthesizer = Synthesizer()
     synthesizer.say('AIKO SMASH! AIKO NOT LIKE YOU!', pitch=-4.0)
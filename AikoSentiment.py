@@ -3,7 +3,7 @@ AikoSentiment.py
 
 Sentiment analysis functions.
 
-Requirements:
+Requirements (azure backend only):
 - key_azuresentiment.txt
 - pip install azure-ai-textanalytics
 
@@ -13,32 +13,379 @@ Changelog:
 - Initial release
 002:
 - Replaced match case statements with if/else statements in order to support older python versions.
+003:
+- Added SentimentService class, which keeps a single TextAnalyticsClient alive and analyzes messages in micro-batches,
+returning results through futures.
+- sentiment_analysis now goes through the shared SentimentService.
+- Mixed sentiment results no longer raise exceptions.
+004:
+- Sentiment analysis is now done through pluggable backends. Added AzureSentimentBackend and LexiconSentimentBackend,
+a local rule-based analyzer which works offline.
+- Backend used by the shared SentimentService can be chosen in the config.
+- Azure keys and SDK are only loaded when the azure backend is used.
+005:
+- SentimentService records how long each message took to be analyzed (including batching delay) in the tracer.
+006:
+- SentimentService's worker thread is now named, so it can be told apart when profiling.
+007:
+- The backend is chosen through AIkoINIhandler's load_config, so the INI file is only parsed once per process.
 """
-from azure.core.credentials import AzureKeyCredential
-from azure.ai.textanalytics import TextAnalyticsClient
+import re
+import math
+import time
+from concurrent.futures import Future
+from threading import Thread, Lock, Condition
+from AIkoTracing import get_tracer
+from AIkoINIhandler import load_config
 
-key_file = open('keys/key_azuresentiment.txt', 'r').read().split('\n')
-key = key_file[0]
-endpoint = key_file[1]
+# service shared by every sentiment analysis request, created on first use
+sentiment_service = None
+sentiment_service_lock = Lock()
 
 
-def sentiment_analysis(text: str):
-    text_analytics_client = TextAnalyticsClient(endpoint=endpoint, credential=AzureKeyCredential(key))
-    texts = [text]
-
-    result = text_analytics_client.analyze_sentiment(texts)
-    sentiment = result[0].sentiment
+def score_document(document):
+    """
+    Converts a document result from the Text Analytics API into a (sentiment, score) tuple, where score is the
+    confidence of the sentiment from 0 to 100.
+    """
+    sentiment = document.sentiment
 
     if sentiment == 'positive':
-        score = int(result[0].confidence_scores.positive * 100)
+        score = int(document.confidence_scores.positive * 100)
     elif sentiment == 'neutral':
-        score = int(result[0].confidence_scores.neutral * 100)
+        score = int(document.confidence_scores.neutral * 100)
     elif sentiment == 'negative':
-        score = int(result[0].confidence_scores.negative * 100)
+        score = int(document.confidence_scores.negative * 100)
+    else:
+        # mixed sentiment doesn't push the mood either way
+        score = 0
 
     return sentiment, score
 
 
+class SentimentBackend:
+    """
+    Base class for sentiment analysis backends.
+
+    Attributes:
+        max_batch_size (int): Maximum number of messages analyzed at once.
+        batch_delay (float): How many seconds a batch should wait to be filled up before being analyzed.
+    """
+    max_batch_size = 10
+    batch_delay = 0.0
+
+    def analyze_batch(self, texts: list) -> list:
+        """
+        Analyzes a batch of messages. Returns a list with a (sentiment, score) tuple for each message, where sentiment
+        is 'positive', 'neutral', 'negative' or 'mixed' and score is the sentiment's confidence from 0 to 100. Failed
+        messages get an exception instead of a tuple.
+        """
+        raise NotImplementedError
+
+
+class AzureSentimentBackend(SentimentBackend):
+    """
+    Sentiment analysis through Azure's Text Analytics API. Keeps a single client alive, and sends up to 10 messages
+    per request.
+    """
+    max_batch_size = 10
+    batch_delay = 0.05
+
+    def __init__(self, key_file: str = 'keys/key_azuresentiment.txt'):
+        from azure.core.credentials import AzureKeyCredential
+        from azure.ai.textanalytics import TextAnalyticsClient
+
+        key, endpoint = open(key_file, 'r').read().split('\n')[:2]
+        self.__client = TextAnalyticsClient(endpoint=endpoint, credential=AzureKeyCredential(key))
+
+    def analyze_batch(self, texts: list) -> list:
+        results = []
+        for document in self.__client.analyze_sentiment(texts):
+            if document.is_error:
+                results.append(RuntimeError(document.error.message))
+            else:
+                results.append(score_document(document))
+        return results
+
+
+class LexiconSentimentBackend(SentimentBackend):
+    """
+    Local rule-based sentiment analysis. Scores messages with a word valence lexicon, taking negations, intensifiers,
+    capitalization, exclamation marks and emoticons into account. Works offline and analyzes thousands of messages
+    per second.
+
+    Parameters:
+        lexicon (dict, optional): Extra {word: valence} entries, added to (or replacing) the built-in ones. Valences
+        range from -4 (very negative) to 4 (very positive).
+    """
+    max_batch_size = 256
+    batch_delay = 0.0
+
+    # word valences, from -4 (very negative) to 4 (very positive)
+    LEXICON = {
+        # positive
+        'love': 3.2, 'loved': 2.9, 'lovely': 2.8, 'adore': 3.0, 'cute': 2.0, 'adorable': 2.2, 'beautiful': 2.9,
+        'pretty': 1.7, 'awesome': 3.1, 'amazing': 2.8, 'great': 3.1, 'good': 1.9, 'nice': 1.8, 'cool': 1.3,
+        'best': 3.2, 'better': 1.9, 'fun': 2.3, 'funny': 1.9, 'happy': 2.7, 'glad': 2.0, 'like': 1.5, 'likes': 1.5,
+        'enjoy': 2.2, 'enjoyed': 2.3, 'wow': 2.0, 'thanks': 1.9, 'thank': 1.5, 'welcome': 2.0, 'smart': 1.7,
+        'clever': 1.8, 'genius': 2.6, 'wonderful': 2.7, 'perfect': 2.7, 'fantastic': 2.6, 'excellent': 2.7,
+        'brilliant': 2.8, 'sweet': 2.0, 'kind': 2.4, 'friend': 2.2, 'friends': 2.1, 'yay': 2.4, 'hype': 1.8,
+        'excited': 1.4, 'exciting': 2.2, 'win': 2.8, 'won': 2.7, 'proud': 2.1, 'hello': 0.5, 'hi': 0.5,
+        'congrats': 2.4, 'congratulations': 2.9, 'haha': 1.5, 'hahaha': 1.6, 'lol': 1.8,
+        'lmao': 2.0, 'pog': 2.0, 'poggers': 2.2, 'gg': 1.8, 'based': 1.2, 'wholesome': 2.3, 'hug': 2.1,
+        'hugs': 2.1, 'yes': 1.0, 'agree': 1.5, 'interesting': 1.7, 'talented': 2.3, 'queen': 1.5,
+        # negative
+        'hate': -2.7, 'hated': -3.2, 'hates': -1.9, 'awful': -2.0, 'terrible': -2.1, 'horrible': -2.5,
+        'bad': -2.5, 'worse': -2.1, 'worst': -3.1, 'ugly': -2.3, 'stupid': -2.4, 'dumb': -2.3, 'idiot': -2.3,
+        'boring': -1.3, 'bored': -1.1, 'annoying': -1.7, 'annoyed': -1.6, 'sad': -2.1, 'angry': -2.3, 'mad': -2.2,
+        'cringe': -1.8, 'trash': -1.9, 'garbage': -2.0, 'sucks': -1.5, 'suck': -1.2, 'shut': -0.8, 'die': -2.9,
+        'kill': -3.7, 'wtf': -2.8, 'no': -1.2, 'never': -0.5, 'wrong': -2.1, 'fail': -2.5, 'failed': -2.3,
+        'lose': -1.3, 'lost': -1.3, 'cry': -2.1, 'crying': -2.1, 'hurt': -2.4, 'pathetic': -2.6, 'useless': -1.8,
+        'disgusting': -2.4, 'lame': -1.8, 'weird': -0.7, 'creepy': -1.9, 'scary': -2.2, 'sorry': -0.3,
+        'unfortunately': -1.6, 'fake': -2.1, 'liar': -2.7, 'rude': -2.0, 'shame': -2.1, 'sick': -2.3,
+        'tired': -1.9, 'ew': -1.5, 'yikes': -1.2, 'bot': -0.6, 'meh': -0.5,
+    }
+    EMOTICONS = {
+        ':)': 2.0, ':-)': 2.0, ':d': 2.3, 'xd': 1.8, ';)': 1.5, '<3': 2.6, ':p': 1.2, '^^': 1.8, ':3': 1.8,
+        ':(': -1.9, ':-(': -1.9, ":'(": -2.2, '>:(': -2.5, 'd:': -1.8, '-_-': -1.0,
+    }
+    NEGATIONS = {
+        'not', 'no', 'never', 'none', 'nobody', 'nothing', 'neither', 'nor', 'cannot', "can't", 'cant', "don't",
+        'dont', "doesn't", 'doesnt', "didn't", 'didnt', "isn't", 'isnt', "aren't", 'arent', "wasn't", 'wasnt',
+        "won't", 'wont', "wouldn't", 'wouldnt', "shouldn't", 'shouldnt', 'without', "ain't", 'aint',
+    }
+    INTENSIFIERS = {
+        'very': 0.3, 'really': 0.3, 'so': 0.3, 'extremely': 0.4, 'super': 0.35, 'totally': 0.3, 'absolutely': 0.35,
+        'completely': 0.3, 'incredibly': 0.4, 'most': 0.3, 'too': 0.2, 'such': 0.2,
+        'kinda': -0.3, 'somewhat': -0.3, 'slightly': -0.3, 'barely': -0.35, 'sorta': -0.3, 'little': -0.2,
+    }
+
+    # how far back a negation affects words, and the damping it applies
+    NEGATION_WINDOW = 4
+    NEGATION_FACTOR = -0.74
+    # normalization constant of the compound score
+    ALPHA = 15
+
+    # emoticons (standing on their own), words, and exclamation/question marks
+    TOKEN = re.compile(
+        r'(?:^|(?<=\s))(?:' + '|'.join(re.escape(emoticon) for emoticon in sorted(EMOTICONS, key=len, reverse=True))
+        + r")(?=\s|$)|[a-z']+|[!?]",
+        re.IGNORECASE
+    )
+
+    def __init__(self, lexicon: dict = None):
+        self.__lexicon = dict(self.LEXICON)
+        if lexicon is not None:
+            self.__lexicon.update(lexicon)
+
+    def compound(self, text: str) -> float:
+        """
+        Returns the message's compound sentiment, from -1 (most negative) to 1 (most positive).
+        """
+        valences = []
+        negated_until = -1
+        intensity = 0.0
+        exclamations = 0
+
+        # emphasis through capitalization only counts when the message isn't all caps
+        letters = [character for character in text if character.isalpha()]
+        mixed_caps = not (letters and all(character.isupper() for character in letters))
+
+        for index, token in enumerate(self.TOKEN.findall(text)):
+            lowered = token.lower()
+
+            if lowered == '!':
+                exclamations += 1
+                continue
+            if lowered == '?':
+                continue
+
+            if lowered in self.EMOTICONS:
+                valences.append(self.EMOTICONS[lowered])
+                continue
+
+            if lowered in self.NEGATIONS:
+                negated_until = index + self.NEGATION_WINDOW
+                if lowered not in self.__lexicon:
+                    continue
+
+            if lowered in self.INTENSIFIERS:
+                intensity += self.INTENSIFIERS[lowered]
+                continue
+
+            valence = self.__lexicon.get(lowered)
+            if valence is None:
+                # stretched words, EG "soooo cuuuute"
+                valence = self.__lexicon.get(re.sub(r'(.)\1{2,}', r'\1', lowered))
+            if valence is None:
+                intensity = 0.0
+                continue
+
+            if intensity:
+                valence += math.copysign(intensity, valence)
+                intensity = 0.0
+            if mixed_caps and token.isupper() and len(token) > 1:
+                valence += math.copysign(0.733, valence)
+            if index <= negated_until and lowered not in self.NEGATIONS:
+                valence *= self.NEGATION_FACTOR
+
+            valences.append(valence)
+
+        if not valences:
+            return 0.0
+
+        total = sum(valences)
+        # exclamation marks amplify whatever the message's sentiment is
+        total += math.copysign(min(exclamations, 4) * 0.292, total) if total else 0.0
+
+        return total / math.sqrt(total * total + self.ALPHA)
+
+    def analyze(self, text: str):
+        """
+        Returns the message's (sentiment, score) tuple.
+        """
+        compound = self.compound(text)
+
+        if compound >= 0.05:
+            return 'positive', int(50 + 50 * compound)
+        if compound <= -0.05:
+            return 'negative', int(50 - 50 * compound)
+        return 'neutral', int(100 - 1000 * abs(compound))
+
+    def analyze_batch(self, texts: list) -> list:
+        return [self.analyze(text) for text in texts]
+
+
+def create_backend(name: str) -> SentimentBackend:
+    """
+    Creates a sentiment backend by name ('azure' or 'local').
+    """
+    name = name.lower()
+    if name == 'azure':
+        return AzureSentimentBackend()
+    if name == 'local':
+        return LexiconSentimentBackend()
+
+    raise ValueError(f'{name} is not a valid sentiment backend.')
+
+
+class SentimentService:
+    """
+    Analyzes submitted messages in micro-batches on a worker thread, through a sentiment backend. Bursts of messages are
+    analyzed in a few batches instead of one request per message.
+
+    Parameters:
+        backend (SentimentBackend): The backend doing the analysis.
+        max_batch_size (int, optional): Maximum number of messages per batch. Uses the backend's if not given.
+        max_delay (float, optional): Maximum number of seconds a message waits for its batch to fill up before it is
+        sent. Uses the backend's if not given.
+
+    Public Methods:
+    - submit(text): Queues a message for analysis. Returns a Future resolved with a (sentiment, score) tuple.
+    - analyze(text): Analyzes a message, blocking until the result is ready.
+    - close(): Stops the service after analyzing the messages already submitted.
+    """
+    def __init__(self, backend: SentimentBackend, max_batch_size: int = None, max_delay: float = None):
+        self.__backend = backend
+
+        self.__max_batch_size = backend.max_batch_size if max_batch_size is None else max_batch_size
+        self.__max_delay = backend.batch_delay if max_delay is None else max_delay
+
+        self.__pending = []
+        self.__condition = Condition()
+        self.__running = True
+        self.__tracer = get_tracer()
+
+        Thread(target=self.__loop, name='sentiment', daemon=True).start()
+
+    def __next_batch(self):
+        # blocks until a batch is ready, then takes it out of the pending list. returns None once the service is closed
+        with self.__condition:
+            while not self.__pending:
+                if not self.__running:
+                    return None
+                self.__condition.wait()
+
+            # gives the batch some time to fill up
+            deadline = time.monotonic() + self.__max_delay
+            while len(self.__pending) < self.__max_batch_size and self.__running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.__condition.wait(remaining)
+
+            batch = self.__pending[:self.__max_batch_size]
+            del self.__pending[:self.__max_batch_size]
+            return batch
+
+    def __loop(self):
+        while True:
+            batch = self.__next_batch()
+            if batch is None:
+                return
+
+            try:
+                results = self.__backend.analyze_batch([text for text, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            now = time.monotonic()
+            for (_, future, submitted), result in zip(batch, results):
+                self.__tracer.record('sentiment', now - submitted)
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def submit(self, text: str) -> Future:
+        """
+        Queues a message for analysis.
+
+        Returns:
+            Future: Resolved with a (sentiment, score) tuple once the message's batch has been analyzed.
+        """
+        future = Future()
+
+        with self.__condition:
+            if not self.__running:
+                raise RuntimeError('SentimentService has been closed.')
+
+            self.__pending.append((text, future, time.monotonic()))
+
+            # wakes the worker up when the first message arrives or when the batch is full
+            if len(self.__pending) == 1 or len(self.__pending) >= self.__max_batch_size:
+                self.__condition.notify()
+
+        return future
+
+    def analyze(self, text: str):
+        return self.submit(text).result()
+
+    def close(self):
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify()
+
+
+def get_sentiment_service():
+    """
+    Returns the SentimentService shared by every sentiment analysis request, creating it on first use.
+    """
+    global sentiment_service
+
+    with sentiment_service_lock:
+        if sentiment_service is None:
+            backend = create_backend(load_config().get('FRAME_OF_MIND', 'sentiment_backend'))
+            sentiment_service = SentimentService(backend)
+        return sentiment_service
+
+
+def sentiment_analysis(text: str):
+    return get_sentiment_service().analyze(text)
+
+
 if __name__ == '__main__':
     print(sentiment_analysis("I think you are cute."))
     print(sentiment_analysis("I don't think you are cute."))
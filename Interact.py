@@ -1,11 +1,10 @@
-from configparser import ConfigParser
+from AIkoINIhandler import load_config
 from AIkoVoice import Synthesizer
 from random import choice
 from AIko import AIko, txt_to_list
 
 # gets config
-config = ConfigParser()
-config.read('AIkoPrefs.ini')
+config = load_config()
 
 # creates a Synthesizer object for voicing Aiko
 synthesizer = Synthesizer()
@@ -4,11 +4,14 @@ GUI interaction loop for livestreaming.
 Requirements:
 
 .py:
-- AIko.py (159beta or greater) and its requirements.
-- AIkoINIHandler.py (24 or greater).
-- AIkoGUITools.py (015 or greater).
-- AIkoStreamingTools.py (029 or greater).
-- AIkoVoice.py (115 or greater) and its requirements.
+- AIko.py (181beta or greater) and its requirements.
+- AIkoINIHandler.py (49 or greater).
+- AIkoGUITools.py (21 or greater), unless running headless.
+- AIkoFrontend.py (001 or greater).
+- AIkoStreamingTools.py (045 or greater).
+- AIkoVoice.py (117 or greater) and its requirements.
+- AIkoTracing.py (001 or greater).
+- AIkoSession.py (004 or greater) and its requirements.
 
 packages:
 - pip install pytchat
@@ -32,626 +35,311 @@ been fixed, though.
 - Fixed silence breaker (say function was not clearing the speaking event, which prevented the loop from continuing)
 - Added base 'you are streaming' scenario when instantiating the AIko object.
 - Introduced a short delay between reading and answering when using the read keyword, for more naturality.
+025:
+- AnswerLoops can now stream completions (configurable), voicing the first sentence of an answer while the rest of it
+is still being generated.
+- Chat messages are now queued in the synthesizer without waiting, so the answer is synthesized while they are read.
+- Talk loop now blocks on MasterQueue until a message is ready, instead of busy polling it.
+- Silence breaker is now a callback scheduled for when the silence reaches its max time, instead of a polling loop.
+- Number of memory slots is now configurable.
+026:
+- Buffered log entries are now written before the app is closed.
+027:
+- Added stats command, which prints latency percentiles for each stage of the interaction pipeline.
+- Latency stats and recent message spans are periodically dumped to the log folder (configurable).
+028:
+- AnswerLoops keywords are now matched with a compiled prefix matcher. Fixed keywords being removed from system
+messages with strip, which also removed any of the keyword's characters from the end of the message.
+029:
+- Chat messages now go through a ChatIngestor before reaching the MasterQueue, which collapses duplicates and spam,
+merges follow-up messages and forwards the best scored messages at a steady pace. Ingestion settings are configurable.
+- Removed the delay after each Twitch chat message, which limited ingestion to about 10 messages per second.
+- stats command also prints chat ingestion counters.
+030:
+- Subscriber status (Twitch subscribers, YouTube members) is passed along with chat messages, for the MessagePool's
+weighted picks.
+- chat_clear command no longer assumes the pool has 10 slots.
+031:
+- Moved ChatLoop, AnswerLoops, parse_msg and prefetch to AIkoSession.py. The character, its queue and its loops are
+now a StreamSession, run by an Orchestrator which can run other sessions alongside it.
+- Twitch channel is now configurable.
+- Fixed the config file being read as AikoPrefs.ini, which fails on case sensitive file systems.
+032:
+- Remote side prompts are now received by a SidePromptServer, which remote operators (RemoteSP.py) stay connected to,
+instead of connecting to the operator every 100ms. Long prompts are no longer cut at 1024 bytes, several operators can
+be connected at once and each prompt is acknowledged.
+033:
+- GUI updates from the chat, talk, remote and speech threads are now queued and applied by the GUI's mainloop at a set
+refresh rate, and its text widgets keep a limited number of lines. Both are configurable.
+034:
+- Added headless mode (configurable), which runs without a GUI: output goes to the console, and commands are read from
+the console and optional control connections. tkinter is only imported when the GUI is used.
+035:
+- Everything is now built and started by main(), so importing Livestream.py no longer starts a livestream.
+036:
+- Remote side prompts require the secret set in the config, if there is one.
 """
 import os
-import socket
-from time import sleep, time
+import json
+from time import sleep
+from datetime import datetime
 from threading import Thread, Event
-from configparser import ConfigParser
-from random import choice, uniform, randint
 
-import pytchat
+from AIko import get_log_writer
+from AIkoFrontend import HeadlessFrontend
+from AIkoVoice import Recognizer
+from AIkoStreamingTools import SidePromptServer, default_scheduler
+from AIkoTracing import get_tracer
+from AIkoINIhandler import load_config
+from AIkoSession import Orchestrator
+build = '035'
 
-from AIko import AIko, txt_to_list
-from AIkoGUITools import LiveGUI
-from AIkoVoice import Synthesizer, Recognizer
-from AIkoStreamingTools import MasterQueue, Pytwitch
-build = '024'
 
-# loop controller
-running = True
+def main():
+    """
+    Builds the livestream's session, frontend and servers, then runs the frontend until the app is closed.
+    """
+    # ------------------------------------------------ MAIN OBJECTS ----------------------------------------------------
+    # config
+    config = load_config()
 
-# ------------------------------------------------ FUNCTIONS -----------------------------------------------------------
+    platform = config.get('LIVESTREAM', 'platform')
 
+    orchestrator = Orchestrator(config=config)
+    session = orchestrator.add_session(
+        'Aiko', f'You are doing a "JUST CHATTING STREAM" on {platform}.', platform=platform,
+        channel=config.get('LIVESTREAM', 'channel'), liveid=config.get('LIVESTREAM', 'liveid')
+    )
+    aiko = session.aiko
+    master_queue = session.queue
+    if config.get('LIVESTREAM', 'frontend').lower() == 'headless':
+        app = HeadlessFrontend(master_queue, control_port=config.getint('LIVESTREAM', 'control_port'))
+    else:
+        # tkinter is only imported when the GUI is used
+        from AIkoGUITools import LiveGUI
 
-def parse_msg(msg: str, character: str = ':', after=False):
-    if after:
-        return msg[msg.index(character) + 2:]
+        app = LiveGUI(master_queue, aiko, refresh_rate=config.getfloat('LIVESTREAM', 'ui_refresh_rate'),
+                      max_lines=config.getint('LIVESTREAM', 'ui_max_lines'))
 
-    return msg[: msg.index(character)]
+    # threading events
+    mute_event = Event()
+    allow_silence_breaker = Event()
+    speaking = Event()
 
-# ------------------------------------------------- CLASSES ------------------------------------------------------------
+    # loops
+    session.attach(app)
+    chat_ingestor = session.ingestor
+    answer_loops = session.answer_loops
 
+    # ---------------------------------------- COMMAND LINE COMMAND FUNCTIONS ------------------------------------------
 
-class ChatLoop:
-    def __init__(self, queue: MasterQueue, ui_app: LiveGUI, youtube: bool = False, yt_id: str = None):
-        self.__queue = queue
-        self.__app = ui_app
+    def cmd_toggle_mic():
+        mute_event.set()
 
-        if youtube:
-            self.__chat = pytchat.create(video_id=yt_id)
-            self.__loop = self.__loop_youtube
-        else:
-            self.__loop = self.__loop_twitch
-
-        self.__running = False
-
-    def start(self):
-        self.__running = True
-        Thread(target=self.__loop).start()
-
-    def stop(self):
-        self.__running = False
-
-    def __skip_message(self, message, author):
-        # skips chat commands
-        if message[0] == '!':
-            return True
-
-        if '@' in message:
-            if 'aikochannel' in message:
-                pass
-            else:
-                return True
-
-        # parses follow alerts and sends them as system messages
-        if author.lower() == 'streamelements' and 'just followed!' in message.lower():
-            follower = message.split(" ", 1)[0][1:]
-            self.__queue.add_message(
-                f'EVENT: {follower} just followed you on Twitch. Thank them! Read their name!', "system")
-            self.__app.print_to_cmdl(f'{follower} just followed. Letting the character know...')
-            return True
-
-        # skips bot replies
-        if author.lower() == 'streamelements':
-            return True
-
-        return False
-
-    def __attempt_merge(self, message, author):
-        if author == self.__last_author:
-            merged_message = f'{self.__last_message} {message}'
-            try:
-                self.__queue.edit_chat_message(self.__last_message, merged_message)
-                self.__app.print_to_cmdl(f'Merge triggered: {self.__last_message} + {message}')
-                self.__last_message = merged_message
-
-                self.__app.update_chat_widget()
-                return True
-            except ValueError:
-                self.__app.print_to_cmdl('Attempted a message merge, but exception occurred.')
-                return False
-
-    def __loop_twitch(self):
-        # starts pytwitch object
-        chat = Pytwitch(open('keys/key_twitch.txt').read().strip(), "aikochannel")
-        # last author variable for merging messages
-        self.__last_author = None
-
-        while running:
-            # blocks until a message is received
-            author, message = chat.get_message()
-            # checks whether message should be skipped (bot commands, etc)
-            if self.__skip_message(message, author):
-                continue
-            # merges current message with last message if the same user immediately follows up with a second message
-            if self.__attempt_merge(message, author):
-                continue
-
-            self.__last_author = author
-            self.__last_message = f'{self.__last_author}: {message}'
-
-            # adds message to queue
-            self.__queue.add_message(self.__last_message, "chat")
-
-            self.__app.update_chat_widget()
-
-            # to keep CPU usage from maxing out
-            sleep(0.1)
-
-    def __loop_youtube(self):
-        self.__last_author = None
+    # first, sets the function to be called when the mute button is pressed
+    app.bind_mute_button(cmd_toggle_mic)
+    # then adds a mute/un-mute command which invokes the button
+    app.add_command('mute', app.toggle_mute, 'Mutes/un-mutes the microphone.')
 
-        while self.__chat.is_alive():
-            if not running:
-                break
-            for c in self.__chat.get().sync_items():
-                if not running:
-                    break
-                # merges current message with last message if the same user immediately follows up with a second message
-                if self.__attempt_merge(c.message, c.author.name):
-                    continue
+    def cmd_help():
+        app.print_to_cmdl()
 
-                self.__last_author = c.author.name
-                self.__last_message = f'{self.__last_author}: {c.message}'
+    def cmd_start_silence_breaker():
+        answer_loops.sb_allow()
+        app.print_to_cmdl('Started the silence breaker.')
 
-                # adds message to queue
-                self.__queue.add_message(self.__last_message, "chat")
+    app.add_command('sb_start', cmd_start_silence_breaker, 'Starts the silence breaker.')
 
-                self.__app.update_chat_widget()
+    def cmd_stop_silence_breaker():
+        answer_loops.sb_stop()
+        app.print_to_cmdl('Stopped the silence breaker.')
 
-            # to keep CPU usage from maxing out
-            sleep(0.1)
+    app.add_command('sb_stop', cmd_stop_silence_breaker, 'Stops the silence breaker.')
 
+    def cmd_switch_scenario(scenario: str):
+        aiko.change_scenario(scenario)
+        app.print_to_cmdl('Changed scenario.')
 
-class AnswerLoops:
-    def __init__(self, char: AIko, ui_app: LiveGUI, queue: MasterQueue):
-        self.__last_time_spoken = time()
+    app.add_command('scenario_change', cmd_switch_scenario, 'Changes the current scenario.')
 
-        # aiko object, app object, message queue object
-        self.__char = char
-        self.__app = ui_app
-        self.__queue = queue
+    def cmd_check_scenario():
+        scenario = aiko.check_scenario()
+        if scenario == '':
+            scenario = 'NO SCENARIO'
+        app.print_to_cmdl(f'Current scenario: "{scenario}"')
 
-        self.__speaking = Event()
-        self.__allow_sb = Event()
+    app.add_command('scenario_check', cmd_check_scenario, 'Prints the current scenario.')
 
-        self.__debug_fom = False
+    def cmd_add_side_prompt(side_prompt: str):
+        aiko.add_side_prompt(side_prompt)
+        app.update_side_prompts_widget()
 
-        self.__config = ConfigParser()
-        self.__config.read('AikoPrefs.ini')
+        app.print_to_cmdl(f'Added local SP: "{side_prompt}"')
 
-        # voices aiko
-        self.__synthesizer = Synthesizer()
+    app.add_command('sp_add', cmd_add_side_prompt, "Injects a side-prompt into the character's memory.")
 
-        # keyword system
-        self.__keywords = {
-            'DEFAULT_SYS': self.__kw_default,
-            # read only
-            'READ_ONLY': self.__kw_read_only,
-            'READ_ONLY_PARSE': self.__kw_read_only_parse,
-            # read and answer
-            'READ': self.__kw_read,
-            'READ_PARSE': self.__kw_read_parse,
-        }
+    def cmd_clear_side_prompts():
+        aiko.context.side_prompts.clear()
 
-    # ----------------------------- KEYWORD CALLED FUNCTIONS
-    def __kw_default(self, message: str):
-        output = self.__char.interact(message, True)
-        self.__app.print(f'(SYS) {message}')
-        self.__app.print(f'Aiko: {output}\n')
+        app.update_side_prompts_widget()
+        app.print_to_cmdl('Cleared all side prompts.')
 
-        self.__say(output)
+    app.add_command('sp_clear', cmd_clear_side_prompts, 'Deletes all side-prompts.')
 
-        # FOM debug printouts
-        if self.__debug_fom:
-            self.__app.print(f'CURRENT SCORE: {aiko.fom.check_score()}')
-            self.__app.print(f'NEXT MOOD: {aiko.context.check_personality()}\n')
+    def cmd_send_sys_message(message: str):
+        master_queue.add_message(message, "system")
+        app.print_to_cmdl(f'Added SM to queue: "{message}"')
 
-    def __kw_read_only(self, message: str, parse=False):
-        self.__app.print(f'(READ){message}\n')
+    app.add_command('send_sys_msg', cmd_send_sys_message,
+                    'Sends a system message to be immediately answered by the char.')
 
-        self.__say(parse_msg(message, after=True) if parse else message, reading=True)
+    def cmd_chat_clear():
+        master_queue.clear_chat_messages()
+        app.update_chat_widget()
+        app.print_to_cmdl('Clearing chat messages...')
 
-        # adds read message to side prompts so the character can "remember" reading it
-        self.__add_sp(message)
+    app.add_command('chat_clear', cmd_chat_clear, 'Clears all chat messages currently in queue.')
 
-    def __kw_read(self, message: str, parse=False):
-        output = self.__char.interact(message, True)
+    def cmd_chat_pause():
+        app.toggle_chat_pause()
+        app.print_to_cmdl('Paused/un-paused the chat queue.')
 
-        self.__app.print(f'(READ){message}')
-        self.__app.print(f'Aiko: {output}\n')
+    app.add_command('chat_pause', cmd_chat_pause, 'Pauses/unpauses the chat queue.')
 
-        self.__say(parse_msg(message, after=True) if parse else message, reading=True)
-        sleep(uniform(0.10, 0.15))
-        self.__say(output)
+    def cmd_debug_fom(debug: str):
+        answer_loops.set_debug_fom(debug)
+        app.print_to_cmdl(f'Set debug_fom to {debug.upper()}.')
 
-        # adds read message to side prompts so the character can "remember" reading it
-        self.__add_sp(message)
-
-        # FOM debug printouts
-        if self.__debug_fom:
-            self.__app.print(f'CURRENT SCORE: {aiko.fom.check_score()}')
-            self.__app.print(f'NEXT MOOD: {aiko.context.check_personality()}\n')
-
-    def __kw_read_only_parse(self, message: str):
-        self.__kw_read_only(message, parse=True)
-
-    def __kw_read_parse(self, message: str):
-        self.__kw_read(message, parse=True)
-
-    # ----------------------------------------
-    @property
-    def keywords(self):
-        return sorted(list(self.__keywords.keys()) + self.__char.keywords)
-
-    def __check_for_kw(self, message: str):
-        """
-        Checks if message contains a keyword, and executes the corresponding keyword function.
-        """
-        if ':' in message:
-            keyword = parse_msg(message)
-            if keyword in self.__keywords:
-                message = message.strip(f'{keyword}:')
-                self.__keywords[keyword](message)
-                return
+    app.add_command('debug_fom', cmd_debug_fom,
+                    'Enables FrameOfMind feature debugging printouts. Usage: debug_fom true/false')
 
-        self.__keywords['DEFAULT_SYS'](message)
-
-    def __say(self, message: str, rate: float = None, style: str = None, pitch: float = None, reading: bool = False):
-        """
-        Sets self.__speaking event in order to declare silence has been broken and voices the given message.
-        """
-        if reading:
-            self.__speaking.set()
-            self.__synthesizer.say(message, rate=uniform(1.2, 1.4), style="neutral")
-            self.__speaking.clear()
-        else:
-            # uses default/given parameters
-            self.__speaking.set()
-            self.__synthesizer.say(message, rate, style, pitch)
-            self.__speaking.clear()
-
-        # resets timer
-        self.__last_time_spoken = time()
-
-    def __add_sp(self, side_prompt: str):
-        self.__char.add_side_prompt(side_prompt)
-        self.__app.update_side_prompts_widget()
-
-    # --------------------------------- LOOPS
-    # interacts with the character AI
-    def __talk_loop(self):
-        """
-        Character's answer loop.
-        """
-
-        while running:
-            msg_type, message = self.__queue.get_next()
-            if msg_type == 'system':
-                self.__check_for_kw(message)
+    def cmd_keywords():
+        help_string = ''
+        for keyword in answer_loops.keywords:
+            if keyword == 'DEFAULT_SYS':
                 continue
-            elif msg_type == 'chat':
-                self.__app.update_chat_widget()
+            help_string += f'{keyword}\n\n'
 
-            # no messages in queue
-            if message == '':
-                continue
+        app.print_to_cmdl(f'KEYWORDS: \n\n{help_string[:-1]}')
 
-            # --------------------------- regular message route ---------------------------------------
-            output = self.__char.interact(message)
+    app.add_command('keywords', cmd_keywords, 'Prints available system message keywords.')
 
-            # reads message before answering, if message is a chat message.
-            if msg_type == 'chat':
-                self.__say(parse_msg(message, after=True), reading=True)
+    def cmd_greet():
+        master_queue.add_message("SPONTANEOUS: You have just started your livestream. Greet the audience.", "system")
 
-            self.__app.print(f'({msg_type.upper()}) {message}')
-            self.__app.print(f'Aiko: {output}\n')
+    app.add_command('greet', cmd_greet, 'Queues a system message ordering the character to greet the audience.')
 
-            # FOM debug printouts
-            if self.__debug_fom:
-                self.__app.print(f'CURRENT SCORE: {aiko.fom.check_score()}')
-                self.__app.print(f'NEXT MOOD: {aiko.context.check_personality()}\n')
+    def cmd_goodbye():
+        master_queue.add_message("SPONTANEOUS: You are about to end your livestream. Say goodbye to the audience.")
 
-            self.__say(output)
+    app.add_command('goodbye', cmd_goodbye,
+                    'Queues a system message ordering the character to bid goodbye to the audience.')
 
-            sleep(0.1)
+    def cmd_stats():
+        app.print_to_cmdl(get_tracer().format_stats())
+        app.print_to_cmdl(', '.join(f'{key}: {value:.1f}' if isinstance(value, float) else f'{key}: {value}'
+                                    for key, value in chat_ingestor.stats().items()))
 
-    # silence breaker
-    def __sb_loop(self):
-        """
-        Silence breaker loop.
-        """
-        system_prompts = txt_to_list('prompts/spontaneous_messages.txt')
-        generic_messages = txt_to_list('prompts/generic_messages.txt')
+    app.add_command('stats', cmd_stats, 'Prints pipeline latency percentiles and chat ingestion counters.')
 
-        min_time = self.__config.getint('SPONTANEOUS_TALKING', 'min_time')
-        max_time = self.__config.getint('SPONTANEOUS_TALKING', 'max_time')
+    def cmd_close_protocol():
+        app.close_app()
+        side_prompt_server.stop()
+        # os._exit skips exit handlers, so buffered log entries are written first
+        orchestrator.stop()
+        os._exit(0)
 
-        # rolls initial max silence time
-        max_silence_time = randint(min_time, max_time)
+    app.add_command('exit', cmd_close_protocol, 'Closes the app.')
+    # also sets this function to run when the app is closed
 
-        while running:
-            # to save on CPU usage during loop execution
-            sleep(0.1)
-            # executes if spontaneous messages arent paused (paused by default)
-            if not self.__allow_sb.is_set():
-                continue
-            # also checks if the character is currently speaking before continuing
-            if self.__speaking.is_set():
-                continue
+    app.set_close_protocol(cmd_close_protocol)
 
-            # checks if time threshold has been reached
-            now = time()
-            if not now - self.__last_time_spoken >= max_silence_time:
-                continue
-            # re-rolls max silence time
-            max_silence_time = randint(min_time, max_time)
-            # decides between spontaneous or generic message
-            dice = randint(0, 1)
-            if dice == 0:
-                try:
-                    message = system_prompts.pop(randint(0, len(system_prompts) - 1))
-                    self.__queue.add_message(message, "system")
-                    sleep(randint(min_time, max_time))
-                    continue
-                except:
-                    pass
-
-            # if dice == 1
-            self.__queue.add_message(choice(generic_messages), "system")
-
-    # -------------------------------- PUBLIC
-
-    def sb_allow(self):
-        """
-        Resumes/Initiates silence breaker.
-        """
-        self.__last_time_spoken = time()
-        self.__allow_sb.set()
+    # ------------------------------------------- SCHEDULED FUNCTIONS --------------------------------------------------
+    stats_dump_interval = config.getfloat('LIVESTREAM', 'stats_dump_interval')
+    stats_file = f'log/stats_{datetime.now().strftime("%d-%m-%Y_%H-%M-%S")}.jsonl'
 
-    def sb_stop(self):
+    def dump_stats():
         """
-        Pauses the silence breaker.
+        Appends the latency stats and the spans finished since the last dump to the session's stats file, then schedules
+        the next dump.
         """
-        self.__allow_sb.clear()
+        tracer = get_tracer()
+        get_log_writer().write(stats_file, json.dumps({
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'stages': tracer.stats(),
+            'spans': [span.as_dict() for span in tracer.drain_spans()],
+        }, ensure_ascii=False) + '\n')
 
-    def set_debug_fom(self, debug: str):
-        self.__debug_fom = bool(debug.capitalize())
+        default_scheduler().schedule(stats_dump_interval, dump_stats)
 
-    def start(self):
+    # ------------------------------------------- REMOTE SIDE PROMPTS --------------------------------------------------
+
+    def remote_side_prompt(action: str, prompt: str, operator: str):
         """
-        Starts loops in separate threads.
+        Called by the side prompt server for each prompt sent by a remote operator.
         """
-        Thread(target=self.__talk_loop).start()
-        Thread(target=self.__sb_loop).start()
-
-
-# ------------------------------------------------ MAIN OBJECTS --------------------------------------------------------
-# config
-config = ConfigParser()
-config.read('AikoPrefs.ini')
-
-platform = config.get('LIVESTREAM', 'platform')
-
-aiko = AIko('Aiko', f'You are doing a "JUST CHATTING STREAM" on {platform}.', sp_slots=config.getint('GENERAL', 'max_side_prompts'))
-master_queue = MasterQueue()
-app = LiveGUI(master_queue, aiko)
-
-# threading events
-mute_event = Event()
-allow_silence_breaker = Event()
-speaking = Event()
-
-# loops
-chat_loop = ChatLoop(
-    master_queue, app, platform == 'youtube', config.get('LIVESTREAM', 'liveid')
-)
-answer_loops = AnswerLoops(aiko, app, master_queue)
-
-# ---------------------------------------- COMMAND LINE COMMAND FUNCTIONS ----------------------------------------------
-
-
-def cmd_toggle_mic():
-    mute_event.set()
-
-
-# first, sets the function to be called when the mute button is pressed
-app.bind_mute_button(cmd_toggle_mic)
-# then adds a mute/un-mute command which invokes the button
-app.add_command('mute', app.bp_button_mute.press, 'Mutes/un-mutes the microphone.')
-
-
-def cmd_help():
-    app.print_to_cmdl()
-
-
-def cmd_start_silence_breaker():
-    answer_loops.sb_allow()
-    app.print_to_cmdl('Started the silence breaker.')
-
-
-app.add_command('sb_start', cmd_start_silence_breaker, 'Starts the silence breaker.')
-
-
-def cmd_stop_silence_breaker():
-    answer_loops.sb_stop()
-    app.print_to_cmdl('Stopped the silence breaker.')
-
-
-app.add_command('sb_stop', cmd_stop_silence_breaker, 'Stops the silence breaker.')
-
-
-def cmd_switch_scenario(scenario: str):
-    aiko.change_scenario(scenario)
-    app.print_to_cmdl('Changed scenario.')
-
+        app.print_to_cmdl(f'Remote side prompt received from {operator} ({action}): {prompt}')
 
-app.add_command('scenario_change', cmd_switch_scenario, 'Changes the current scenario.')
-
-
-def cmd_check_scenario():
-    scenario = aiko.check_scenario()
-    if scenario == '':
-        scenario = 'NO SCENARIO'
-    app.print_to_cmdl(f'Current scenario: "{scenario}"')
-
-
-app.add_command('scenario_check', cmd_check_scenario, 'Prints the current scenario.')
-
-
-def cmd_add_side_prompt(side_prompt: str):
-    aiko.add_side_prompt(side_prompt)
-    app.update_side_prompts_widget()
-
-    app.print_to_cmdl(f'Added local SP: "{side_prompt}"')
-
-
-app.add_command('sp_add', cmd_add_side_prompt, "Injects a side-prompt into the character's memory.")
-
-
-def cmd_clear_side_prompts():
-    for i in range(0, 5):
-        aiko.context.side_prompts.delete_item(i)
-
-    app.update_side_prompts_widget()
-    app.print_to_cmdl('Cleared all side prompts.')
-
-
-app.add_command('sp_clear', cmd_clear_side_prompts, 'Deletes all side-prompts.')
-
-
-def cmd_send_sys_message(message: str):
-    master_queue.add_message(message, "system")
-    app.print_to_cmdl(f'Added SM to queue: "{message}"')
-
-
-app.add_command('send_sys_msg', cmd_send_sys_message, 'Sends a system message to be immediately answered by the char.')
-
-
-def cmd_chat_clear():
-    app.chat_button_pause.press()
-    for i in range(0, 10):
-        master_queue.delete_chat_message(i)
-    app.chat_button_pause.press()
-    app.print_to_cmdl('Clearing chat messages...')
-
-
-app.add_command('chat_clear', cmd_chat_clear, 'Clears all chat messages currently in queue.')
-
-
-def cmd_chat_pause():
-    app.chat_button_pause.press()
-    app.print_to_cmdl('Paused/un-paused the chat queue.')
-
-
-app.add_command('chat_pause', cmd_chat_pause, 'Pauses/unpauses the chat queue.')
-
-
-def cmd_debug_fom(debug: str):
-    answer_loops.set_debug_fom(debug)
-    app.print_to_cmdl(f'Set debug_fom to {debug.upper()}.')
-
-
-app.add_command('debug_fom', cmd_debug_fom,
-                'Enables FrameOfMind feature debugging printouts. Usage: debug_fom true/false')
-
-
-def cmd_keywords():
-    help_string = ''
-    for keyword in answer_loops.keywords:
-        if keyword == 'DEFAULT_SYS':
-            continue
-        help_string += f'{keyword}\n\n'
-
-    app.print_to_cmdl(f'KEYWORDS: \n\n{help_string[:-1]}')
-
-
-app.add_command('keywords', cmd_keywords, 'Prints available system message keywords.')
-
-
-def cmd_greet():
-    master_queue.add_message("SPONTANEOUS: You have just started your livestream. Greet the audience.", "system")
-
-
-app.add_command('greet', cmd_greet, 'Queues a system message ordering the character to greet the audience.')
-
-
-def cmd_goodbye():
-    master_queue.add_message("SPONTANEOUS: You are about to end your livestream. Say goodbye to the audience.")
-
-
-app.add_command('goodbye', cmd_goodbye, 'Queues a system message ordering the character to bid goodbye to the audience.')
-
-
-def cmd_close_protocol():
-    global running
-
-    running = False
-    app.close_app()
-    os._exit(0)
-
-
-app.add_command('exit', cmd_close_protocol, 'Closes the app.')
-# also sets this function to run when the app is closed
-
-app.set_close_protocol(cmd_close_protocol)
-
-
-# ----------------------------------------- THREADED LOOP FUNCTIONS ----------------------------------------------------
+        if action == 'system':
+            master_queue.add_message(prompt, "system")
+        else:
+            aiko.add_side_prompt(prompt)
+            app.update_side_prompts_widget()
 
+    side_prompt_server = SidePromptServer(remote_side_prompt, config.get('REMOTE_SIDE_PROMPTING', 'listen_ip'),
+                                          config.getint('REMOTE_SIDE_PROMPTING', 'port'),
+                                          secret=config.get('REMOTE_SIDE_PROMPTING', 'secret'))
 
-def thread_remote_receiver():
-    global running
-    # ------------ Set Up ----------------
-    # server_ip = '26.124.79.180'    # Ulaidh's ID (FOR RCHART TO USE)
-    # server_ip = '26.246.74.120'    # Rchart's ID (FOR ULAIDH TO USE)
-    # port = 5004
-    server_ip = config.get('REMOTE_SIDE_PROMPTING', 'server_ip')
-    port = config.getint('REMOTE_SIDE_PROMPTING', 'port')
-    # ------------------------------------
+    # ----------------------------------------- THREADED LOOP FUNCTIONS ------------------------------------------------
 
-    while running:
+    def thread_speech_recognition():
+        username = config.get('GENERAL', 'username')
 
-        try:
-            # ------- TCP IP protocol -------
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((server_ip, port))
-            msg = s.recv(1024)
-            # -------------------------------
+        def parse_event(evt):
+            event = str(evt)
 
-            message = msg.decode()[:-1]
-            completion_option_selected = msg.decode()[-1]
-            app.print_to_cmdl(
-                f'Remote side prompt received with the option {completion_option_selected}: {message}'
-                )
+            keyword = 'text="'
+            stt_start = event.index(keyword)
+            stt_end = event.index('",')
 
-            if completion_option_selected == '1':
-                master_queue.add_message(message, "system")
+            message = event[stt_start + len(keyword):stt_end]
 
-            elif completion_option_selected == '2':
-                aiko.add_side_prompt(message)
-                app.update_side_prompts_widget()
+            if message != '':
+                master_queue.add_message(f'{username}: {message}', "mic")
+                app.print_to_cmdl(f'Added mic message to queue: {message}')
 
-            else:
-                app.print_to_cmdl('Remote side prompt received but something went wrong. Side prompt ABORTED!')
+        # creates recognizer object for speech recognition
+        recognizer = Recognizer()
 
-            # disconnect the client
-            s.close()
-        except:
-            pass
+        mute_event.wait()
+        mute_event.clear()
+        # print('\nEnabled speech recognition.\n')
         sleep(0.1)
 
+        recognizer.start(parse_event, mute_event)
 
-def thread_speech_recognition():
-    username = config.get('GENERAL', 'username')
-
-    def parse_event(evt):
-        event = str(evt)
-
-        keyword = 'text="'
-        stt_start = event.index(keyword)
-        stt_end = event.index('",')
-
-        message = event[stt_start + len(keyword):stt_end]
-
-        if message != '':
-            master_queue.add_message(f'{username}: {message}', "mic")
-            app.print_to_cmdl(f'Added mic message to queue: {message}')
-
-    # creates recognizer object for speech recognition
-    recognizer = Recognizer()
-
-    mute_event.wait()
-    mute_event.clear()
-    # print('\nEnabled speech recognition.\n')
-    sleep(0.1)
+    # ------------------------------------------------------------------------------------------------------------------
 
-    recognizer.start(parse_event, mute_event)
+    orchestrator.start()
 
-# ----------------------------------------------------------------------------------------------------------------------
+    # dumping stats is disabled if the interval is 0
+    if stats_dump_interval > 0:
+        default_scheduler().schedule(stats_dump_interval, dump_stats)
 
+    try:
+        side_prompt_address = side_prompt_server.start()
+        app.print_to_cmdl(f'Listening for remote side prompts on port {side_prompt_address[1]}.')
+    except OSError as e:
+        app.print_to_cmdl(f"Couldn't start the remote side prompt server: {e}")
 
-platform = config.get('LIVESTREAM', 'platform').lower()
+    Thread(target=thread_speech_recognition).start()
 
-chat_loop.start()
-answer_loops.start()
+    # Thread(target=thread_silence_breaker).start()
+    # Thread(target=thread_talk).start()
+    app.print_to_cmdl('All threads started.')
+    app.print_to_cmdl(f'Running AILiveGUI build {build}. Type "help" to see commands.')
+    app.run()
 
-Thread(target=thread_remote_receiver).start()
-Thread(target=thread_speech_recognition).start()
 
-# Thread(target=thread_silence_breaker).start()
-# Thread(target=thread_talk).start()
-app.print_to_cmdl('All threads started.')
-app.print_to_cmdl(f'Running AILiveGUI build {build}. Type "help" to see commands.')
-app.run()
+if __name__ == '__main__':
+    main()
@@ -3,82 +3,184 @@ RemoteSP.py
 
 
 Script that allows to send side prompts remotely to the person who is running the main script.
-This one works as a sever in the TCP IP connection
+This one works as a client: it connects to the side prompt server started by Livestream.py and stays connected,
+sending each side prompt as a line of JSON and waiting for it to be acknowledged.
+
+usage:
+	python RemoteSP.py [server_ip] [--port PORT] [--name NAME] [--secret SECRET]
+
+	server_ip, port and secret default to the REMOTE_SIDE_PROMPTING section of AIkoPrefs.ini, if there is one.
+	The streamer's listen_ip must be set to an address reachable by the operator (it only accepts local connections
+	by default).
 
 requirements:
 	- Radmin VPN (It is necessary to do the TCP IP connection with an emulated LAN)
 
+changelog:
+
+002:
+	- Now a client of Livestream.py's side prompt server, over a single persistent connection, instead of listening
+	again for every message. Prompts are no longer cut at 1024 bytes, and each one is acknowledged by the server.
+003:
+	- Sends the server's shared secret, if one is given, when connecting.
+
+004:
+	- send() no longer raises if reconnecting fails or the server refuses the hello. It returns a failed reply instead.
 '''
 
 # ------------ Imports ---------------
 
+import json
 import socket
+import argparse
+from time import sleep
+from configparser import ConfigParser
 
 # ------------------------------------
 
 
+# options and the server action they map to
+actions = {'1': 'system', '2': 'side_prompt'}
+
+
+class SidePromptClient:
+	"""
+	Persistent connection to a side prompt server. Reconnects whenever the connection is lost.
+
+	Parameters:
+		host (str): The server's address.
+		port (int): The server's port.
+		operator (str): Name shown to the streamer along with each prompt.
+		timeout (float): Seconds to wait for each acknowledgement.
+		secret (str): The server's shared secret, if it has one.
+	"""
+	def __init__(self, host: str, port: int, operator: str = '', timeout: float = 10.0, secret: str = ''):
+		self.host = host
+		self.port = port
+		self.operator = operator
+		self.timeout = timeout
+		self.secret = secret
+
+		self.__socket = None
+		self.__replies = None
+		self.__next_id = 0
+
+	def connect(self):
+		"""
+		Connects to the server, retrying until it succeeds. Raises PermissionError if the server refuses the secret.
+		"""
+		while True:
+			try:
+				self.__socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+				self.__replies = self.__socket.makefile('rb')
+				break
+			except OSError as e:
+				print(f'Could not connect to {self.host}:{self.port} ({e}). Retrying...')
+				sleep(2)
+
+		if self.operator or self.secret:
+			reply = self.__request({'action': 'hello', 'operator': self.operator, 'secret': self.secret})
+			if not reply['ok']:
+				self.close()
+				raise PermissionError(reply['error'])
+
+	def close(self):
+		if self.__socket is not None:
+			self.__socket.close()
+			self.__socket = None
+
+	def __request(self, request: dict):
+		self.__next_id += 1
+		request['id'] = self.__next_id
+
+		self.__socket.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+		# replies come in the same order as requests
+		line = self.__replies.readline()
+		if not line:
+			raise ConnectionError('The server closed the connection.')
+
+		reply = json.loads(line)
+		if reply.get('id') is None:
+			# the server couldn't read the request (EG, it was too long), and closes the connection after replying
+			self.close()
+			return reply
+		if reply.get('id') != request['id']:
+			raise ConnectionError('Got a reply to a different request.')
+		return reply
+
+	def send(self, action: str, prompt: str):
+		"""
+		Sends a prompt and waits for the server to acknowledge it. Reconnects and tries once more if the connection
+		was lost.
+
+		Returns:
+			dict: The server's reply, with an ok key (and an error key if the prompt was refused).
+		"""
+		for attempt in range(2):
+			try:
+				if self.__socket is None:
+					self.connect()
+				return self.__request({'action': action, 'prompt': prompt})
+			except PermissionError as e:
+				# the server refused the hello (e.g. its secret changed), so trying again won't help
+				return {'ok': False, 'error': str(e)}
+			except (OSError, ValueError) as e:
+				# ConnectionError and socket timeouts are OSErrors, malformed replies are ValueErrors
+				self.close()
+				if attempt == 1:
+					return {'ok': False, 'error': str(e)}
+				print(f'Lost connection to the server ({e}). Reconnecting...')
+
+
+if __name__ == '__main__':
+	# ------------ Set Up ----------------
+	config = ConfigParser()
+	config.read('AIkoPrefs.ini')
+
+	parser = argparse.ArgumentParser(description='Sends side prompts to a character streaming on Livestream.py.')
+	parser.add_argument('server_ip', nargs='?', default=config.get('REMOTE_SIDE_PROMPTING', 'server_ip', fallback=''))
+	parser.add_argument('--port', type=int, default=config.getint('REMOTE_SIDE_PROMPTING', 'port', fallback=5004))
+	parser.add_argument('--name', default=socket.gethostname(), help='Name shown to the streamer.')
+	parser.add_argument('--secret', default=config.get('REMOTE_SIDE_PROMPTING', 'secret', fallback=''),
+						help="The streamer's shared secret.")
+	args = parser.parse_args()
+
+	if not args.server_ip:
+		parser.error('server_ip is required when AIkoPrefs.ini does not set it.')
+
+	client = SidePromptClient(args.server_ip, args.port, args.name, secret=args.secret)
+	try:
+		client.connect()
+	except PermissionError as e:
+		parser.exit(1, f'The server refused the connection: {e}\n')
+	print(f'Connected to {args.server_ip}:{args.port}.')
+	# ------------------------------------
 
-# ------------ Set Up ----------------
-  
-# take the server name and port name
-port = 5004
-
-# ------------------------------------
-
-
-while True:
-	print()
-	sideprompt = input('Write a side prompt to send: ')
-
-	print()
-	print('Please select one option to send the prompt:')
-	print('1 - Generate completion immediately')
-	print('2 - Add the message as extra information to the next user message')
-	print('3 - Abort message')
-
-	user_option = input('option: ')
 	while True:
-		if (user_option == '1') or (user_option == '2') or (user_option == '3'):
-			break
 		print()
-		print("That's not a valid option you moron, try again!")
-		user_option = input('option: ')
-
-	if user_option == '3':
-		print('Message deleted!')
-		continue
+		sideprompt = input('Write a side prompt to send: ')
 
+		print()
+		print('Please select one option to send the prompt:')
+		print('1 - Generate completion immediately')
+		print('2 - Add the message as extra information to the next user message')
+		print('3 - Abort message')
 
-	# -------- TCP IP set up --------
-	# create a socket at server side
-	# using TCP / IP protocol
-	s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-	# bind the socket with server
-	# and port number
-	s.bind(('0.0.0.0', port))
-
-	# allow maximum 1 connection to
-	# the socket
-	s.listen(1)
-
-	# wait till a client accept
-	# connection
-	c, addr = s.accept()
-
-	# display client address
-	#print("CONNECTION FROM:", str(addr))
-	# -------------------------------
-
-
-	# send message to the client after
-	# encoding into binary string
-
-	message = sideprompt + user_option
-	c.send(message.encode())
-
-	print('Message successfully sent!')
-	
-	# disconnect the server
-	c.close()
-
+		user_option = input('option: ')
+		while True:
+			if (user_option == '1') or (user_option == '2') or (user_option == '3'):
+				break
+			print()
+			print("That's not a valid option you moron, try again!")
+			user_option = input('option: ')
+
+		if user_option == '3':
+			print('Message deleted!')
+			continue
+
+		reply = client.send(actions[user_option], sideprompt)
+		if reply['ok']:
+			print('Message successfully sent!')
+		else:
+			print(f'Message was not delivered: {reply["error"]}')